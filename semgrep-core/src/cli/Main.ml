@@ -195,6 +195,8 @@ let ncores = ref 1
 
 (* path to cache (given by semgrep-python) *)
 let use_parsing_cache = ref ""
+(* whether the cache is kept across runs, where files may change *)
+let persistent_parsing_cache = ref false
 (* take the list of files in a file (given by semgrep-python) *)
 let target_file = ref ""
 
@@ -343,16 +345,13 @@ let xlang_files_of_dirs_or_files xlang files_or_dirs =
 (* Caching *)
 (*****************************************************************************)
 
-let filemtime file =
-  (Unix.stat file).Unix.st_mtime
-
 (* The function below is mostly a copy-paste of Common.cache_computation.
  * This function is slightly more flexible because we can put the cache file
  * anywhere thanks to the argument 'cache_file_of_file'.
  * We also try to be a bit more type-safe by using the version tag above.
  * TODO: merge in pfff/commons/Common.ml at some point
 *)
-let cache_computation file cache_file_of_file f =
+let cache_computation ?(cacheable=(fun _ -> true)) file cache_file_of_file f =
   if !use_parsing_cache=""
   then f ()
   else begin
@@ -364,8 +363,11 @@ let cache_computation file cache_file_of_file f =
     end else begin
       Common.profile_code "Main.cache_computation" (fun () ->
 
+        (* the name of a cache file kept across runs depends on the content
+         * of the file (see parse_generic), so there is no need to compare
+         * mtimes *)
         let file_cache = cache_file_of_file file in
-        if Sys.file_exists file_cache && filemtime file_cache >= filemtime file
+        if Sys.file_exists file_cache
         then begin
           logger#info "using cache: %s" file_cache;
           let (version, file2, res) = Common2.get_value file_cache in
@@ -376,12 +378,21 @@ let cache_computation file cache_file_of_file f =
           then failwith (spf
                            "Not the same file! Md5sum collision! Clean the cache file %s"
                            file_cache);
-
+          (* semgrep-python evicts the least recently used cache files from
+           * a persistent cache, so mark this one as used *)
+          (try Unix.utimes file_cache 0.0 0.0 with Unix.Unix_error _ -> ());
           res
         end
         else begin
           let res = f () in
-          Common2.write_value (Version.version, file, res) file_cache;
+          if cacheable res
+          then begin
+            (* several semgrep-core processes can share the same cache, so
+             * never let them see a partially written file *)
+            let tmp_cache = spf "%s.%d.tmp" file_cache (Unix.getpid ()) in
+            Common2.write_value (Version.version, file, res) tmp_cache;
+            Unix.rename tmp_cache file_cache
+          end;
           res
         end
       )
@@ -397,6 +408,18 @@ let cache_file_of_file filename =
   let md5 = Digest.string filename in
   Filename.concat dir (spf "%s.ast_cache" (Digest.to_hex md5))
 
+(* The digest of each file, computed once per process even when the file is
+ * parsed for several languages *)
+let file_digests = Hashtbl.create 101
+
+let file_digest file =
+  match Hashtbl.find_opt file_digests file with
+  | Some digest -> digest
+  | None ->
+      let digest = Digest.to_hex (Digest.file file) in
+      Hashtbl.add file_digests file digest;
+      digest
+
 (*****************************************************************************)
 (* Timeout *)
 (*****************************************************************************)
@@ -514,14 +537,31 @@ let parse_generic lang file =
   (*e: [[Main_semgrep_core.parse_generic()]] use standard macros if parsing C *)
 
   let v =
-    cache_computation file (fun file ->
+    (* a parse can time out because the machine is busy, and the timeout is
+     * not part of the key, so only the per-run cache remembers timeouts *)
+    let cacheable = function
+      | Left _ -> true
+      | Right _ -> not !persistent_parsing_cache
+    in
+    cache_computation ~cacheable file (fun file ->
       (* we may use different parsers for the same file (e.g., in Python3 or
        * Python2 mode), so put the lang as part of the cache "dependency".
        * We also add ast_version here so bumping the version will not
        * try to use the old cache file (which should generate an exception).
+       * The filename must stay in the key, because the tokens of the AST
+       * record it, and matches report it.
+       * Finally, a cache kept across runs adds the digest of the content of
+       * the file, so that it survives a fresh checkout of unchanged files.
+       * Files do not change during a run, so a per-run cache does not need
+       * to read them twice.
       *)
-      let full_filename = spf "%s__%s__%s"
-          file (Lang.string_of_lang lang) Version.version
+      let digest =
+        if !persistent_parsing_cache
+        then file_digest file
+        else ""
+      in
+      let full_filename = spf "%s__%s__%s__%s"
+          file (Lang.string_of_lang lang) Version.version digest
       in
       cache_file_of_file full_filename)
       (fun () ->
@@ -1323,6 +1363,9 @@ let options () =
     "-use_parsing_cache", Arg.Set_string use_parsing_cache,
     " <dir> save and use parsed ASTs in a cache at given directory.
     It is the caller's responsiblity to clear the cache";
+    "-persistent_parsing_cache", Arg.Set persistent_parsing_cache,
+    " the cache of -use_parsing_cache is kept across runs, so key it on the
+    content of the files too";
 
     "-filter_irrelevant_patterns", Arg.Set Flag.filter_irrelevant_patterns,
     " filter patterns not containing any strings in target file";
@@ -72,8 +72,7 @@ let metavar_of_json s = function
   | _ -> failwith (spf "wrong format for metavar %s" s)
 
 (* JSON format used internally in semgrep-python for metavariable-comparison *)
-let parse_json file =
-  let json = JSON.load_json file in
+let parse_request json =
   match json with
   | J.Object xs ->
       (match Common.sort_by_key_lowfirst xs with
@@ -100,6 +99,10 @@ let parse_json file =
       )
   | _ -> failwith "wrong json format"
 
+let parse_json file =
+  let json = JSON.load_json file in
+  parse_request json
+
 (*****************************************************************************)
 (* Converting *)
 (*****************************************************************************)
@@ -241,18 +244,33 @@ and eval_op op values code =
 (* This is when called from the semgrep Python wrapper for the
  * metavariable-comparison: condition.
 *)
-let eval_json_file file =
+let eval_request json =
   try
-    let (env, code) = parse_json file in
-    let res = eval env code in
-    print_result (Some res)
+    let (env, code) = parse_request json in
+    Some (eval env code)
   with
   | NotHandled e ->
       logger#sdebug (G.show_any (G.E e));
-      print_result None
+      None
   | exn ->
       logger#debug "exn: %s" (Common.exn_to_s exn);
-      print_result None
+      None
+
+(* semgrep-python can also send an array of requests, to evaluate all the
+ * comparisons of a rule on a file at once. The results are then printed
+ * as an array of true, false, or null when a request could not be evaluated.
+*)
+let json_of_result = function
+  | Some (Bool b) -> J.Bool b
+  | Some (Int i) -> J.Bool (i <> 0)
+  | _ -> J.Null
+
+let eval_json_file file =
+  match JSON.load_json file with
+  | J.Array xs ->
+      let results = xs |> List.map (fun x -> json_of_result (eval_request x)) in
+      pr (J.string_of_json (J.Array results))
+  | json -> print_result (eval_request json)
 
 (* for testing purpose *)
 let test_eval file =
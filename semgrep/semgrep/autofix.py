@@ -9,6 +9,7 @@ from typing import Tuple
 from semgrep.error import SemgrepError
 from semgrep.rule import Rule
 from semgrep.rule_match import RuleMatch
+from semgrep.source_cache import source_cache
 
 logger = logging.getLogger(__name__)
 
@@ -22,7 +23,7 @@ class Fix:
 
 
 def _get_lines(path: Path) -> List[str]:
-    contents = path.read_text()
+    contents = source_cache.read_text(path)
     lines = contents.split(SPLIT_CHAR)
     return lines
 
@@ -81,6 +82,8 @@ def _regex_replace(
 
 
 def _write_contents(path: Path, contents: str) -> None:
+    # the cache may map the file, so let it go before truncating the file
+    source_cache.invalidate(path)
     path.write_text(contents)
 
 
@@ -3,6 +3,7 @@ import argparse
 import logging
 import multiprocessing
 import os
+from pathlib import Path
 
 import semgrep.config_resolver
 import semgrep.semgrep_main
@@ -11,16 +12,19 @@ from semgrep import __VERSION__
 from semgrep.constants import DEFAULT_CONFIG_FILE
 from semgrep.constants import DEFAULT_MAX_CHARS_PER_LINE
 from semgrep.constants import DEFAULT_MAX_LINES_PER_FINDING
+from semgrep.constants import DEFAULT_PARSING_CACHE_MAX_SIZE
 from semgrep.constants import DEFAULT_TIMEOUT
 from semgrep.constants import MAX_CHARS_FLAG_NAME
 from semgrep.constants import MAX_LINES_FLAG_NAME
 from semgrep.constants import OutputFormat
+from semgrep.constants import PARSING_CACHE_DIR_ENV_VAR
 from semgrep.constants import RCE_RULE_FLAG
 from semgrep.constants import SEMGREP_URL
 from semgrep.dump_ast import dump_parsed_ast
 from semgrep.error import SemgrepError
 from semgrep.output import managed_output
 from semgrep.output import OutputSettings
+from semgrep.parsing_cache import ParsingCache
 from semgrep.synthesize_patterns import synthesize_patterns
 from semgrep.target_manager import optional_stdin_target
 from semgrep.version import is_running_latest
@@ -103,6 +107,28 @@ def cli() -> None:
         default="none",
         help="Turn on/off optimizations. Default = 'none'. Use 'all' to turn all optimizations on.",
     )
+    config.add_argument(
+        "--batch-rules",
+        action="store_true",
+        help=(
+            "Run all search-mode rules of a language in a single semgrep-core "
+            "invocation instead of one invocation per rule. Rules in taint mode, "
+            "rules with equivalences and generic or regex-only rules still run "
+            "one at a time. The limits of --timeout and --max-memory then apply "
+            "to all the rules of a batch together on each file, and an error of "
+            "semgrep-core on a file, e.g. a timeout, is reported once for the "
+            "batch, under the first rule run on the file."
+        ),
+    )
+    config.add_argument(
+        "--no-prefilter",
+        action="store_true",
+        help=(
+            "Run every rule on all its files. By default, a rule is not run on "
+            "the files that do not contain the identifiers its patterns require, "
+            "so errors, e.g. parse errors, are not reported for these files."
+        ),
+    )
 
     parser.add_argument(
         "--exclude",
@@ -170,6 +196,17 @@ def cli() -> None:
         ),
     )
 
+    config.add_argument(
+        "--parallel-rules",
+        action="store",
+        type=int,
+        default=1,
+        help=(
+            "Number of rules (or batches of rules with --batch-rules) to run "
+            "concurrently, each in its own semgrep-core process. Defaults to 1."
+        ),
+    )
+
     config.add_argument(
         "--timeout",
         type=int,
@@ -199,6 +236,57 @@ def cli() -> None:
         ),
     )
 
+    config.add_argument(
+        "--parsing-cache-dir",
+        type=Path,
+        default=os.environ.get(PARSING_CACHE_DIR_ENV_VAR),
+        help=(
+            "Keep the ASTs parsed by semgrep-core in this directory so that "
+            "unchanged files are not parsed again on the next run. Defaults to "
+            f"the value of ${PARSING_CACHE_DIR_ENV_VAR}, if set, else ASTs are "
+            "cached for the current run only."
+        ),
+    )
+
+    config.add_argument(
+        "--baseline-ref",
+        help=(
+            "Only scan files added or modified since this git ref, including "
+            "uncommitted changes."
+        ),
+    )
+
+    config.add_argument(
+        "--baseline-changed-lines",
+        action="store_true",
+        help=(
+            "Together with --baseline-ref, only report findings on lines added "
+            "or modified since the baseline ref, or next to lines deleted since then."
+        ),
+    )
+
+    config.add_argument(
+        "--incremental-cache",
+        type=Path,
+        help=(
+            "Store the results of each rule on each file in this file, and "
+            "reuse them on the next run for the rules and files that did not "
+            "change."
+        ),
+    )
+
+    config.add_argument(
+        "--parsing-cache-max-size",
+        type=int,
+        default=DEFAULT_PARSING_CACHE_MAX_SIZE // (1024 * 1024),
+        help=(
+            "Maximum size of the --parsing-cache-dir in MB. The least recently "
+            "used ASTs are deleted once it is exceeded. Defaults to {} MB.".format(
+                DEFAULT_PARSING_CACHE_MAX_SIZE // (1024 * 1024)
+            )
+        ),
+    )
+
     config.add_argument(
         "--severity",
         action="append",
@@ -360,6 +448,12 @@ def cli() -> None:
         "--version", action="store_true", help="Show the version and exit."
     )
 
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        help="Delete the contents of the --parsing-cache-dir and exit.",
+    )
+
     parser.add_argument(
         "--force-color",
         action="store_true",
@@ -404,6 +498,9 @@ def cli() -> None:
     if args.dump_ast and not args.lang:
         parser.error("--dump-ast and -l/--lang must both be specified")
 
+    if args.baseline_changed_lines and not args.baseline_ref:
+        parser.error("--baseline-changed-lines requires --baseline-ref")
+
     output_time = args.time or args.json_time
 
     # set the flags
@@ -453,13 +550,28 @@ def cli() -> None:
         # uses managed_output internally
         semgrep.test.test_main(args)
 
+    parsing_cache = (
+        ParsingCache(
+            args.parsing_cache_dir,
+            max_size=args.parsing_cache_max_size * 1024 * 1024,
+        )
+        if args.parsing_cache_dir is not None
+        else None
+    )
+
     # The 'optional_stdin_target' context manager must remain before
     # 'managed_output'. Output depends on file contents so we cannot have
     # already deleted the temporary stdin file.
     with optional_stdin_target(args.target) as target, managed_output(
         output_settings
     ) as output_handler:
-        if args.dump_ast:
+        if args.clear_cache:
+            if parsing_cache is None:
+                raise SemgrepError(
+                    f"--clear-cache requires --parsing-cache-dir or ${PARSING_CACHE_DIR_ENV_VAR}"
+                )
+            parsing_cache.clear()
+        elif args.dump_ast:
             dump_parsed_ast(args.json, args.lang, args.pattern, target)
         elif args.synthesize_patterns:
             synthesize_patterns(args.lang, args.synthesize_patterns, target)
@@ -489,6 +601,7 @@ def cli() -> None:
                 configs=args.config,
                 no_rewrite_rule_ids=args.no_rewrite_rule_ids,
                 jobs=args.jobs,
+                parallel_rules=args.parallel_rules,
                 include=args.include,
                 exclude=args.exclude,
                 strict=args.strict,
@@ -504,4 +617,10 @@ def cli() -> None:
                 severity=args.severity,
                 report_time=output_time,
                 optimizations=args.optimizations,
+                batch_rules=args.batch_rules,
+                prefilter=not args.no_prefilter,
+                parsing_cache=parsing_cache,
+                incremental_cache=args.incremental_cache,
+                baseline_ref=args.baseline_ref,
+                baseline_changed_lines=args.baseline_changed_lines,
             )
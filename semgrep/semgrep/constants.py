@@ -18,6 +18,11 @@ DEFAULT_CONFIG_FOLDER = f".{DEFAULT_SEMGREP_CONFIG_NAME}"
 
 DEFAULT_TIMEOUT = 30  # seconds
 
+PARSING_CACHE_DIR_ENV_VAR = "SEMGREP_PARSING_CACHE_DIR"
+DEFAULT_PARSING_CACHE_MAX_SIZE = 1024 * 1024 * 1024  # bytes
+DEFAULT_SOURCE_CACHE_MAX_SIZE = 256 * 1024 * 1024  # bytes
+DEFAULT_SOURCE_CACHE_MMAP_MIN_SIZE = 1024 * 1024  # bytes
+
 SEMGREP_USER_AGENT = f"Semgrep/{__VERSION__}"
 SEMGREP_USER_AGENT_APPEND = os.environ.get("SEMGREP_USER_AGENT_APPEND")
 if SEMGREP_USER_AGENT_APPEND is not None:
@@ -1,21 +1,19 @@
 import collections
-import functools
-import json
 import logging
-import re
 import subprocess
 import tempfile
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from multiprocessing import pool
 from pathlib import Path
 from typing import Any
-from typing import cast
+from typing import Deque
 from typing import Dict
+from typing import FrozenSet
 from typing import IO
 from typing import Iterator
 from typing import List
 from typing import Optional
-from typing import Pattern as TPattern
 from typing import Sequence
 from typing import Set
 from typing import Tuple
@@ -27,23 +25,42 @@ from semgrep.core_exception import CoreException
 from semgrep.equivalences import Equivalence
 from semgrep.error import _UnknownLanguageError
 from semgrep.error import InvalidPatternError
+from semgrep.error import LexicalError
 from semgrep.error import MatchTimeoutError
+from semgrep.error import OutOfMemoryError
 from semgrep.error import SemgrepError
+from semgrep.error import SourceParseError
+from semgrep.error import TooManyMatchesError
 from semgrep.error import UnknownLanguageError
 from semgrep.evaluation import enumerate_patterns_in_boolean_expression
 from semgrep.evaluation import evaluate
+from semgrep.evaluation import group_pattern_matches
+from semgrep.json_stream import JSONStreamError
+from semgrep.json_stream import load_object
+from semgrep.literal_prefilter import required_words
+from semgrep.literal_prefilter import Requirement
+from semgrep.literal_prefilter import satisfies
+from semgrep.literal_prefilter import target_words
+from semgrep.parsing_cache import parsing_cache_directory
+from semgrep.parsing_cache import ParsingCache
 from semgrep.pattern import Pattern
 from semgrep.pattern_match import PatternMatch
 from semgrep.profile_manager import ProfileManager
 from semgrep.profiling import ProfilingData
 from semgrep.profiling import Times
+from semgrep.regex_scanner import RegexMatch
+from semgrep.regex_scanner import scan_targets
+from semgrep.result_cache import ResultCache
 from semgrep.rule import Rule
 from semgrep.rule_match import RuleMatch
 from semgrep.semgrep_types import BooleanRuleExpression
 from semgrep.semgrep_types import Language
 from semgrep.semgrep_types import OPERATORS
+from semgrep.semgrep_types import PatternId
 from semgrep.semgrep_types import TAINT_MODE
 from semgrep.spacegrep import run_spacegrep
+from semgrep.target_file_cache import target_file_cache
+from semgrep.target_file_cache import TargetFileCache
 from semgrep.target_manager import TargetManager
 from semgrep.target_manager_extensions import all_supported_languages
 from semgrep.target_manager_extensions import GENERIC_LANGUAGES
@@ -52,55 +69,27 @@ from semgrep.util import debug_tqdm_write
 from semgrep.util import partition
 from semgrep.util import progress_bar
 from semgrep.util import SEMGREP_PATH
-from semgrep.util import sub_run
+from semgrep.util import sub_popen
 
 logger = logging.getLogger(__name__)
 
-
-def _offset_to_line_no(offset: int, buff: str) -> int:
-    """
-    Given string buffer return one indexed line number associated with byte offset
-    """
-    return buff.count("\n", 0, offset) + 1
+# the pattern-regex and pattern-not-regex matches of each rule, by language
+RegexPatternMatches = Dict[
+    Tuple[Rule, Language], List[Tuple[PatternId, Path, RegexMatch]]
+]
 
 
-def _offset_to_col_no(offset: int, buff: str) -> int:
+def _error_path(error: SemgrepError) -> Optional[Path]:
     """
-    Return one indexed col number associated with byte offset
+    Return the target file an error from semgrep-core is about, if any
     """
-    return offset - buff.rfind("\n", 0, offset)
-
-
-def get_re_matches(
-    patterns_re: Sequence[Tuple[Any, TPattern[Any]]], path: Path
-) -> List[PatternMatch]:
-    try:
-        contents = path.read_text()
-    except UnicodeDecodeError:
-        logger.debug(f"regex matcher skipping binary file at {path}")
-        return []
-
-    return [
-        PatternMatch(
-            {
-                "check_id": pattern_id,
-                "path": str(path),
-                "start": {
-                    "offset": match.start(),
-                    "line": _offset_to_line_no(match.start(), contents),
-                    "col": _offset_to_col_no(match.start(), contents),
-                },
-                "end": {
-                    "offset": match.end(),
-                    "line": _offset_to_line_no(match.end(), contents),
-                    "col": _offset_to_col_no(match.end(), contents),
-                },
-                "extra": {},
-            }
-        )
-        for pattern_id, pattern in patterns_re
-        for match in re.finditer(pattern, contents)
-    ]
+    if isinstance(
+        error, (MatchTimeoutError, OutOfMemoryError, TooManyMatchesError, LexicalError)
+    ):
+        return error.path
+    if isinstance(error, SourceParseError) and error.spans and error.spans[0].file:
+        return Path(error.spans[0].file)
+    return None
 
 
 class CoreRunner:
@@ -118,6 +107,12 @@ class CoreRunner:
         max_memory: int,
         timeout_threshold: int,
         report_time: bool,
+        batch_rules: bool = False,
+        parallel_rules: int = 1,
+        prefilter: bool = True,
+        parsing_cache: Optional[ParsingCache] = None,
+        result_cache: Optional[ResultCache] = None,
+        debug: bool = False,
     ):
         self._allow_exec = allow_exec
         self._jobs = jobs
@@ -125,6 +120,13 @@ class CoreRunner:
         self._max_memory = max_memory
         self._timeout_threshold = timeout_threshold
         self._report_time = report_time
+        self._batch_rules = batch_rules
+        self._parallel_rules = parallel_rules
+        self._prefilter = prefilter
+        self._parsing_cache = parsing_cache
+        self._result_cache = result_cache
+        # whether to keep the evaluation steps of rules, for --debugging-json
+        self._debug = debug
 
     def _flatten_rule_patterns(self, rules: List[Rule]) -> Iterator[Pattern]:
         """
@@ -210,25 +212,27 @@ class CoreRunner:
         self,
         patterns_json: List[Any],
         patterns: List[Pattern],
-        targets: List[Path],
+        targets: Sequence[Path],
         language: Language,
-        rule: Rule,
+        rule: Optional[Rule],
         rules_file_flag: str,
         cache_dir: str,
+        target_files: TargetFileCache,
         report_time: bool,
+        pruned: FrozenSet[Path] = frozenset(),
     ) -> dict:
+        """
+        Run semgrep-core once on TARGETS but PRUNED with PATTERNS
+
+        RULE is None when PATTERNS come from a batch of several rules, see
+        _run_batch.
+        """
         with tempfile.NamedTemporaryFile(
             "w"
-        ) as pattern_file, tempfile.NamedTemporaryFile(
-            "w"
-        ) as target_file, tempfile.NamedTemporaryFile(
-            "w"
-        ) as equiv_file:
+        ) as pattern_file, tempfile.NamedTemporaryFile("w") as equiv_file:
             yaml = YAML()
             yaml.dump({"rules": patterns_json}, pattern_file)
             pattern_file.flush()
-            target_file.write("\n".join(str(t) for t in targets))
-            target_file.flush()
 
             cmd = [SEMGREP_PATH] + [
                 "-lang",
@@ -239,7 +243,7 @@ class CoreRunner:
                 "-j",
                 str(self._jobs),
                 "-target_file",
-                target_file.name,
+                target_files.path(targets, pruned),
                 "-use_parsing_cache",
                 cache_dir,
                 "-timeout",
@@ -247,8 +251,10 @@ class CoreRunner:
                 "-max_memory",
                 str(self._max_memory),
             ]
+            if self._parsing_cache is not None:
+                cmd += ["-persistent_parsing_cache"]
 
-            equivalences = rule.equivalences
+            equivalences = rule.equivalences if rule is not None else []
             if equivalences:
                 self._write_equivalences_file(equiv_file, equivalences)
                 cmd += ["-equivalences", equiv_file.name]
@@ -256,46 +262,61 @@ class CoreRunner:
             if report_time:
                 cmd += ["-json_time"]
 
-            core_run = sub_run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            logger.debug(core_run.stderr.decode("utf-8", errors="replace"))
-
-            out_bytes = core_run.stdout
-            err_bytes = core_run.stderr
-            returncode = core_run.returncode
+            output_json, returncode = self._stream_core_output(cmd)
             if returncode != 0:
-                output_json = self._parse_core_output(out_bytes, err_bytes, returncode)
-
-                if "error" in output_json:
+                if rule is None:
+                    raise SemgrepError(
+                        f"semgrep-core failed while running a batch of {language} rules:\n{output_json.get('error', 'no error')}"
+                    )
+                elif "error" in output_json:
                     self._raise_semgrep_error_from_json(output_json, patterns, rule)
                 else:
                     raise SemgrepError(
                         f"unexpected json output while invoking semgrep-core with rule '{rule.id}':\n{PLEASE_FILE_ISSUE_TEXT}"
                     )
 
-            output_json = self._parse_core_output(out_bytes, err_bytes, returncode)
-
             return output_json
 
-    def _parse_core_output(
-        self, out_bytes: bytes, err_bytes: bytes, returncode: int
-    ) -> Dict[str, Any]:
-        # see if semgrep output a JSON error that we can decode
-        semgrep_output = out_bytes.decode("utf-8", errors="replace")
-        try:
-            return cast(Dict[str, Any], json.loads(semgrep_output))
-        except ValueError:
-            semgrep_error = err_bytes.decode("utf-8", errors="replace")
+    def _stream_core_output(self, cmd: List[str]) -> Tuple[Dict[str, Any], int]:
+        """
+        Run semgrep-core with CMD and return its JSON output and exit code
+
+        The output is decoded while semgrep-core writes it, and its matches are
+        converted to PatternMatch objects as they arrive, see json_stream. All
+        the matches are returned: semgrep-core does not group them by file, so
+        they are only evaluated once it exits.
+        """
+        # stderr goes to a file so that semgrep-core never blocks on a full
+        # stderr pipe while we read its stdout
+        with tempfile.TemporaryFile() as stderr_file:
+            with sub_popen(
+                cmd, stdout=subprocess.PIPE, stderr=stderr_file
+            ) as core_process:
+                try:
+                    output_json = load_object(
+                        core_process.stdout, {"matches": PatternMatch}
+                    )
+                    stream_error = None
+                except JSONStreamError as ex:
+                    stream_error = ex
+                returncode = core_process.wait()
+            stderr_file.seek(0)
+            semgrep_error = stderr_file.read().decode("utf-8", errors="replace")
+        logger.debug(semgrep_error)
+
+        if stream_error is not None:
             raise SemgrepError(
                 f"semgrep-core exit code: {returncode}\n"
-                f"unexpected non-json output while invoking semgrep-core:\n"
+                f"unexpected non-json output while invoking semgrep-core ({stream_error}):\n"
                 "--- semgrep-core stdout ---\n"
-                f"{semgrep_output}\n"
+                f"{stream_error.rest}\n"
                 "--- end semgrep-core stdout ---\n"
                 "--- semgrep-core stderr ---\n"
                 f"{semgrep_error}\n"
                 "--- end semgrep-core stderr ---\n"
                 f"{PLEASE_FILE_ISSUE_TEXT}"
             )
+        return output_json, returncode
 
     def _add_match_times(
         self,
@@ -317,11 +338,41 @@ class CoreRunner:
                         ),
                     )
 
+    def _add_batch_match_times(
+        self,
+        rules: List[Rule],
+        targets_by_rule: Dict[Rule, Set[Path]],
+        profiling_data: ProfilingData,
+        output_time_json: Dict[str, Any],
+    ) -> None:
+        """
+        Collect the match times reported by a semgrep-core invocation for RULES,
+        split evenly between the rules that were run on each target
+        """
+        for target in output_time_json.get("targets", []):
+            if "match_time" not in target or "path" not in target:
+                continue
+            path = Path(target["path"])
+            target_rules = [rule for rule in rules if path in targets_by_rule[rule]]
+            for rule in target_rules:
+                profiling_data.set_times(
+                    rule.id,
+                    target["path"],
+                    Times(
+                        parse_time=target["parse_time"] / len(target_rules),
+                        match_time=target["match_time"] / len(target_rules),
+                        run_time=target["run_time"] / len(target_rules),
+                    ),
+                )
+
     def _run_rule(
         self,
         rule: Rule,
         target_manager: TargetManager,
         cache_dir: str,
+        target_files: TargetFileCache,
+        regex_matches: RegexPatternMatches,
+        pruned_targets: Dict[Rule, FrozenSet[Path]],
         max_timeout_files: List[Path],
         profiler: ProfileManager,
         profiling_data: ProfilingData,
@@ -338,9 +389,16 @@ class CoreRunner:
         ).items():
 
             targets = self.get_files_for_language(language, rule, target_manager)
-            targets = [target for target in targets if target not in max_timeout_files]
+            if max_timeout_files:
+                # keep the shared list of targets otherwise, see TargetFileCache
+                targets = [
+                    target for target in targets if target not in max_timeout_files
+                ]
             all_targets = all_targets.union(targets)
-            if not targets:
+            # the pruned targets are left out of the target file, which rules
+            # with the same targets and pruned targets share
+            pruned = pruned_targets.get(rule, frozenset())
+            if all(target in pruned for target in targets):
                 continue
 
             if rule.mode == TAINT_MODE:
@@ -360,7 +418,9 @@ class CoreRunner:
                     rule,
                     "-tainting_rules_file",
                     cache_dir,
+                    target_files,
                     report_time=self._report_time,
+                    pruned=pruned,
                 )
             else:
                 # semgrep-core doesn't know about OPERATORS.REGEX - this is
@@ -373,7 +433,11 @@ class CoreRunner:
                     all_patterns_for_language,
                 )
                 if patterns_regex:
-                    self.handle_regex_patterns(outputs, patterns_regex, targets)
+                    outputs.extend(
+                        self._regex_pattern_matches(
+                            regex_matches, rule, 0, language, max_timeout_files
+                        )
+                    )
 
                 # regex-only rules only support OPERATORS.REGEX.
                 # Skip passing this rule to semgrep-core.
@@ -402,10 +466,13 @@ class CoreRunner:
                         run_spacegrep,
                         rule.id,
                         patterns,
-                        targets,
+                        [target for target in targets if target not in pruned],
                         timeout=self._timeout,
                         report_time=self._report_time,
                     )
+                    output_json["matches"] = [
+                        PatternMatch(m) for m in output_json["matches"]
+                    ]
                 else:  # Run semgrep-core
                     output_json = profiler.track(
                         rule.id,
@@ -417,81 +484,466 @@ class CoreRunner:
                         rule,
                         "-rules_file",
                         cache_dir,
+                        target_files,
                         report_time=self._report_time,
+                        pruned=pruned,
                     )
 
             errors.extend(
-                CoreException.from_json(e, language, rule.id).into_semgrep_error()
-                for e in output_json["errors"]
+                self._core_error(e, language, rule) for e in output_json["errors"]
             )
-            outputs.extend(PatternMatch(m) for m in output_json["matches"])
+            outputs.extend(output_json["matches"])
             if "time" in output_json:
                 self._add_match_times(rule, profiling_data, output_json["time"])
 
-        # group output; we want to see all of the same rule ids on the same file path
-        by_rule_index: Dict[
-            Rule, Dict[Path, List[PatternMatch]]
-        ] = collections.defaultdict(lambda: collections.defaultdict(list))
+        findings, debugging_steps = self._evaluate_rule(rule, outputs)
+        logger.debug(f"...ran on {len(all_targets)} files")
 
-        for pattern_match in outputs:
-            by_rule_index[rule][pattern_match.path].append(pattern_match)
+        return findings, debugging_steps, errors, all_targets
 
+    def _evaluate_rule(
+        self, rule: Rule, outputs: List[PatternMatch]
+    ) -> Tuple[List[RuleMatch], List[Dict[str, Any]]]:
+        """
+        Evaluate the boolean expression of RULE on the pattern matches it produced
+        """
+        # group output; we want to see all of the same rule ids on the same file path
         findings = []
         debugging_steps: List[Any] = []
-        for rule, paths in by_rule_index.items():
-            for filepath, pattern_matches in paths.items():
-                logger.debug(
-                    f"--> rule ({rule.id}) has findings on filepath: {filepath}"
+        for filepath, file_matches in group_pattern_matches(outputs).items():
+            logger.debug(f"--> rule ({rule.id}) has findings on filepath: {filepath}")
+
+            findings_for_rule, debugging_steps = evaluate(
+                rule, file_matches, self._allow_exec, debug=self._debug
+            )
+            findings.extend(findings_for_rule)
+
+        # debugging steps are only tracked for a single file, just overwrite
+        return dedup_output(findings), debugging_steps
+
+    @staticmethod
+    def _can_batch_rule(rule: Rule) -> bool:
+        """
+        Whether RULE can share a semgrep-core invocation with other rules
+
+        Taint rules and rules with equivalences need their own rules file, and
+        spacegrep and regex-only languages are not run by semgrep-core.
+        """
+        return (
+            rule.mode != TAINT_MODE
+            and not rule.equivalences
+            and not any(
+                language in GENERIC_LANGUAGES or language in REGEX_LANGUAGES
+                for language in rule.languages
+            )
+        )
+
+    def _run_batch(
+        self,
+        language: Language,
+        rules: List[Rule],
+        target_manager: TargetManager,
+        cache_dir: str,
+        target_files: TargetFileCache,
+        regex_matches: RegexPatternMatches,
+        pruned_targets: Dict[Rule, FrozenSet[Path]],
+        max_timeout_files: List[Path],
+        profiler: ProfileManager,
+        profiling_data: ProfilingData,
+    ) -> Dict[
+        Rule,
+        Tuple[List[RuleMatch], List[Dict[str, Any]], List[SemgrepError], Set[Path]],
+    ]:
+        """
+        Run every rule in RULES on its LANGUAGE targets with a single semgrep-core
+        invocation
+
+        Patterns are tagged with the index of their rule in RULES, so the
+        matches are split back per rule through PatternMatch.rule_index. Each
+        rule only keeps the matches on its own targets, since semgrep-core runs
+        on the union of the targets of all rules.
+
+        If the batched invocation fails, the rules are rerun one at a time so that
+        the resulting error is attributed to the right rule.
+        """
+        outputs: Dict[Rule, List[PatternMatch]] = {rule: [] for rule in rules}
+        errors: Dict[Rule, List[SemgrepError]] = {rule: [] for rule in rules}
+        targets_by_rule: Dict[Rule, Set[Path]] = {}
+        # the targets each rule is run on, without those it cannot match
+        core_targets_by_rule: Dict[Rule, Set[Path]] = {}
+        all_targets: Set[Path] = set()
+
+        for rule in rules:
+            targets = self.get_files_for_language(language, rule, target_manager)
+            targets_by_rule[rule] = {
+                target for target in targets if target not in max_timeout_files
+            }
+            core_targets_by_rule[rule] = targets_by_rule[rule] - pruned_targets.get(
+                rule, set()
+            )
+            all_targets.update(core_targets_by_rule[rule])
+
+        patterns: List[Pattern] = []
+        patterns_regex: Dict[Rule, List[Pattern]] = collections.defaultdict(list)
+        for pattern in self._flatten_rule_patterns(rules):
+            rule = rules[pattern.rule_index]
+            if pattern.language != language or not core_targets_by_rule[rule]:
+                continue
+            operator = pattern.expression.operator
+            if operator == OPERATORS.REGEX or operator == OPERATORS.NOT_REGEX:
+                # see _run_rule, regexes are matched in Python
+                patterns_regex[rule].append(pattern)
+            elif operator not in [
+                OPERATORS.METAVARIABLE_REGEX,
+                OPERATORS.METAVARIABLE_COMPARISON,
+            ]:
+                patterns.append(pattern)
+
+        for rule_index, rule in enumerate(rules):
+            if rule in patterns_regex:
+                outputs[rule].extend(
+                    self._regex_pattern_matches(
+                        regex_matches, rule, rule_index, language, max_timeout_files
+                    )
                 )
 
-                findings_for_rule, debugging_steps = evaluate(
-                    rule, pattern_matches, self._allow_exec
+        if patterns:
+            try:
+                output_json = profiler.track(
+                    f"batch-{language}",
+                    self._run_core_command,
+                    [p.to_json() for p in patterns],
+                    patterns,
+                    sorted(all_targets),
+                    language,
+                    None,
+                    "-rules_file",
+                    cache_dir,
+                    target_files,
+                    report_time=self._report_time,
                 )
-                findings.extend(findings_for_rule)
+            except SemgrepError as ex:
+                logger.debug(f"{ex}\nfalling back to running rules one at a time")
+                return {
+                    rule: self._run_rule(
+                        rule,
+                        target_manager,
+                        cache_dir,
+                        target_files,
+                        regex_matches,
+                        pruned_targets,
+                        max_timeout_files,
+                        profiler,
+                        profiling_data,
+                    )
+                    for rule in rules
+                }
+
+            for pattern_match in output_json["matches"]:
+                rule = rules[pattern_match.rule_index]
+                if pattern_match.path in core_targets_by_rule[rule]:
+                    outputs[rule].append(pattern_match)
+
+            for error_json in output_json["errors"]:
+                # semgrep-core does not know which rule caused an error, so it
+                # is reported once, for the first rule that was run on the file,
+                # and e.g. a timeout counts once towards --timeout-threshold
+                error_path = Path(error_json["path"])
+                for rule in rules:
+                    if error_path in core_targets_by_rule[rule]:
+                        errors[rule].append(
+                            self._core_error(error_json, language, rule)
+                        )
+                        break
 
-        findings = dedup_output(findings)
-        logger.debug(f"...ran on {len(all_targets)} files")
+            if "time" in output_json:
+                self._add_batch_match_times(
+                    rules, core_targets_by_rule, profiling_data, output_json["time"]
+                )
 
-        # debugging steps are only tracked for a single file, just overwrite
-        return findings, debugging_steps, errors, all_targets
+        results = {}
+        for rule in rules:
+            findings, debugging_steps = self._evaluate_rule(rule, outputs[rule])
+            results[rule] = (
+                findings,
+                debugging_steps,
+                errors[rule],
+                targets_by_rule[rule],
+            )
+        logger.debug(f"...ran {len(rules)} rules on {len(all_targets)} files")
 
-    def handle_regex_patterns(
-        self,
-        outputs: List[PatternMatch],
-        patterns_regex: List[Any],
-        targets: List[Path],
-    ) -> None:
-        patterns_json = [pattern.to_json() for pattern in patterns_regex]
-        try:
-            patterns_re = [
-                (pattern["id"], re.compile(pattern["pattern"]))
-                for pattern in patterns_json
-            ]
-        except re.error as err:
-            raise SemgrepError(f"invalid regular expression specified: {err}")
+        return results
 
-        re_fn = functools.partial(get_re_matches, patterns_re)
-        with pool.ThreadPool(self._jobs) as tpool:
-            matches = tpool.map(re_fn, targets)
+    def _prefilter_targets(
+        self, rules: List[Rule], target_manager: TargetManager
+    ) -> Dict[Rule, FrozenSet[Path]]:
+        """
+        Return the targets of each of RULES that it cannot match, because they
+        do not contain the words its patterns require, see literal_prefilter
 
-        outputs.extend(
-            single_match for file_matches in matches for single_match in file_matches
+        These (rule, target) pairs are still counted as run, but they are not
+        passed to semgrep-core or spacegrep. Nothing is pruned with
+        --no-prefilter.
+        """
+        if not self._prefilter:
+            return {}
+        requirements: Dict[Rule, Requirement] = {}
+        targets_by_rule: Dict[Rule, Set[Path]] = {}
+        for rule in rules:
+            requirement = required_words(rule)
+            if not requirement:
+                continue
+            requirements[rule] = requirement
+            targets_by_rule[rule] = {
+                target
+                for language in rule.languages
+                if language not in REGEX_LANGUAGES
+                for target in self.get_files_for_language(
+                    language, rule, target_manager
+                )
+            }
+
+        pruned_targets: Dict[Rule, FrozenSet[Path]] = {}
+        if not requirements:
+            return pruned_targets
+
+        words = frozenset(
+            word
+            for requirement in requirements.values()
+            for required in requirement
+            for word in required
+        )
+        targets = sorted(set().union(*targets_by_rule.values()))
+        words_by_target = dict(zip(targets, target_words(words, targets, self._jobs)))
+        # rules with the same targets and words share their pruned targets, and
+        # so their target file, see TargetFileCache
+        shared: Dict[FrozenSet[Path], FrozenSet[Path]] = {}
+        for rule, requirement in requirements.items():
+            pruned = set()
+            for target in targets_by_rule[rule]:
+                # the targets that cannot be read are left to semgrep-core
+                found = words_by_target[target]
+                if found is not None and not satisfies(found, requirement):
+                    pruned.add(target)
+            if pruned:
+                frozen = frozenset(pruned)
+                pruned_targets[rule] = shared.setdefault(frozen, frozen)
+
+        num_pruned = sum(len(pruned) for pruned in pruned_targets.values())
+        logger.debug(
+            f"prefilter skipped {num_pruned} (rule, file) pairs that cannot match"
         )
+        return pruned_targets
+
+    def _match_regex_patterns(
+        self, rules: List[Rule], target_manager: TargetManager
+    ) -> RegexPatternMatches:
+        """
+        Match the pattern-regex and pattern-not-regex patterns of all RULES
+
+        semgrep-core doesn't know about these patterns, so they are matched in
+        Python, with a single read of each target for all the rules, in
+        self._jobs processes, see scan_targets.
+        """
+        regexes: Dict[str, int] = {}
+        # what to match in each target: the indices of the regexes, and the
+        # rule, language and pattern id each of them is matched for
+        requests: Dict[Path, List[Tuple[int, Rule, Language, PatternId]]] = {}
+        for rule in rules:
+            if rule.mode == TAINT_MODE:
+                continue
+            for pattern in self._flatten_rule_patterns([rule]):
+                operator = pattern.expression.operator
+                if operator != OPERATORS.REGEX and operator != OPERATORS.NOT_REGEX:
+                    continue
+                regex = pattern.to_json()["pattern"]
+                index = regexes.setdefault(regex, len(regexes))
+                pattern_id = PatternId(pattern.expression.pattern_id or "")
+                for target in self.get_files_for_language(
+                    pattern.language, rule, target_manager
+                ):
+                    requests.setdefault(target, []).append(
+                        (index, rule, pattern.language, pattern_id)
+                    )
+
+        regex_matches: RegexPatternMatches = collections.defaultdict(list)
+        if not requests:
+            return regex_matches
+
+        targets = list(requests)
+        matches = scan_targets(
+            list(regexes),
+            [
+                (
+                    target,
+                    list(dict.fromkeys(request[0] for request in requests[target])),
+                )
+                for target in targets
+            ],
+            self._jobs,
+        )
+
+        matches_by_target: Dict[int, Dict[int, List[RegexMatch]]] = {}
+        for match in matches:
+            target_index, regex_match = match[0], match[1:]
+            matches_by_target.setdefault(target_index, {}).setdefault(
+                regex_match[0], []
+            ).append(regex_match)
+        for target_index, target_matches in matches_by_target.items():
+            target = targets[target_index]
+            for index, rule, language, pattern_id in requests[target]:
+                regex_matches[(rule, language)].extend(
+                    (pattern_id, target, match)
+                    for match in target_matches.get(index, [])
+                )
+        return regex_matches
 
     @staticmethod
+    def _regex_pattern_matches(
+        regex_matches: RegexPatternMatches,
+        rule: Rule,
+        rule_index: int,
+        language: Language,
+        max_timeout_files: List[Path],
+    ) -> List[PatternMatch]:
+        """
+        Return the matches of the regex patterns of RULE on its LANGUAGE targets,
+        for a semgrep-core invocation where RULE is at RULE_INDEX
+        """
+        return [
+            PatternMatch(
+                {
+                    "check_id": f"{rule_index}.{pattern_id}",
+                    "path": str(path),
+                    "start": {"offset": start, "line": start_line, "col": start_col},
+                    "end": {"offset": end, "line": end_line, "col": end_col},
+                    "extra": {},
+                }
+            )
+            for pattern_id, path, (
+                _,
+                start,
+                start_line,
+                start_col,
+                end,
+                end_line,
+                end_col,
+            ) in regex_matches.get((rule, language), [])
+            if path not in max_timeout_files
+        ]
+
     def get_files_for_language(
-        language: Language, rule: Rule, target_manager: TargetManager
-    ) -> List[Path]:
+        self, language: Language, rule: Rule, target_manager: TargetManager
+    ) -> Sequence[Path]:
         try:
-            targets = target_manager.get_files(language, rule.includes, rule.excludes)
+            targets: Sequence[Path] = target_manager.get_files(
+                language, rule.includes, rule.excludes
+            )
         except _UnknownLanguageError as ex:
             raise UnknownLanguageError(
                 short_msg=f"invalid language: {language}",
                 long_msg=f"unsupported language: {language}. supported languages are: {', '.join(all_supported_languages())}",
                 spans=[rule.languages_span.with_context(before=1, after=1)],
             ) from ex
+        if self._result_cache is not None:
+            targets = self._result_cache.filter_targets(rule, targets)
         return targets
 
+    def _core_error(
+        self, error_json: Dict[str, Any], language: Language, rule: Rule
+    ) -> SemgrepError:
+        """
+        Convert an error reported by semgrep-core (or spacegrep) while running RULE
+        """
+        if self._result_cache is not None:
+            self._result_cache.add_core_error(rule, error_json, language)
+        return CoreException.from_json(
+            error_json, language, rule.id
+        ).into_semgrep_error()
+
+    def _split_rules_into_units(
+        self, rules: List[Rule]
+    ) -> List[Tuple[Optional[Language], List[Rule]]]:
+        """
+        Split RULES into the units of work of _run_rules
+
+        A unit is either (None, [rule]) for a rule run on its own, or
+        (language, rules) for rules batched into a single semgrep-core invocation
+        """
+        if not self._batch_rules:
+            return [(None, [rule]) for rule in rules]
+
+        batched_rules, single_rules = partition(self._can_batch_rule, rules)
+        rules_by_language: Dict[Language, List[Rule]] = collections.defaultdict(list)
+        for rule in batched_rules:
+            for language in rule.languages:
+                language_rules = rules_by_language[language]
+                if not language_rules or language_rules[-1] is not rule:
+                    language_rules.append(rule)
+
+        units: List[Tuple[Optional[Language], List[Rule]]] = list(
+            rules_by_language.items()
+        )
+        units.extend((None, [rule]) for rule in single_rules)
+        return units
+
+    def _run_unit(
+        self,
+        language: Optional[Language],
+        unit_rules: List[Rule],
+        target_manager: TargetManager,
+        cache_dir: str,
+        target_files: TargetFileCache,
+        regex_matches: RegexPatternMatches,
+        pruned_targets: Dict[Rule, FrozenSet[Path]],
+        max_timeout_files: List[Path],
+        profiler: ProfileManager,
+    ) -> Tuple[
+        Dict[
+            Rule,
+            Tuple[List[RuleMatch], List[Dict[str, Any]], List[SemgrepError], Set[Path]],
+        ],
+        ProfilingData,
+    ]:
+        """
+        Run one unit of work of _run_rules, see _split_rules_into_units
+
+        Units may run concurrently, so each one collects its match times in
+        its own ProfilingData.
+        """
+        profiling_data = ProfilingData()
+        if language is None:
+            rule = unit_rules[0]
+            debug_tqdm_write(f"Running rule {rule._raw.get('id')}...")
+            results = {
+                rule: self._run_rule(
+                    rule,
+                    target_manager,
+                    cache_dir,
+                    target_files,
+                    regex_matches,
+                    pruned_targets,
+                    max_timeout_files,
+                    profiler,
+                    profiling_data,
+                )
+            }
+        else:
+            debug_tqdm_write(f"Running {len(unit_rules)} {language} rules...")
+            results = self._run_batch(
+                language,
+                unit_rules,
+                target_manager,
+                cache_dir,
+                target_files,
+                regex_matches,
+                pruned_targets,
+                max_timeout_files,
+                profiler,
+                profiling_data,
+            )
+        return results, profiling_data
+
     def _run_rules(
         self, rules: List[Rule], target_manager: TargetManager, profiler: ProfileManager
     ) -> Tuple[
@@ -509,23 +961,46 @@ class CoreRunner:
         all_targets: Set[Path] = set()
         profiling_data: ProfilingData = ProfilingData()
 
-        # cf. for bar_format: https://tqdm.github.io/docs/tqdm/
-        with tempfile.TemporaryDirectory() as semgrep_core_ast_cache_dir:
-            for rule in progress_bar(
-                rules, bar_format="{l_bar}{bar}|{n_fmt}/{total_fmt}"
-            ):
-                debug_tqdm_write(f"Running rule {rule._raw.get('id')}...")
-                rule_matches, debugging_steps, errors, rule_targets = self._run_rule(
-                    rule,
-                    target_manager,
-                    semgrep_core_ast_cache_dir,
-                    max_timeout_files,
-                    profiler,
-                    profiling_data,
-                )
+        def merge_unit_results(
+            unit_results: Dict[
+                Rule,
+                Tuple[
+                    List[RuleMatch],
+                    List[Dict[str, Any]],
+                    List[SemgrepError],
+                    Set[Path],
+                ],
+            ],
+            unit_profiling_data: ProfilingData,
+        ) -> None:
+            nonlocal all_targets
+            # A concurrent unit may have started before some of its files reached
+            # the timeout threshold. Drop whatever it found on these files, so
+            # that the results are the same as when running units one by one.
+            timed_out = set(max_timeout_files)
+            profiling_data.update(
+                unit_profiling_data, skip_targets={str(path) for path in timed_out}
+            )
+            for rule, (
+                rule_matches,
+                debugging_steps,
+                errors,
+                rule_targets,
+            ) in unit_results.items():
+                if timed_out:
+                    rule_matches = [
+                        rule_match
+                        for rule_match in rule_matches
+                        if rule_match.path not in timed_out
+                    ]
+                    errors = [
+                        err for err in errors if _error_path(err) not in timed_out
+                    ]
+                    rule_targets = set(rule_targets) - timed_out
                 all_targets = all_targets.union(rule_targets)
-                findings_by_rule[rule] = rule_matches
-                debugging_steps_by_rule[rule] = debugging_steps
+                findings_by_rule.setdefault(rule, []).extend(rule_matches)
+                if debugging_steps or rule not in debugging_steps_by_rule:
+                    debugging_steps_by_rule[rule] = debugging_steps
                 all_errors.extend(errors)
                 for err in errors:
                     if isinstance(err, MatchTimeoutError):
@@ -536,6 +1011,69 @@ class CoreRunner:
                         ):
                             max_timeout_files.append(err.path)
 
+        pruned_targets = self._prefilter_targets(rules, target_manager)
+        regex_matches = self._match_regex_patterns(rules, target_manager)
+
+        # cf. for bar_format: https://tqdm.github.io/docs/tqdm/
+        units = progress_bar(
+            self._split_rules_into_units(rules),
+            bar_format="{l_bar}{bar}|{n_fmt}/{total_fmt}",
+        )
+        # semgrep-core writes its cache files atomically, so concurrent units
+        # can share the cache directory
+        with parsing_cache_directory(
+            self._parsing_cache
+        ) as semgrep_core_ast_cache_dir, target_file_cache() as target_files:
+
+            if self._parallel_rules <= 1:
+                for language, unit_rules in units:
+                    merge_unit_results(
+                        *self._run_unit(
+                            language,
+                            unit_rules,
+                            target_manager,
+                            semgrep_core_ast_cache_dir,
+                            target_files,
+                            regex_matches,
+                            pruned_targets,
+                            max_timeout_files,
+                            profiler,
+                        )
+                    )
+            else:
+                # Results are merged in the order of the units, whatever order
+                # they complete in, and at most 2 * N units are queued so that
+                # new units still see recent additions to max_timeout_files.
+                in_flight: Deque["Future[Any]"] = collections.deque()
+                with ThreadPoolExecutor(max_workers=self._parallel_rules) as executor:
+                    try:
+                        for language, unit_rules in units:
+                            if len(in_flight) >= 2 * self._parallel_rules:
+                                merge_unit_results(*in_flight.popleft().result())
+                            in_flight.append(
+                                executor.submit(
+                                    self._run_unit,
+                                    language,
+                                    unit_rules,
+                                    target_manager,
+                                    semgrep_core_ast_cache_dir,
+                                    target_files,
+                                    regex_matches,
+                                    pruned_targets,
+                                    list(max_timeout_files),
+                                    profiler,
+                                )
+                            )
+                        while in_flight:
+                            merge_unit_results(*in_flight.popleft().result())
+                    finally:
+                        for future in in_flight:
+                            future.cancel()
+
+        # a batched rule gets findings from one unit per language
+        findings_by_rule = {
+            rule: dedup_output(findings_by_rule.get(rule, [])) for rule in rules
+        }
         all_errors = dedup_errors(all_errors)
         return (
             findings_by_rule,
@@ -566,8 +1104,11 @@ class CoreRunner:
         errors: List[SemgrepError] = []
         all_targets: Set[Path] = set()
         profiling_data: ProfilingData = ProfilingData()
+        pruned_targets = self._prefilter_targets(rules, target_manager)
         # cf. for bar_format: https://tqdm.github.io/docs/tqdm/
-        with tempfile.TemporaryDirectory() as semgrep_core_ast_cache_dir:
+        with parsing_cache_directory(
+            self._parsing_cache
+        ) as semgrep_core_ast_cache_dir, target_file_cache() as target_files:
             for rule, language in tuple(
                 chain(
                     *(
@@ -577,19 +1118,16 @@ class CoreRunner:
                 )
             ):
                 debug_tqdm_write(f"Running rule {rule._raw.get('id')}...")
-                with tempfile.NamedTemporaryFile(
-                    "w", suffix=".yaml"
-                ) as rule_file, tempfile.NamedTemporaryFile("w") as target_file:
+                with tempfile.NamedTemporaryFile("w", suffix=".yaml") as rule_file:
                     targets = self.get_files_for_language(
                         language, rule, target_manager
                     )
+                    all_targets = all_targets.union(targets)
+                    pruned = pruned_targets.get(rule, frozenset())
                     # opti: no need to call semgrep-core if no target files
-                    if not targets:
+                    if all(target in pruned for target in targets):
                         continue
-                    all_targets = all_targets.union(targets)
 
-                    target_file.write("\n".join(map(lambda p: str(p), targets)))
-                    target_file.flush()
                     yaml = YAML()
                     yaml.dump({"rules": [rule._raw]}, rule_file)
                     rule_file.flush()
@@ -604,7 +1142,7 @@ class CoreRunner:
                         "-j",
                         str(self._jobs),
                         "-target_file",
-                        target_file.name,
+                        target_files.path(targets, pruned),
                         "-use_parsing_cache",
                         semgrep_core_ast_cache_dir,
                         "-timeout",
@@ -612,15 +1150,13 @@ class CoreRunner:
                         "-max_memory",
                         str(self._max_memory),
                     ]
+                    if self._parsing_cache is not None:
+                        cmd += ["-persistent_parsing_cache"]
 
                     if self._report_time:
                         cmd += ["-json_time"]
 
-                    r = sub_run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                    out_bytes, err_bytes, returncode = r.stdout, r.stderr, r.returncode
-                    output_json = self._parse_core_output(
-                        out_bytes, err_bytes, returncode
-                    )
+                    output_json, returncode = self._stream_core_output(cmd)
 
                     if "time" in output_json:
                         self._add_match_times(rule, profiling_data, output_json["time"])
@@ -637,7 +1173,7 @@ class CoreRunner:
                 findings = [
                     RuleMatch.from_pattern_match(
                         rule.id,
-                        PatternMatch(pattern_match),
+                        pattern_match,
                         message=rule.message,
                         metadata=rule.metadata,
                         severity=rule.severity,
@@ -650,8 +1186,7 @@ class CoreRunner:
                 findings = dedup_output(findings)
                 outputs[rule].extend(findings)
                 errors.extend(
-                    CoreException.from_json(e, language, rule.id).into_semgrep_error()
-                    for e in output_json["errors"]
+                    self._core_error(e, language, rule) for e in output_json["errors"]
                 )
         # end for rule, language ...
 
@@ -1,14 +1,17 @@
-import copy
+import functools
 import logging
 import re
 from collections import defaultdict
 from collections import OrderedDict
+from pathlib import Path
 from typing import Any
 from typing import Callable
 from typing import Dict
 from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Optional
+from typing import Pattern
 from typing import Set
 from typing import Tuple
 from typing import Union
@@ -20,8 +23,9 @@ from semgrep.constants import RCE_RULE_FLAG
 from semgrep.error import NEED_ARBITRARY_CODE_EXEC_EXIT_CODE
 from semgrep.error import SemgrepError
 from semgrep.error import UnknownOperatorError
-from semgrep.metavariable_comparison import metavariable_comparison
+from semgrep.metavariable_comparison import metavariable_comparisons
 from semgrep.pattern_match import PatternMatch
+from semgrep.range_index import RangeIndex
 from semgrep.rule import Rule
 from semgrep.rule_lang import YamlMap
 from semgrep.rule_match import RuleMatch
@@ -33,6 +37,7 @@ from semgrep.semgrep_types import PatternId
 from semgrep.semgrep_types import Range
 from semgrep.semgrep_types import TAINT_MODE
 from semgrep.util import flatten
+from semgrep.where_python import WherePython
 
 logger = logging.getLogger(__name__)
 
@@ -81,8 +86,6 @@ def add_debugging_info(
             for metavar, metavar_values in pattern.metavariables.items():
                 metavars_for_patterns[metavar].append(metavar_values)
 
-    logger.debug(f"after filter '{expression.operator}': {output_ranges}")
-
     steps_for_debugging.append(
         DebuggingStep(
             pattern_name_for_operator(expression.operator),
@@ -107,14 +110,59 @@ def compare_propagated_metavariable(
     )
 
 
-def get_re_range_matches(
+class PatternMatchIndex:
+    """
+    The pattern matches of a file, indexed by offsets and by metavariable uid
+    for metavariable-regex and metavariable-comparison
+    """
+
+    def __init__(self, pattern_matches: Iterable[PatternMatch]) -> None:
+        self._pattern_matches = pattern_matches
+        self._by_offsets: Optional[Dict[Tuple[int, int], List[PatternMatch]]] = None
+        self._by_uid: Dict[Tuple[str, Any], List[PatternMatch]] = {}
+
+    def _build(self) -> Dict[Tuple[int, int], List[PatternMatch]]:
+        if self._by_offsets is None:
+            self._by_offsets = {}
+            for pm in self._pattern_matches:
+                self._by_offsets.setdefault(
+                    (pm.start_offset, pm.end_offset), []
+                ).append(pm)
+                for metavariable, uid in pm.metavariable_uids.items():
+                    self._by_uid.setdefault((metavariable, uid), []).append(pm)
+        return self._by_offsets
+
+    def metavariable_matches(
+        self, _range: Range, metavariable: str
+    ) -> Iterator[PatternMatch]:
+        """
+        Yield the pattern matches that bind METAVARIABLE for _RANGE, i.e. the
+        matches of _RANGE itself, then the matches whose METAVARIABLE was
+        propagated to _RANGE
+        """
+        by_offsets = self._build()
+        for pm in by_offsets.get((_range.start, _range.end), []):
+            if pm.range == _range and metavariable in pm.metavariables:
+                yield pm
+        if metavariable in _range.propagated_metavariables:
+            yield from self._by_uid.get(
+                (metavariable, _range.propagated_metavariables[metavariable]), []
+            )
+
+
+def filter_metavariable_values(
     metavariable: str,
-    regex: str,
+    predicate: Callable[[List[str]], List[bool]],
     ranges: Set[Range],
-    pattern_matches: List[PatternMatch],
+    pattern_match_index: PatternMatchIndex,
 ) -> Set[Range]:
-
-    result: Set[Range] = set()
+    """
+    Keep the ranges where a value of METAVARIABLE satisfies PREDICATE, which is
+    called once with all the distinct values and returns a result for each
+    """
+    candidates: List[Tuple[Range, List[str]]] = []
+    # an ordered set
+    values: Dict[str, None] = {}
     for _range in ranges:
         if (
             metavariable not in _range.metavariables
@@ -123,50 +171,82 @@ def get_re_range_matches(
             logger.debug(f"metavariable '{metavariable}' missing in range '{_range}'")
             continue
 
-        any_matching_ranges = any(
-            pm.range == _range
-            and metavariable in pm.metavariables
-            and re.match(regex, pm.get_metavariable_value(metavariable))
-            for pm in pattern_matches
-        )
-        any_propagated_ranges = any(
-            re.match(regex, pm.get_metavariable_value(metavariable))
-            for pm in pattern_matches
-            if compare_propagated_metavariable(_range, pm, metavariable)
-        )
-        if any_matching_ranges or any_propagated_ranges:
-            result.add(_range)
+        range_values = [
+            pm.get_metavariable_value(metavariable)
+            for pm in pattern_match_index.metavariable_matches(_range, metavariable)
+        ]
+        values.update(dict.fromkeys(range_values))
+        candidates.append((_range, range_values))
+
+    if not values:
+        return set()
+    results_by_value = dict(zip(values, predicate(list(values))))
+    return {
+        _range
+        for _range, range_values in candidates
+        if any(results_by_value[value] for value in range_values)
+    }
 
-    return result
 
+@functools.lru_cache(maxsize=4096)
+def _compile_metavariable_regex(regex: str) -> Pattern[str]:
+    return re.compile(regex)
 
-def compare_range_match(
+
+def get_re_range_matches(
     metavariable: str,
-    comparison: str,
-    strip: Optional[bool],
-    base: Optional[int],
-    content: str,
-) -> bool:
+    regex: str,
+    ranges: Set[Range],
+    pattern_match_index: PatternMatchIndex,
+) -> Set[Range]:
+    compiled_regex = _compile_metavariable_regex(regex)
+    return filter_metavariable_values(
+        metavariable,
+        lambda values: [compiled_regex.match(value) is not None for value in values],
+        ranges,
+        pattern_match_index,
+    )
+
 
+def comparison_content(
+    metavariable: str, strip: Optional[bool], base: Optional[int], content: str
+) -> Optional[Union[int, float]]:
+    """
+    Return the number to compare for the value CONTENT of METAVARIABLE, or None
+    if it is not a number
+    """
     if strip:
         content = content.strip("\"'`")
 
     try:
         # Assume float data if "." in content
         if "." in content:
-            converted = float(content)
+            return float(content)
         else:
             if base is not None:
-                converted = int(content, base=base)
+                return int(content, base=base)
             else:
-                converted = int(content)
+                return int(content)
     except ValueError:
         logger.debug(
             f"metavariable '{metavariable}' incorrect comparison type '{content}'"
         )
-        return False
+        return None
 
-    return metavariable_comparison(metavariable, comparison, converted)
+
+def compare_range_matches(
+    metavariable: str,
+    comparison: str,
+    strip: Optional[bool],
+    base: Optional[int],
+    contents: List[str],
+) -> List[bool]:
+    converted = [
+        comparison_content(metavariable, strip, base, content) for content in contents
+    ]
+    numbers = [number for number in converted if number is not None]
+    results = iter(metavariable_comparisons(metavariable, comparison, numbers))
+    return [number is not None and next(results) for number in converted]
 
 
 def get_comparison_range_matches(
@@ -175,127 +255,77 @@ def get_comparison_range_matches(
     strip: Optional[bool],
     base: Optional[int],
     ranges: Set[Range],
-    pattern_matches: List[PatternMatch],
+    pattern_match_index: PatternMatchIndex,
 ) -> Set[Range]:
-
-    result: Set[Range] = set()
-    for _range in ranges:
-        if (
-            metavariable not in _range.metavariables
-            and metavariable not in _range.propagated_metavariables
-        ):
-            logger.debug(f"metavariable '{metavariable}' missing in range '{_range}'")
-            continue
-
-        any_matching_ranges = any(
-            pm.range == _range
-            and metavariable in pm.metavariables
-            and compare_range_match(
-                metavariable,
-                comparison,
-                strip,
-                base,
-                pm.get_metavariable_value(metavariable),
-            )
-            for pm in pattern_matches
-        )
-        any_propagated_ranges = any(
-            compare_range_match(
-                metavariable,
-                comparison,
-                strip,
-                base,
-                pm.get_metavariable_value(metavariable),
-            )
-            for pm in pattern_matches
-            if compare_propagated_metavariable(_range, pm, metavariable)
-        )
-        if any_matching_ranges or any_propagated_ranges:
-            result.add(_range)
-
-    return result
-
-
-def compare_where_python(where_expression: str, pattern_match: PatternMatch) -> bool:
-    result = False
-    return_var = "semgrep_pattern_return"
-    lines = where_expression.strip().split("\n")
-    to_eval = "\n".join(lines[:-1] + [f"{return_var} = {lines[-1]}"])
-
-    local_vars = {
-        metavar: pattern_match.get_metavariable_value(metavar)
-        for metavar in pattern_match.metavariables
-    }
-    scope = {"vars": local_vars}
-
-    try:
-        # fmt: off
-        exec(to_eval, scope)  # nosem: contrib.dlint.dlint-equivalent.insecure-exec-use, python.lang.security.audit.exec-detected.exec-detected
-        # fmt: on
-        result = scope[return_var]  # type: ignore
-    except KeyError as ex:
-        logger.error(
-            f"could not find metavariable {ex} while evaluating where-python expression '{where_expression}', consider case where metavariable is missing"
-        )
-    except Exception as ex:
-        logger.error(
-            f"received error '{repr(ex)}' while evaluating where-python expression '{where_expression}'"
-        )
-
-    if not isinstance(result, bool):
-        raise SemgrepError(
-            f"where-python expression '{where_expression}' needs boolean output but got {result}"
-        )
-    return result
+    return filter_metavariable_values(
+        metavariable,
+        lambda values: compare_range_matches(
+            metavariable, comparison, strip, base, values
+        ),
+        ranges,
+        pattern_match_index,
+    )
 
 
 def get_where_python_range_matches(
-    where_expression: str, ranges: Set[Range], pattern_matches: List[PatternMatch]
+    where_python: WherePython, ranges: Set[Range], pattern_matches: List[PatternMatch]
 ) -> Set[Range]:
-
-    return {
-        pm.range
-        for pm in pattern_matches
-        if pm.range in ranges and compare_where_python(where_expression, pm)
-    }
+    result: Set[Range] = set()
+    for pm in pattern_matches:
+        # only evaluate the matches of ranges left that are not kept yet
+        if pm.range in ranges and pm.range not in result:
+            metavariable_values = {
+                metavariable: pm.get_metavariable_value(metavariable)
+                for metavariable in pm.metavariables
+            }
+            if where_python.evaluate(metavariable_values):
+                result.add(pm.range)
+    return result
 
 
 def filter_ranges_with_propagation(
     ranges_left: Set[Range],
-    ranges_for_pattern: Set[Range],
+    candidates: Callable[[Range], Iterable[Range]],
     predicate: Callable[[Range, Range], bool],
     metavariable_propagation: bool,
 ) -> Set[Range]:
-
+    """
+    Keep the ranges left for which PREDICATE holds with at least one range of
+    the pattern, among the CANDIDATES ranges of the pattern given in stabilized
+    order (see RangeIndex). With METAVARIABLE_PROPAGATION, a kept range gets
+    the metavariables of the last of these ranges.
+    """
     stabilized_ranges_left = stabilize_evaluation_ordering(ranges_left)
-    stabilized_ranges_for_pattern = stabilize_evaluation_ordering(ranges_for_pattern)
     result: Set[Range] = set()
     for _range in stabilized_ranges_left:
-        matched = False
-        for pattern_range in stabilized_ranges_for_pattern:
+        matched_range = None
+        for pattern_range in candidates(_range):
             if predicate(pattern_range, _range):
-                if metavariable_propagation:
-                    # We need a deepcopy here because Python sets are passed by reference,
-                    # and the call to update() will affect ranges referenced in other
-                    # recursive calls to _evaluate_expression
-                    new_range = copy.deepcopy(_range)
-                    new_range.propagated_metavariables.update(
-                        pattern_range.metavariables
-                    )
-                else:
-                    new_range = _range
-                matched = True
-        if matched:
-            result.add(new_range)
+                matched_range = pattern_range
+        if matched_range is None:
+            continue
+        if metavariable_propagation:
+            _range = _range.with_propagated_metavariables(matched_range.metavariables)
+        result.add(_range)
     return result
 
 
+def _range_index(ranges_for_pattern: Set[Range]) -> RangeIndex:
+    """
+    Index the ranges of a pattern for the operators that compare them with the
+    ranges left, in stabilized order (see filter_ranges_with_propagation)
+    """
+    return RangeIndex(list(stabilize_evaluation_ordering(ranges_for_pattern)))
+
+
 def _evaluate_single_expression(
     expression: BooleanRuleExpression,
     pattern_ids_to_pattern_matches: Dict[PatternId, List[PatternMatch]],
+    pattern_match_index: PatternMatchIndex,
     ranges_left: Set[Range],
     allow_exec: bool,
     metavariable_propagation: bool,
+    rule: Optional[Rule],
 ) -> Set[Range]:
 
     if not expression.pattern_id:
@@ -309,7 +339,7 @@ def _evaluate_single_expression(
         # remove all ranges that don't equal the ranges for this pattern
         output_ranges = filter_ranges_with_propagation(
             ranges_left,
-            ranges_for_pattern,
+            _range_index(ranges_for_pattern).equal,
             predicate=lambda r1, r2: r1 == r2,
             metavariable_propagation=metavariable_propagation,
         )
@@ -320,18 +350,19 @@ def _evaluate_single_expression(
         # remove all ranges (not enclosed by) or (not equal to) the inside ranges
         output_ranges = filter_ranges_with_propagation(
             ranges_left,
-            ranges_for_pattern,
+            _range_index(ranges_for_pattern).enclosing,
             predicate=lambda r1, r2: r1.is_enclosing_or_eq(r2),
             metavariable_propagation=metavariable_propagation,
         )
     elif expression.operator == OPERATORS.AND_NOT_INSIDE:
         # remove all ranges enclosed by or equal to
+        range_index = _range_index(ranges_for_pattern)
         output_ranges = {
             _range
             for _range in ranges_left
             if not any(
-                pattern_range.is_enclosing_or_eq(_range)
-                for pattern_range in ranges_for_pattern
+                pattern_range.metavariables_match(_range)
+                for pattern_range in range_index.enclosing(_range)
             )
         }
     elif expression.operator == OPERATORS.REGEX:
@@ -339,14 +370,11 @@ def _evaluate_single_expression(
         output_ranges = ranges_left.intersection(ranges_for_pattern)
     elif expression.operator == OPERATORS.NOT_REGEX:
         # remove the result if pattern-not-regex is within another pattern
+        range_index = _range_index(ranges_for_pattern)
         output_ranges = {
             _range
             for _range in ranges_left
-            if not any(
-                _range.is_range_enclosing_or_eq(pattern_range)
-                or pattern_range.is_range_enclosing_or_eq(_range)
-                for pattern_range in ranges_for_pattern
-            )
+            if not range_index.enclosing(_range) and not range_index.enclosed(_range)
         }
     elif expression.operator == OPERATORS.WHERE_PYTHON:
         if not allow_exec:
@@ -359,7 +387,9 @@ def _evaluate_single_expression(
                 f"expected operator '{expression.operator}' to have string value guaranteed by schema"
             )
         output_ranges = get_where_python_range_matches(
-            expression.operand,
+            rule.where_python(expression.operand)
+            if rule is not None
+            else WherePython(expression.operand),
             ranges_left,
             list(flatten(pattern_ids_to_pattern_matches.values())),
         )
@@ -373,7 +403,7 @@ def _evaluate_single_expression(
             expression.operand["metavariable"].value,
             expression.operand["regex"].value,
             ranges_left,
-            list(flatten(pattern_ids_to_pattern_matches.values())),
+            pattern_match_index,
         )
     elif expression.operator == OPERATORS.METAVARIABLE_COMPARISON:
         if not isinstance(expression.operand, YamlMap):
@@ -388,7 +418,7 @@ def _evaluate_single_expression(
             strip.value if strip is not None else None,
             base.value if base is not None else None,
             ranges_left,
-            list(flatten(pattern_ids_to_pattern_matches.values())),
+            pattern_match_index,
         )
     else:
         raise UnknownOperatorError(f"unknown operator {expression.operator}")
@@ -396,25 +426,76 @@ def _evaluate_single_expression(
     return output_ranges
 
 
+@attr.s(auto_attribs=True, frozen=True)
+class FileMatches:
+    """
+    The pattern matches of a rule on a single file
+    """
+
+    # in the order of the output of semgrep-core
+    pattern_matches: List[PatternMatch]
+    # in stabilized evaluation order, i.e. by decreasing pattern id and in
+    # the order of the output for each pattern id
+    pattern_ids_to_pattern_matches: Dict[PatternId, List[PatternMatch]]
+
+
+def group_pattern_matches(
+    pattern_matches: Iterable[PatternMatch],
+) -> Dict[Path, FileMatches]:
+    """
+    Group PATTERN_MATCHES by file, then by pattern id, in a single pass
+
+    Paths and pattern ids of pattern matches are interned, so grouping only
+    hashes objects that cache their hash. Only the pattern ids of each file
+    are sorted, rather than all of its matches.
+    """
+    by_path: Dict[Path, FileMatches] = {}
+    for pm in pattern_matches:
+        file_matches = by_path.get(pm.path)
+        if file_matches is None:
+            file_matches = by_path[pm.path] = FileMatches([], {})
+        file_matches.pattern_matches.append(pm)
+        file_matches.pattern_ids_to_pattern_matches.setdefault(pm.id, []).append(pm)
+
+    return {
+        path: FileMatches(
+            file_matches.pattern_matches,
+            OrderedDict(
+                stabilize_evaluation_ordering(
+                    file_matches.pattern_ids_to_pattern_matches.items(),
+                    key=lambda item: item[0],
+                )
+            ),
+        )
+        for path, file_matches in by_path.items()
+    }
+
+
 def evaluate(
-    rule: Rule, pattern_matches: List[PatternMatch], allow_exec: bool
+    rule: Rule,
+    file_matches: FileMatches,
+    allow_exec: bool,
+    debug: bool = False,
 ) -> Tuple[List[RuleMatch], List[Dict[str, Any]]]:
     """
-    Takes a Rule and list of pattern matches from a single file and
-    handles the boolean expression evaluation of the Rule's patterns
-    Returns a list of RuleMatches.
+    Takes a Rule and the pattern matches from a single file, grouped by
+    group_pattern_matches, and handles the boolean expression evaluation of
+    the Rule's patterns
+    Returns a list of RuleMatches, and the steps of the evaluation when DEBUG
+    is set (for --debugging-json) or an empty list otherwise.
     """
     output = []
 
-    pattern_ids_to_pattern_matches: Dict[PatternId, List[PatternMatch]] = OrderedDict()
-    for pm in stabilize_evaluation_ordering(pattern_matches, key=lambda pm: pm.id):
-        pattern_ids_to_pattern_matches.setdefault(pm.id, []).append(pm)
+    pattern_matches = file_matches.pattern_matches
+    pattern_ids_to_pattern_matches = file_matches.pattern_ids_to_pattern_matches
 
-    initial_ranges: DebugRanges = {
-        pattern_id: set(pm.range for pm in pattern_matches)
-        for pattern_id, pattern_matches in pattern_ids_to_pattern_matches.items()
-    }
-    steps_for_debugging = [DebuggingStep("initial", None, initial_ranges, {})]
+    steps_for_debugging: Optional[List[DebuggingStep]] = None
+    if debug:
+        initial_ranges: DebugRanges = {
+            pattern_id: set(pm.range for pm in pattern_matches)
+            for pattern_id, pattern_matches in pattern_ids_to_pattern_matches.items()
+        }
+        steps_for_debugging = [DebuggingStep("initial", None, initial_ranges, {})]
 
     if rule.mode == TAINT_MODE:
         valid_ranges_to_output = {
@@ -426,6 +507,7 @@ def evaluate(
             pattern_ids_to_pattern_matches,
             allow_exec=allow_exec,
             steps_for_debugging=steps_for_debugging,
+            rule=rule,
         )
 
         # only output matches which are inside these offsets!
@@ -464,6 +546,8 @@ def evaluate(
             )
             output.append(rule_match)
 
+    if steps_for_debugging is None:
+        return output, []
     return output, [attr.asdict(step) for step in steps_for_debugging]
 
 
@@ -498,27 +582,38 @@ def interpolate_fix_metavariables(
 def evaluate_expression(
     expression: BooleanRuleExpression,
     pattern_ids_to_pattern_matches: Dict[PatternId, List[PatternMatch]],
-    steps_for_debugging: List[DebuggingStep],
+    steps_for_debugging: Optional[List[DebuggingStep]],
     allow_exec: bool,
+    rule: Optional[Rule] = None,
 ) -> Set[Range]:
+    """
+    Return the ranges matching EXPRESSION, where RULE, if any, is the rule of
+    EXPRESSION and keeps its compiled pattern-where-python expressions. The
+    steps of the evaluation are appended to STEPS_FOR_DEBUGGING, unless it is
+    None.
+    """
     ranges_left = {x.range for x in flatten(pattern_ids_to_pattern_matches.values())}
     return _evaluate_expression(
         expression,
         pattern_ids_to_pattern_matches,
+        PatternMatchIndex(list(flatten(pattern_ids_to_pattern_matches.values()))),
         ranges_left,
         steps_for_debugging,
         allow_exec=allow_exec,
         metavariable_propagation=False,
+        rule=rule,
     )
 
 
 def _evaluate_expression(
     expression: BooleanRuleExpression,
     pattern_ids_to_pattern_matches: Dict[PatternId, List[PatternMatch]],
+    pattern_match_index: PatternMatchIndex,
     ranges_left: Set[Range],
-    steps_for_debugging: List[DebuggingStep],
+    steps_for_debugging: Optional[List[DebuggingStep]],
     allow_exec: bool,
     metavariable_propagation: bool,
+    rule: Optional[Rule],
 ) -> Set[Range]:
     if expression.operator in OPERATORS_WITH_CHILDREN:
         if expression.children is None:
@@ -533,10 +628,12 @@ def _evaluate_expression(
                 _evaluate_expression(
                     expr,
                     pattern_ids_to_pattern_matches,
+                    pattern_match_index,
                     ranges_left.copy(),
                     steps_for_debugging,
                     allow_exec=allow_exec,
                     metavariable_propagation=False,
+                    rule=rule,
                 )
                 for expr in expression.children
             ]
@@ -547,10 +644,12 @@ def _evaluate_expression(
                 remainining_ranges = _evaluate_expression(
                     expr,
                     pattern_ids_to_pattern_matches,
+                    pattern_match_index,
                     ranges_left.copy(),
                     steps_for_debugging,
                     allow_exec=allow_exec,
                     metavariable_propagation=True,
+                    rule=rule,
                 )
                 ranges_left.intersection_update(remainining_ranges)
         else:
@@ -564,17 +663,22 @@ def _evaluate_expression(
         ranges_left = _evaluate_single_expression(
             expression,
             pattern_ids_to_pattern_matches,
+            pattern_match_index,
             ranges_left,
             allow_exec=allow_exec,
             metavariable_propagation=metavariable_propagation,
+            rule=rule,
         )
 
-    add_debugging_info(
-        expression,
-        ranges_left,
-        pattern_ids_to_pattern_matches,
-        steps_for_debugging,
-    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"after filter '{expression.operator}': {ranges_left}")
+    if steps_for_debugging is not None:
+        add_debugging_info(
+            expression,
+            ranges_left,
+            pattern_ids_to_pattern_matches,
+            steps_for_debugging,
+        )
     return ranges_left
 
 
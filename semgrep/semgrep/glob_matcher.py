@@ -0,0 +1,141 @@
+"""
+Matching of paths against sets of globs, as used by include/exclude filters
+
+A GlobMatcher compiles all its globs into a single regular expression with
+the semantics of pathlib's PurePath.match, and remembers the result for the
+paths it has seen. Matchers are shared between all the users of the same set
+of globs, e.g. rules with the same `paths:` filters. Both caches are bounded so
+that they don't grow across runs in the same process.
+"""
+import functools
+import re
+from pathlib import Path
+from pathlib import PurePosixPath
+from typing import Collection
+from typing import Dict
+from typing import FrozenSet
+from typing import List
+from typing import Pattern
+
+# Separates the parts of a path in the string the regexes are matched against:
+# unlike "/", it cannot appear in a part (the root part is "/")
+SEP = "\x00"
+NOT_SEP = f"[^{SEP}]"
+
+# Number of shared matchers, and of paths each matcher remembers
+MAX_MATCHERS = 256
+MAX_CACHED_PATHS = 1 << 16
+
+
+def _translate_part(glob_part: str) -> str:
+    """
+    Translate one part of a glob to a regex, like fnmatch.translate but never
+    matching across parts
+    """
+    i, n = 0, len(glob_part)
+    res: List[str] = []
+    while i < n:
+        c = glob_part[i]
+        i += 1
+        if c == "*":
+            if not res or res[-1] != f"{NOT_SEP}*":
+                res.append(f"{NOT_SEP}*")
+        elif c == "?":
+            res.append(NOT_SEP)
+        elif c == "[":
+            j = i
+            if j < n and glob_part[j] == "!":
+                j += 1
+            if j < n and glob_part[j] == "]":
+                j += 1
+            while j < n and glob_part[j] != "]":
+                j += 1
+            if j >= n:
+                res.append(r"\[")
+                continue
+            # a leading "]" is a member of the set, and must stay one after
+            # the separator is added to negated sets
+            stuff = glob_part[i:j].replace("\\", r"\\").replace("]", r"\]")
+            # escape set operations reserved by the re module
+            stuff = re.sub(r"([&~|])", r"\\\1", stuff)
+            i = j + 1
+            if stuff == "!":
+                res.append(NOT_SEP)
+            elif stuff[0] == "!":
+                res.append(f"[^{SEP}{stuff[1:]}]")
+            elif stuff[0] in ("^", "["):
+                res.append(f"[\\{stuff}]")
+            else:
+                res.append(f"[{stuff}]")
+        else:
+            res.append(re.escape(c))
+    return "".join(res)
+
+
+def _translate(glob: str) -> str:
+    """
+    Translate a glob to a regex matching the paths that PurePath.match(glob) accepts,
+    when followed by the end of the path
+
+    Relative globs match the end of a path, absolute globs the whole path.
+    """
+    parts = PurePosixPath(glob).parts
+    if not parts:
+        raise ValueError(f"empty glob: {glob!r}")
+    if parts[0].startswith("/"):
+        return "^" + SEP.join(
+            [re.escape(parts[0])] + [_translate_part(p) for p in parts[1:]]
+        )
+    return f"(?:^|{SEP})" + SEP.join(_translate_part(p) for p in parts)
+
+
+class GlobMatcher:
+    def __init__(self, globs: Collection[str]) -> None:
+        self.globs = frozenset(globs)
+        alternatives = "|".join(
+            f"(?:{_translate(glob)})" for glob in sorted(self.globs)
+        )
+        # a glob matches the path itself when it matches at the end, and one
+        # of its parents when it matches up to a separator
+        self._path_regex: Pattern = re.compile(f"(?:{alternatives})$")
+        self._path_or_parent_regex: Pattern = re.compile(
+            f"(?:{alternatives})(?:{SEP}|$)"
+        )
+        self._cache: Dict[Path, bool] = {}
+
+    def __repr__(self) -> str:
+        return f"GlobMatcher({sorted(self.globs)!r})"
+
+    def match_path(self, path: Path) -> bool:
+        """
+        Return true if PATH matches any glob, as PurePath.match does
+        """
+        if not self.globs or not path.parts:
+            return False
+        return self._path_regex.search(SEP.join(path.parts)) is not None
+
+    def match(self, path: Path) -> bool:
+        """
+        Return true if PATH or any parent of PATH matches any glob
+        """
+        if not self.globs or not path.parts:
+            return False
+        result = self._cache.get(path)
+        if result is None:
+            result = self._path_or_parent_regex.search(SEP.join(path.parts)) is not None
+            if len(self._cache) >= MAX_CACHED_PATHS:
+                self._cache.clear()
+            self._cache[path] = result
+        return result
+
+
+@functools.lru_cache(maxsize=MAX_MATCHERS)
+def _glob_matcher(globs: FrozenSet[str]) -> GlobMatcher:
+    return GlobMatcher(globs)
+
+
+def glob_matcher(globs: Collection[str]) -> GlobMatcher:
+    """
+    Return the GlobMatcher for GLOBS, shared by all the callers with the same globs
+    """
+    return _glob_matcher(frozenset(globs))
@@ -0,0 +1,165 @@
+"""
+Incremental parsing of the JSON output of semgrep-core
+
+semgrep-core prints a single JSON object, whose "matches" array can get very
+large. Instead of reading the whole output before decoding it, load_object
+decodes the object as it is read, and converts the items of its arrays one by
+one, so that the output never has to be held as bytes, text and objects at the
+same time. The converted items are all kept in the result, so memory still
+grows with the number of matches.
+"""
+import codecs
+import json
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import IO
+from typing import Mapping
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = " \t\n\r"
+# characters that can follow a number in valid JSON
+NUMBER_END = WHITESPACE + ",]}"
+
+
+class JSONStreamError(ValueError):
+    def __init__(self, msg: str, rest: str) -> None:
+        super().__init__(msg)
+        # the output that was not consumed, for error messages
+        self.rest = rest
+
+
+class _Reader:
+    def __init__(self, stream: IO[bytes]) -> None:
+        self._stream = stream
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._json_decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _read(self, size: int = CHUNK_SIZE) -> bool:
+        """
+        Append at least SIZE characters from the stream to the buffer, unless
+        it ends first. Return false if nothing was left to read.
+        """
+        if self._eof:
+            return False
+        # drop what was consumed, so that the buffer only holds the current value
+        if self._pos > len(self._buf) // 2:
+            self._buf = self._buf[self._pos :]
+            self._pos = 0
+        parts = []
+        read = 0
+        while read < size:
+            chunk = self._stream.read(CHUNK_SIZE)
+            if not chunk:
+                self._eof = True
+                parts.append(self._decoder.decode(b"", final=True))
+                break
+            text = self._decoder.decode(chunk)
+            parts.append(text)
+            read += len(text)
+        self._buf += "".join(parts)
+        return read > 0 or any(parts)
+
+    def error(self, msg: str) -> JSONStreamError:
+        rest = self._buf[self._pos :]
+        while self._read():
+            rest = self._buf[self._pos :]
+        return JSONStreamError(msg, rest)
+
+    def peek(self) -> str:
+        """
+        Return the next character that is not whitespace, without consuming it
+        """
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._read():
+                raise self.error("unexpected end of JSON output")
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if c not in chars:
+            raise self.error(f"expected one of {chars!r} in JSON output, got {c!r}")
+        self._pos += 1
+        return c
+
+    def value(self) -> Any:
+        """
+        Decode the next JSON value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buf, self._pos)
+            except ValueError:
+                # the value is probably cut short: read as much again as was
+                # already buffered, so that decoding a long value stays linear
+                if not self._read(max(CHUNK_SIZE, len(self._buf) - self._pos)):
+                    raise self.error("invalid JSON output")
+                continue
+            # a number at the end of the buffer may go on in the next chunk
+            if (
+                isinstance(value, (int, float))
+                and (end == len(self._buf) or self._buf[end] not in NUMBER_END)
+                and self._read()
+            ):
+                continue
+            self._pos = end
+            return value
+
+    def at_end(self) -> bool:
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return False
+            if not self._read():
+                return True
+
+
+def load_object(
+    stream: IO[bytes], item_parsers: Mapping[str, Callable[[Any], Any]]
+) -> Dict[str, Any]:
+    """
+    Decode the JSON object read from STREAM
+
+    The items of an array value whose key is in ITEM_PARSERS are converted with
+    the corresponding function as soon as they are decoded.
+
+    Raises JSONStreamError if the output is not a JSON object.
+    """
+    reader = _Reader(stream)
+    result: Dict[str, Any] = {}
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.expect("}")
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise reader.error("expected a key in JSON output")
+            reader.expect(":")
+            parse_item = item_parsers.get(key)
+            if parse_item is not None and reader.peek() == "[":
+                reader.expect("[")
+                items = []
+                if reader.peek() == "]":
+                    reader.expect("]")
+                else:
+                    while True:
+                        items.append(parse_item(reader.value()))
+                        if reader.expect(",]") == "]":
+                            break
+                result[key] = items
+            else:
+                result[key] = reader.value()
+            if reader.expect(",}") == "}":
+                break
+    if not reader.at_end():
+        raise reader.error("unexpected data after JSON output")
+    return result
@@ -0,0 +1,351 @@
+"""
+Prefiltering of the targets of a rule by the words its patterns require
+
+Most rules cannot match a file unless some identifiers of their patterns, e.g.
+`loads` in `pickle.loads(...)`, appear in it. required_words extracts these
+words from the expression of a rule, respecting pattern-either as OR and
+patterns as AND, and target_words reads each target once for the words of all
+the rules, so that semgrep-core is not run on the (rule, file) pairs that
+cannot match.
+
+The filter must never skip a file that a rule matches, so it errs on the side
+of requiring less:
+- only identifiers are required, not the contents of strings, which constant
+  propagation can build out of other strings
+- the keywords of the languages of a rule and the types of typed
+  metavariables are not required either, since semgrep may match them in
+  other forms, e.g. an arrow function for `function`. Rules in a language
+  without a list of keywords are not filtered at all.
+- words are compared case insensitively, and anywhere in the file, including
+  strings and comments, e.g. `from pickle import loads` contains `pickle`
+"""
+import multiprocessing
+import re
+from pathlib import Path
+from typing import Dict
+from typing import FrozenSet
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+
+from semgrep.regex_scanner import MIN_TARGETS_PER_PROCESS
+from semgrep.rule import Rule
+from semgrep.semgrep_types import BooleanRuleExpression
+from semgrep.semgrep_types import Language
+from semgrep.semgrep_types import OPERATORS
+from semgrep.semgrep_types import TAINT_MODE
+from semgrep.target_manager_extensions import C_LANGUAGES
+from semgrep.target_manager_extensions import CSHARP_LANGUAGES
+from semgrep.target_manager_extensions import GENERIC_LANGUAGES
+from semgrep.target_manager_extensions import GO_LANGUAGES
+from semgrep.target_manager_extensions import JAVA_LANGUAGES
+from semgrep.target_manager_extensions import JAVASCRIPT_LANGUAGES
+from semgrep.target_manager_extensions import JSON_LANGUAGES
+from semgrep.target_manager_extensions import KOTLIN_LANGUAGES
+from semgrep.target_manager_extensions import LUA_LANGUAGES
+from semgrep.target_manager_extensions import ML_LANGUAGES
+from semgrep.target_manager_extensions import PHP_LANGUAGES
+from semgrep.target_manager_extensions import PYTHON_LANGUAGES
+from semgrep.target_manager_extensions import RUBY_LANGUAGES
+from semgrep.target_manager_extensions import RUST_LANGUAGES
+from semgrep.target_manager_extensions import TYPESCRIPT_LANGUAGES
+from semgrep.target_manager_extensions import YAML_LANGUAGES
+
+# a file can contain a rule's matches only if it contains at least one word of
+# each of these sets, i.e. a conjunction of disjunctions
+Requirement = List[FrozenSet[str]]
+
+_STRING = re.compile(r"\"(?:[^\"\\\n]|\\.)*\"|'(?:[^'\\\n]|\\.)*'|`[^`]*`|'\w+")
+# a metavariable with an optional type annotation, as in `$X: int`
+_METAVARIABLE = re.compile(r"\$(?:\.\.\.)?\w+(?:\s*:\s*[\w.<>\[\],?*&\s]*)?")
+# the words before a metavariable, e.g. the type of `(List<String> $X)`
+_BEFORE_METAVARIABLE = re.compile(r"[\w.<>\[\],?*&\s]*(?=\$)")
+_PATTERN_WORD = re.compile(r"(?<!\w)[A-Za-z_]\w*", re.ASCII)
+_FILE_WORD = re.compile(rb"[a-z_][a-z0-9_]*")
+_DIGITS = b"0123456789"
+_WORD_BYTES = b"abcdefghijklmnopqrstuvwxyz_" + _DIGITS
+_CHUNK_SIZE = 1 << 20
+
+_JAVASCRIPT_KEYWORDS = """
+    async await break case catch class const continue debugger default delete
+    do else export extends false finally for from function get if import in
+    instanceof let new null of require return set static super switch this
+    throw true try typeof undefined var void while with yield
+"""
+
+# the words that each language reserves, which semgrep may match in other
+# forms, e.g. an arrow function for `function` or braces for `do ... end`
+_KEYWORDS_BY_LANGUAGES = [
+    (
+        PYTHON_LANGUAGES,
+        """
+        and as assert async await break class continue def del elif else except
+        exec false finally for from global if import in is lambda none nonlocal
+        not or pass print raise return self true try while with yield
+        """,
+    ),
+    (JAVASCRIPT_LANGUAGES, _JAVASCRIPT_KEYWORDS),
+    (
+        TYPESCRIPT_LANGUAGES,
+        _JAVASCRIPT_KEYWORDS
+        + """
+        abstract any as boolean declare enum implements interface keyof module
+        namespace never number object private protected public readonly string
+        symbol type unknown
+        """,
+    ),
+    (
+        JAVA_LANGUAGES,
+        """
+        abstract assert boolean break byte case catch char class const continue
+        default do double else enum extends false final finally float for goto
+        if implements import instanceof int interface long native new null
+        package private protected public return short static strictfp super
+        switch synchronized this throw throws transient true try var void
+        volatile while
+        """,
+    ),
+    (
+        C_LANGUAGES,
+        """
+        auto break case char const continue default do double else enum extern
+        float for goto if inline int long null register restrict return short
+        signed sizeof static struct switch typedef union unsigned void volatile
+        while
+        """,
+    ),
+    (
+        GO_LANGUAGES,
+        """
+        break case chan const continue default defer else fallthrough false for
+        func go goto if import interface map nil package range return select
+        struct switch true type var
+        """,
+    ),
+    (
+        RUBY_LANGUAGES,
+        """
+        alias and begin break case class def defined do else elsif end ensure
+        false for if in lambda module next nil not or proc redo rescue retry
+        return self super then true undef unless until when while yield
+        """,
+    ),
+    (
+        PHP_LANGUAGES,
+        """
+        abstract and array as break callable case catch class clone const
+        continue declare default do echo else elseif empty enddeclare endfor
+        endforeach endif endswitch endwhile eval exit extends false final
+        finally fn for foreach function global goto if implements include
+        include_once instanceof insteadof interface isset list match namespace
+        new null or parent print private protected public require require_once
+        return self static switch this throw trait true try unset use var while
+        xor yield
+        """,
+    ),
+    (
+        LUA_LANGUAGES,
+        """
+        and break do else elseif end false for function goto if in local nil not
+        or repeat return self then true until while
+        """,
+    ),
+    (
+        CSHARP_LANGUAGES,
+        """
+        abstract as async await base bool break byte case catch char checked
+        class const continue decimal default delegate do double else enum event
+        explicit extern false finally fixed float for foreach goto if implicit
+        in int interface internal is lock long namespace new null object
+        operator out override params private protected public readonly ref
+        return sbyte sealed short sizeof stackalloc static string struct switch
+        this throw true try typeof uint ulong unchecked unsafe ushort using var
+        virtual void volatile while
+        """,
+    ),
+    (
+        RUST_LANGUAGES,
+        """
+        as async await break const continue crate dyn else enum extern false fn
+        for if impl in let loop match mod move mut pub ref return self static
+        struct super trait true type unsafe use where while
+        """,
+    ),
+    (
+        KOTLIN_LANGUAGES,
+        """
+        as break by catch class constructor continue do else false finally for
+        fun get if import in init interface is null object package return set
+        super this throw true try typealias typeof val var when where while
+        """,
+    ),
+    (
+        ML_LANGUAGES,
+        """
+        and as assert begin class constraint do done downto else end exception
+        external false for fun function functor if in include inherit
+        initializer lazy let match method module mutable new nonrec object of
+        open or private rec sig struct then to true try type val virtual when
+        while with
+        """,
+    ),
+    (YAML_LANGUAGES, "false n no null off on true y yes"),
+    (JSON_LANGUAGES, "false null true"),
+    # spacegrep matches the words of a pattern as they are
+    (GENERIC_LANGUAGES, ""),
+]
+_KEYWORDS: Dict[Language, FrozenSet[str]] = {
+    language: frozenset(keywords.split())
+    for languages, keywords in _KEYWORDS_BY_LANGUAGES
+    for language in languages
+}
+
+
+def _pattern_words(pattern: str, keywords: FrozenSet[str]) -> FrozenSet[str]:
+    """
+    Return the words that appear in every code matching PATTERN, lower cased,
+    except KEYWORDS
+    """
+    pattern = _STRING.sub(" ", pattern)
+    pattern = _BEFORE_METAVARIABLE.sub(" ", pattern)
+    pattern = _METAVARIABLE.sub(" ", pattern)
+    words = {word.lower() for word in _PATTERN_WORD.findall(pattern)}
+    return frozenset(words - keywords)
+
+
+def _required_words(
+    expression: BooleanRuleExpression, keywords: FrozenSet[str]
+) -> Requirement:
+    operator = expression.operator
+    if operator == OPERATORS.AND or operator == OPERATORS.AND_INSIDE:
+        if not isinstance(expression.operand, str):
+            return []
+        return [
+            frozenset([word])
+            for word in sorted(_pattern_words(expression.operand, keywords))
+        ]
+    if operator == OPERATORS.AND_ALL:
+        return [
+            words
+            for child in expression.children or []
+            for words in _required_words(child, keywords)
+        ]
+    if operator == OPERATORS.AND_EITHER:
+        # a conjunction of disjunctions cannot express a disjunction of these
+        # without blowing up, so only one set of words is kept by alternative
+        either_words: FrozenSet[str] = frozenset()
+        for child in expression.children or []:
+            child_requirement = _required_words(child, keywords)
+            if not child_requirement:
+                return []
+            either_words |= min(child_requirement, key=len)
+        return [either_words] if either_words else []
+    # negations, regexes and metavariable conditions only remove matches
+    return []
+
+
+def required_words(rule: Rule) -> Requirement:
+    """
+    Return what a file must contain for RULE to match in it, see Requirement
+
+    An empty requirement means that RULE may match in any file.
+    """
+    if rule.mode == TAINT_MODE or rule.equivalences:
+        return []
+    keywords: FrozenSet[str] = frozenset()
+    for language in rule.languages:
+        if language not in _KEYWORDS:
+            # e.g. regex-only rules
+            return []
+        keywords |= _KEYWORDS[language]
+    return list(dict.fromkeys(_required_words(rule.expression, keywords)))
+
+
+def satisfies(words: FrozenSet[str], requirement: Requirement) -> bool:
+    """
+    Whether a file that contains WORDS meets REQUIREMENT
+    """
+    return all(not required.isdisjoint(words) for required in requirement)
+
+
+def _file_words(path: str, words: FrozenSet[bytes]) -> Optional[FrozenSet[str]]:
+    """
+    Return the WORDS that the file at PATH contains, or None if it cannot be read
+    """
+    found: Set[bytes] = set()
+    max_length = max((len(word) for word in words), default=0)
+    try:
+        with open(path, "rb") as fd:
+            # the file is read by chunks, so that a large file is never copied
+            # whole, and the words of each chunk are looked up in WORDS all at
+            # once rather than searched one by one
+            rest = b""
+            # whether the last chunk ended in a word longer than all of WORDS
+            in_long_word = False
+            while len(found) < len(words):
+                chunk = fd.read(_CHUNK_SIZE)
+                data = chunk.lower()
+                if in_long_word:
+                    data = data.lstrip(_WORD_BYTES)
+                    if chunk and not data:
+                        continue
+                    in_long_word = False
+                data = rest + data
+                # the word at the end of the chunk may go on in the next one
+                end = len(data.rstrip(_WORD_BYTES)) if chunk else len(data)
+                found.update(words.intersection(_FILE_WORD.findall(data, 0, end)))
+                # like in _FILE_WORD, a word does not start with digits
+                rest = data[end:].lstrip(_DIGITS)
+                if len(rest) > max_length:
+                    rest = b""
+                    in_long_word = True
+                if not chunk:
+                    break
+    except OSError:
+        return None
+    return frozenset(word.decode("ascii") for word in found)
+
+
+# the words of all the rules in a worker process, set by _init_worker
+_worker_words: FrozenSet[bytes] = frozenset()
+
+
+def _init_worker(words: FrozenSet[bytes]) -> None:
+    global _worker_words
+    _worker_words = words
+
+
+def _words_of_shard(
+    shard: Sequence[Tuple[int, str]]
+) -> List[Tuple[int, Optional[FrozenSet[str]]]]:
+    return [(index, _file_words(path, _worker_words)) for index, path in shard]
+
+
+def target_words(
+    words: FrozenSet[str], targets: Sequence[Path], jobs: int
+) -> List[Optional[FrozenSet[str]]]:
+    """
+    Return the WORDS that each of TARGETS contains, or None for the targets
+    that cannot be read
+
+    Like scan_targets, the targets are sharded across up to JOBS processes.
+    """
+    encoded_words = frozenset(word.encode("ascii") for word in words)
+    requests = [(index, str(target)) for index, target in enumerate(targets)]
+    processes = min(jobs, len(requests) // MIN_TARGETS_PER_PROCESS)
+    if processes <= 1:
+        return [_file_words(path, encoded_words) for _, path in requests]
+
+    num_shards = processes * 4
+    shards = [requests[i::num_shards] for i in range(num_shards)]
+    with multiprocessing.Pool(
+        processes, initializer=_init_worker, initargs=(encoded_words,)
+    ) as process_pool:
+        words_by_shard = process_pool.map(_words_of_shard, shards)
+    result: List[Optional[FrozenSet[str]]] = [None] * len(requests)
+    for shard_words in words_by_shard:
+        for index, found in shard_words:
+            result[index] = found
+    return result
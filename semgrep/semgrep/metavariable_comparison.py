@@ -1,6 +1,34 @@
+"""
+Evaluation of the comparison expressions of metavariable-comparison
+
+Comparisons used to be evaluated by running `semgrep-core -eval` on each
+candidate value. They are now compiled once, in process, for the subset of
+Python that semgrep-core interprets (see Eval_generic.ml): int, float, string,
+boolean and list literals, metavariables, arithmetic, comparisons, boolean
+operators, `in`, and `re.match` with a literal pattern, plus the `int` and
+`str` conversions. Like semgrep-core, operators only apply to operands of the
+same type (there is no implicit conversion between ints and floats), and an
+expression that cannot be evaluated is false.
+
+Expressions outside of this subset are still sent to semgrep-core, with one call
+for all the values of a metavariable.
+"""
+import ast
+import functools
 import json
+import logging
+import math
+import re
 import subprocess
+import sys
 import tempfile
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
 from typing import Union
 
 from semgrep.constants import PLEASE_FILE_ISSUE_TEXT
@@ -8,18 +36,323 @@ from semgrep.error import SemgrepError
 from semgrep.util import SEMGREP_PATH
 from semgrep.util import sub_check_output
 
+logger = logging.getLogger(__name__)
 
-def metavariable_comparison(
-    metavariable: str, comparison: str, content: Union[int, float, str]
-) -> bool:
-    core_request = {
-        "metavars": {metavariable: content},
-        "language": "python",  # Hardcode for now
-        "code": comparison,
-    }
+Content = Union[int, float, str]
+Env = Dict[str, Content]
+Evaluator = Callable[[Env], Any]
+
+if sys.version_info >= (3, 8):
+    _LITERAL_NODES: tuple = (ast.Constant,)
+else:
+    _LITERAL_NODES = (ast.Num, ast.Str, ast.NameConstant)
+
+# metavariables are not valid Python names, so they are renamed before parsing;
+# strings are matched first so that their content is left untouched
+_METAVARIABLE_RE = re.compile(
+    r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')|\$([A-Za-z_][A-Za-z_0-9]*)"
+)
+_METAVARIABLE_PREFIX = "semgrep_metavariable__"
+
+
+class _Unsupported(Exception):
+    """
+    The expression is outside of the subset evaluated in process
+    """
+
+
+class _NotHandled(Exception):
+    """
+    The expression cannot be evaluated with these values, so it is false
+    """
+
+
+def _is_int(value: Any) -> bool:
+    # bool is a subclass of int, but not an int for semgrep-core
+    return type(value) is int
+
+
+def _same_type(values: List[Any], *types: type) -> bool:
+    return all(type(value) is type(values[0]) for value in values) and (
+        type(values[0]) in types
+    )
+
+
+def _equal(v1: Any, v2: Any) -> bool:
+    """
+    Structural equality of semgrep-core, where 0, 0.0 and False all differ
+    """
+    if type(v1) is not type(v2):
+        return False
+    if isinstance(v1, list):
+        return len(v1) == len(v2) and all(_equal(x1, x2) for x1, x2 in zip(v1, v2))
+    return bool(v1 == v2)
+
+
+def _div(v1: Any, v2: Any) -> Any:
+    if _is_int(v1):
+        if v2 == 0:
+            raise _NotHandled()
+        # OCaml integer division rounds towards zero
+        quotient = abs(v1) // abs(v2)
+        return quotient if (v1 < 0) == (v2 < 0) else -quotient
+    if v2 == 0:
+        if v1 == 0 or v1 != v1:
+            return float("nan")
+        return math.copysign(float("inf"), v1) * math.copysign(1.0, v2)
+    return v1 / v2
+
+
+def _mod(v1: int, v2: int) -> int:
+    if v2 == 0:
+        raise _NotHandled()
+    # the sign of OCaml's mod is that of the dividend
+    quotient: int = _div(v1, v2)
+    return v1 - v2 * quotient
+
+
+_ARITHMETIC: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Add: lambda v1, v2: v1 + v2,
+    ast.Sub: lambda v1, v2: v1 - v2,
+    ast.Mult: lambda v1, v2: v1 * v2,
+    ast.Div: _div,
+}
+
+_ORDERING: Dict[type, Callable[[Any, Any], bool]] = {
+    ast.Gt: lambda v1, v2: v1 > v2,
+    ast.GtE: lambda v1, v2: v1 >= v2,
+    ast.Lt: lambda v1, v2: v1 < v2,
+    ast.LtE: lambda v1, v2: v1 <= v2,
+}
+
+
+def _in(v1: Any, v2: Any) -> bool:
+    return isinstance(v2, list) and any(_equal(v1, x) for x in v2)
+
+
+def _compare(op: ast.cmpop, v1: Any, v2: Any) -> bool:
+    if type(op) in _ORDERING:
+        if not _same_type([v1, v2], int, float):
+            raise _NotHandled()
+        return _ORDERING[type(op)](v1, v2)
+    if isinstance(op, ast.Eq):
+        return _equal(v1, v2)
+    if isinstance(op, ast.NotEq):
+        return not _equal(v1, v2)
+    if isinstance(op, ast.In):
+        return _in(v1, v2)
+    if isinstance(op, ast.NotIn):
+        return not _in(v1, v2)
+    raise _NotHandled()
+
+
+def _to_int(value: Any) -> int:
+    if _is_int(value) or (isinstance(value, float) and math.isfinite(value)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            raise _NotHandled()
+    raise _NotHandled()
+
+
+def _to_str(value: Any) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float, str)):
+        return str(value)
+    raise _NotHandled()
+
+
+_CONVERSIONS: Dict[str, Callable[[Any], Any]] = {"int": _to_int, "str": _to_str}
+
+
+def _compile_node(node: ast.AST, names: Dict[str, str]) -> Evaluator:
+    """
+    Return a function evaluating NODE in an environment of metavariable values,
+    where NAMES maps the renamed metavariables back to their names
+    """
+    if isinstance(node, _LITERAL_NODES):
+        value = ast.literal_eval(node)
+        if not isinstance(value, (bool, int, float, str)):
+            raise _Unsupported()
+        return lambda env: value
+
+    if isinstance(node, ast.Name):
+        name = names.get(node.id, node.id)
+
+        def lookup(env: Env) -> Any:
+            if name not in env:
+                raise _NotHandled()
+            return env[name]
+
+        return lookup
+
+    if isinstance(node, ast.List):
+        items = [_compile_node(item, names) for item in node.elts]
+        return lambda env: [item(env) for item in items]
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile_node(node.operand, names)
+        if isinstance(node.op, ast.Not):
+
+            def negate(env: Env) -> Any:
+                value = operand(env)
+                if not isinstance(value, bool):
+                    raise _NotHandled()
+                return not value
+
+            return negate
+
+        if isinstance(node.op, (ast.UAdd, ast.USub)):
+            sign = -1 if isinstance(node.op, ast.USub) else 1
+
+            def signed(env: Env) -> Any:
+                value = operand(env)
+                if not _same_type([value], int, float):
+                    raise _NotHandled()
+                return sign * value
+
+            return signed
+        raise _Unsupported()
+
+    if isinstance(node, ast.BinOp):
+        left = _compile_node(node.left, names)
+        right = _compile_node(node.right, names)
+        if isinstance(node.op, ast.Mod):
+
+            def modulo(env: Env) -> Any:
+                v1, v2 = left(env), right(env)
+                if not _same_type([v1, v2], int):
+                    raise _NotHandled()
+                return _mod(v1, v2)
+
+            return modulo
+
+        if type(node.op) not in _ARITHMETIC:
+            raise _Unsupported()
+        operator = _ARITHMETIC[type(node.op)]
+
+        def arithmetic(env: Env) -> Any:
+            v1, v2 = left(env), right(env)
+            if not _same_type([v1, v2], int, float):
+                raise _NotHandled()
+            return operator(v1, v2)
+
+        return arithmetic
+
+    if isinstance(node, ast.BoolOp):
+        operands = [_compile_node(value, names) for value in node.values]
+        is_and = isinstance(node.op, ast.And)
+
+        def boolean(env: Env) -> Any:
+            # all operands are evaluated, as in semgrep-core
+            values = [operand(env) for operand in operands]
+            if not _same_type(values, bool):
+                raise _NotHandled()
+            return all(values) if is_and else any(values)
+
+        return boolean
+
+    if isinstance(node, ast.Compare):
+        operands = [_compile_node(node.left, names)] + [
+            _compile_node(comparator, names) for comparator in node.comparators
+        ]
+        ops = node.ops
+        if not all(
+            type(op) in _ORDERING
+            or isinstance(op, (ast.Eq, ast.NotEq, ast.In, ast.NotIn))
+            for op in ops
+        ):
+            raise _Unsupported()
+
+        def comparison(env: Env) -> Any:
+            values = [operand(env) for operand in operands]
+            return all(
+                _compare(op, v1, v2) for op, v1, v2 in zip(ops, values, values[1:])
+            )
+
+        return comparison
+
+    if isinstance(node, ast.Call) and not node.keywords:
+        func = node.func
+        if (
+            isinstance(func, ast.Attribute)
+            and isinstance(func.value, ast.Name)
+            and func.value.id == "re"
+            and func.attr == "match"
+            and len(node.args) == 2
+            and isinstance(node.args[1], _LITERAL_NODES)
+        ):
+            pattern = ast.literal_eval(node.args[1])
+            if not isinstance(pattern, str):
+                raise _Unsupported()
+            try:
+                regex = re.compile(pattern)
+            except re.error:
+                raise _Unsupported()
+            subject = _compile_node(node.args[0], names)
+
+            def match(env: Env) -> Any:
+                value = subject(env)
+                if not isinstance(value, str):
+                    raise _NotHandled()
+                return regex.match(value) is not None
+
+            return match
+
+        if (
+            isinstance(func, ast.Name)
+            and func.id in _CONVERSIONS
+            and len(node.args) == 1
+        ):
+            convert = _CONVERSIONS[func.id]
+            argument = _compile_node(node.args[0], names)
+            return lambda env: convert(argument(env))
+
+    raise _Unsupported()
+
+
+@functools.lru_cache(maxsize=None)
+def compile_comparison(comparison: str) -> Optional[Evaluator]:
+    """
+    Compile COMPARISON, or return None if it has to be evaluated by semgrep-core
+    """
+    names: Dict[str, str] = {}
+
+    def rename(match: "re.Match[str]") -> str:
+        if match.group(2) is None:
+            return match.group(0)
+        renamed = _METAVARIABLE_PREFIX + match.group(2)
+        names[renamed] = "$" + match.group(2)
+        return renamed
+
+    try:
+        tree = ast.parse(_METAVARIABLE_RE.sub(rename, comparison.strip()), mode="eval")
+        return _compile_node(tree.body, names)
+    except (SyntaxError, ValueError, RecursionError, _Unsupported):
+        logger.debug(f"comparison '{comparison}' will be evaluated by semgrep-core")
+        return None
+
+
+def _core_metavariable_comparisons(
+    metavariable: str, comparison: str, contents: Sequence[Content]
+) -> List[bool]:
+    """
+    Evaluate COMPARISON for each of CONTENTS with a single semgrep-core call
+    """
+    core_requests = [
+        {
+            "metavars": {metavariable: content},
+            "language": "python",  # Hardcode for now
+            "code": comparison,
+        }
+        for content in contents
+    ]
 
     with tempfile.NamedTemporaryFile("w") as temp_file:
-        json.dump(core_request, temp_file)
+        json.dump(core_requests, temp_file)
         temp_file.flush()
         cmd = [SEMGREP_PATH, "-eval", temp_file.name]
         try:
@@ -29,4 +362,65 @@ def metavariable_comparison(
                 f"error invoking semgrep with:\n\t{' '.join(cmd)}\n\t{ex}\n{PLEASE_FILE_ISSUE_TEXT}"
             )
 
-    return output.strip() == b"true"
+    try:
+        results = json.loads(output)
+    except ValueError:
+        results = None
+    if not isinstance(results, list) or len(results) != len(contents):
+        raise SemgrepError(
+            f"unexpected output of {' '.join(cmd)}: {output!r}\n{PLEASE_FILE_ISSUE_TEXT}"
+        )
+    # null when semgrep-core could not evaluate the comparison
+    return [result is True for result in results]
+
+
+# results of semgrep-core, by metavariable, comparison, type and value of the
+# content, since e.g. 1 and 1.0 are not the same value. Bounded like _evaluate,
+# since a long running process sees new contents with every run.
+_core_results: Dict[Tuple[str, str, type, Content], bool] = {}
+_MAX_CORE_RESULTS = 65536
+
+
+# typed, for the same reason
+@functools.lru_cache(maxsize=65536, typed=True)
+def _evaluate(metavariable: str, comparison: str, content: Content) -> bool:
+    evaluator = compile_comparison(comparison)
+    assert evaluator is not None
+    try:
+        result = evaluator({metavariable: content})
+    except _NotHandled:
+        return False
+    # as in semgrep-core, an int is true when it is not zero
+    return result is True or (_is_int(result) and result != 0)
+
+
+def metavariable_comparisons(
+    metavariable: str, comparison: str, contents: Sequence[Content]
+) -> List[bool]:
+    """
+    Return whether COMPARISON holds when METAVARIABLE is each of CONTENTS
+
+    Comparisons outside of the subset evaluated in process are sent to
+    semgrep-core all at once.
+    """
+    if compile_comparison(comparison) is not None:
+        return [_evaluate(metavariable, comparison, content) for content in contents]
+
+    keys = [(metavariable, comparison, type(content), content) for content in contents]
+    found = {key: _core_results[key] for key in keys if key in _core_results}
+    pending = list(dict.fromkeys(key for key in keys if key not in found))
+    if pending:
+        results = _core_metavariable_comparisons(
+            metavariable, comparison, [key[3] for key in pending]
+        )
+        found.update(zip(pending, results))
+        if len(_core_results) + len(pending) > _MAX_CORE_RESULTS:
+            _core_results.clear()
+        _core_results.update(zip(pending, results))
+    return [found[key] for key in keys]
+
+
+def metavariable_comparison(
+    metavariable: str, comparison: str, content: Content
+) -> bool:
+    return metavariable_comparisons(metavariable, comparison, [content])[0]
@@ -0,0 +1,155 @@
+"""
+Persistent directory for the parsing cache of semgrep-core
+
+semgrep-core names its cache files after the path, language and content of
+each target (see parse_generic in semgrep-core), and marks a cache file as
+used by touching it. Cache files are stored under a subdirectory per
+semgrep-core version, and once the cache grows over its maximum size the
+least recently used files are deleted.
+"""
+import contextlib
+import logging
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import attr
+
+from semgrep.constants import DEFAULT_PARSING_CACHE_MAX_SIZE
+from semgrep.error import SemgrepError
+from semgrep.util import SEMGREP_PATH
+from semgrep.util import sub_run
+
+logger = logging.getLogger(__name__)
+
+# semgrep-core writes <md5>.ast_cache files through <md5>.ast_cache.<pid>.tmp
+CACHE_FILE_SUFFIXES = (".ast_cache", ".tmp")
+# a temporary file that was not renamed after this many seconds was left by a
+# semgrep-core process that died, rather than being written by a running one
+STALE_TMP_FILE_AGE = 60 * 60
+
+
+def semgrep_core_version() -> str:
+    """
+    Return the version of semgrep-core, usable as a directory name
+    """
+    core_run = sub_run(
+        [SEMGREP_PATH, "-version"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    output = (core_run.stdout + core_run.stderr).decode("utf-8", errors="replace")
+    version = output.strip().split("version:", 1)[-1].strip()
+    if core_run.returncode != 0 or not version:
+        raise SemgrepError("could not determine the version of semgrep-core")
+    return re.sub(r"[^\w.-]+", "_", version)
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class ParsingCache:
+    root: Path
+    max_size: int = DEFAULT_PARSING_CACHE_MAX_SIZE  # in bytes
+
+    @contextlib.contextmanager
+    def directory(self) -> Iterator[str]:
+        """
+        Yield the directory to pass to semgrep-core's -use_parsing_cache, and
+        evict the least recently used cache files once semgrep-core is done
+        """
+        cache_dir = self.root / semgrep_core_version()
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            raise SemgrepError(f"could not create parsing cache at {cache_dir}: {e}")
+        logger.debug(f"using parsing cache at {cache_dir}")
+        try:
+            yield str(cache_dir)
+        finally:
+            self.evict()
+
+    def _cache_files(self) -> List[Tuple[float, int, Path]]:
+        """
+        Return (last use, size, path) of every file in the cache that can be
+        evicted, i.e. the finished cache files and the stale temporary files
+
+        Other temporary files may still be written by a semgrep-core process of
+        a concurrent run, which would fail to rename them.
+        """
+        stale_time = time.time() - STALE_TMP_FILE_AGE
+        cache_files = []
+        for path in self.root.glob("*/*"):
+            if path.suffix not in CACHE_FILE_SUFFIXES:
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                # deleted by a concurrent semgrep run
+                continue
+            if path.suffix == ".tmp" and stat.st_mtime > stale_time:
+                continue
+            cache_files.append((stat.st_mtime, stat.st_size, path))
+        return cache_files
+
+    def evict(self) -> None:
+        """
+        Delete the least recently used cache files until the cache fits in
+        its maximum size
+        """
+        cache_files = self._cache_files()
+        size = sum(file_size for _, file_size, _ in cache_files)
+        if size <= self.max_size:
+            return
+
+        cache_files.sort()
+        evicted = 0
+        for _, file_size, path in cache_files:
+            if size <= self.max_size:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+            size -= file_size
+            evicted += 1
+        logger.debug(f"evicted {evicted} files from the parsing cache at {self.root}")
+
+        for version_dir in self.root.iterdir():
+            with contextlib.suppress(OSError):
+                version_dir.rmdir()  # only succeeds if empty
+
+    def clear(self) -> None:
+        """
+        Delete every file in the cache
+        """
+        if not self.root.exists():
+            return
+        version_dirs = list(self.root.iterdir())
+        for version_dir in version_dirs:
+            # be careful when given the wrong directory
+            if not version_dir.is_dir() or any(
+                not path.is_file() or path.suffix not in CACHE_FILE_SUFFIXES
+                for path in version_dir.iterdir()
+            ):
+                raise SemgrepError(
+                    f"refusing to clear {self.root}: it does not look like a parsing cache"
+                )
+        for version_dir in version_dirs:
+            shutil.rmtree(version_dir)
+        logger.info(f"cleared the parsing cache at {self.root}")
+
+
+@contextlib.contextmanager
+def parsing_cache_directory(parsing_cache: Optional[ParsingCache]) -> Iterator[str]:
+    """
+    Yield a persistent cache directory if PARSING_CACHE is set, else a temporary
+    directory that is removed at the end of the run
+    """
+    if parsing_cache is None:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            yield cache_dir
+    else:
+        with parsing_cache.directory() as cache_dir:
+            yield cache_dir
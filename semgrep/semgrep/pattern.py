@@ -21,12 +21,17 @@ class Pattern:
         span: Optional[Span],
     ) -> None:
         self._id = f"{rule_index}.{expression.pattern_id}"
+        self._rule_index = rule_index
         self._language = language
         self._severity = severity
         self._expression = expression
         self._pattern = expression.operand
         self._span = span
 
+    @property
+    def rule_index(self) -> int:
+        return self._rule_index
+
     @property
     def span(self) -> Optional[Span]:
         return self._span
@@ -1,32 +1,112 @@
+import functools
+import sys
 from pathlib import Path
 from typing import Any
 from typing import Dict
+from typing import Mapping
 from typing import Optional
+from typing import Tuple
 
+from semgrep.semgrep_types import EMPTY_METAVARIABLES
 from semgrep.semgrep_types import PatternId
 from semgrep.semgrep_types import Range
+from semgrep.source_cache import source_cache
+
+
+# bounded, since a long running process sees new check ids with every run
+@functools.lru_cache(maxsize=4096)
+def _parse_check_id(check_id: str) -> Tuple[int, PatternId]:
+    """
+    Split the check id of a pattern sent to semgrep-core, see Pattern.to_json
+
+    Whole rules run by semgrep-core report their rule id instead, which has
+    no rule index.
+    """
+    rule_index, _, pattern_id = check_id.partition(".")
+    if not rule_index.isdigit():
+        return -1, PatternId(sys.intern(check_id))
+    return int(rule_index), PatternId(sys.intern(pattern_id))
+
+
+# the same Path object for all the matches in a file, see clear_path_cache
+_paths: Dict[str, Path] = {}
+
+
+def _intern_path(path: str) -> Path:
+    """
+    Return the same Path object for all the matches in a file
+    """
+    interned = _paths.get(path)
+    if interned is None:
+        interned = _paths[path] = Path(path)
+    return interned
+
+
+def clear_path_cache() -> None:
+    """
+    Forget the paths of the matches of the previous runs in this process
+    """
+    _paths.clear()
+
+
+def _get_uid(metavariable_data: Any) -> Any:
+    try:
+        return metavariable_data["unique_id"]["sid"]
+    except KeyError:
+        try:
+            return metavariable_data["unique_id"]["md5sum"]
+        except KeyError:
+            return None
 
 
 class PatternMatch:
     """
     Encapsulates a section of code that matches a single pattern
+
+    A run keeps all its pattern matches, so the fields used while evaluating
+    rules are parsed once from the JSON output of semgrep-core, and only the
+    parts of that output needed for the findings are kept.
     """
 
+    __slots__ = (
+        "rule_index",
+        "id",
+        "path",
+        "metavariable_uids",
+        "range",
+        "_start",
+        "_end",
+        "_extra",
+        "_metavariable_values",
+    )
+
     def __init__(self, raw_json: Dict[str, Any]) -> None:
-        self._raw_json = raw_json
+        self.rule_index, self.id = _parse_check_id(raw_json["check_id"])
+        self.path = _intern_path(raw_json["path"])
+        self._start: Dict[str, Any] = raw_json["start"]
+        self._end: Dict[str, Any] = raw_json["end"]
+        self._extra: Dict[str, Any] = raw_json["extra"]
+        metavariables = self.metavariables
+        self.metavariable_uids: Mapping[str, Any] = (
+            {
+                metavariable: _get_uid(data)
+                for metavariable, data in metavariables.items()
+            }
+            if metavariables
+            else EMPTY_METAVARIABLES
+        )
+        self.range = Range(
+            self._start["offset"], self._end["offset"], self.metavariable_uids
+        )
         self._metavariable_values: Optional[Dict[str, str]] = None
 
     @property
-    def rule_index(self) -> int:
-        return int(self._raw_json["check_id"].split(".")[0])
+    def start_offset(self) -> int:
+        return self.range.start
 
     @property
-    def id(self) -> PatternId:
-        return PatternId(".".join(self._raw_json["check_id"].split(".")[1:]))
-
-    @property
-    def path(self) -> Path:
-        return Path(self._raw_json["path"])
+    def end_offset(self) -> int:
+        return self.range.end
 
     @property
     def metavariables(self) -> Dict[str, Any]:
@@ -34,36 +114,12 @@ class PatternMatch:
 
     @property
     def extra(self) -> Dict[str, Any]:
-        return self._raw_json["extra"]
-
-    @property
-    def metavariable_uids(self) -> Dict[str, Any]:
-        def _get_uid(metavariable_data: Any) -> Any:
-            try:
-                return metavariable_data["unique_id"]["sid"]
-            except KeyError:
-                try:
-                    return metavariable_data["unique_id"]["md5sum"]
-                except KeyError:
-                    return None
-
-        return {
-            metavariable: _get_uid(data)
-            for metavariable, data in self.metavariables.items()
-        }
-
-    @property
-    def range(self) -> Range:
-        return Range(
-            self._raw_json["start"]["offset"],
-            self._raw_json["end"]["offset"],
-            self.metavariable_uids,
-        )
+        return self._extra
 
     @property
     def start(self) -> Dict[str, Any]:
         # https://docs.r2c.dev/en/latest/api/output.html does not support offset at the moment
-        start = dict(self._raw_json["start"])
+        start = dict(self._start)
         if "offset" in start:
             del start["offset"]
         return start
@@ -71,29 +127,38 @@ class PatternMatch:
     @property
     def end(self) -> Dict[str, Any]:
         # https://docs.r2c.dev/en/latest/api/output.html does not support offset at the moment
-        end = dict(self._raw_json["end"])
+        end = dict(self._end)
         if "offset" in end:
             del end["offset"]
         return end
 
-    def _read_metavariable_values(self) -> Dict[str, str]:
+    def to_json(self) -> Dict[str, Any]:
         """
-        Read self.path and lookup all values of metavariables in self.metavariables
+        Return the JSON output of semgrep-core this match was built from
         """
-        result = {}
-
-        # open path and ignore non-utf8 bytes. https://stackoverflow.com/a/56441652
-        with open(self.path, errors="replace") as fd:
-            for metavariable, metavariable_data in self.metavariables.items():
-                # Offsets are start inclusive and end exclusive
-                start_offset = metavariable_data["start"]["offset"]
-                end_offset = metavariable_data["end"]["offset"]
-                length = end_offset - start_offset
-
-                fd.seek(start_offset)
-                result[metavariable] = fd.read(length)
+        return {
+            "check_id": self.id
+            if self.rule_index < 0
+            else f"{self.rule_index}.{self.id}",
+            "path": str(self.path),
+            "start": self._start,
+            "end": self._end,
+            "extra": self._extra,
+        }
 
-        return result
+    def _read_metavariable_values(self) -> Dict[str, str]:
+        """
+        Lookup all values of metavariables in self.metavariables in self.path
+        """
+        # Offsets are byte offsets, start inclusive and end exclusive
+        return {
+            metavariable: source_cache.read(
+                self.path,
+                metavariable_data["start"]["offset"],
+                metavariable_data["end"]["offset"],
+            )
+            for metavariable, metavariable_data in self.metavariables.items()
+        }
 
     def get_metavariable_value(self, metavariable: str) -> str:
         """
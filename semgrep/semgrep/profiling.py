@@ -1,3 +1,4 @@
+from typing import Container
 from typing import Dict
 from typing import NamedTuple
 
@@ -20,3 +21,9 @@ class ProfilingData:
 
     def set_times(self, rule: str, target: str, times: Times) -> None:
         self._match_time_matrix[Semgrep_run(rule=rule, target=target)] = times
+
+    def update(self, other: "ProfilingData", skip_targets: Container[str] = ()) -> None:
+        """Add the times of OTHER, except those on SKIP_TARGETS"""
+        for run, times in other._match_time_matrix.items():
+            if run.target not in skip_targets:
+                self._match_time_matrix[run] = times
@@ -0,0 +1,94 @@
+"""
+Index of ranges for the containment queries of rule evaluation
+
+Operators like pattern-inside compare every range left with the ranges of a
+pattern. RangeIndex sorts the ranges of the pattern by start offset and keeps
+the maximum and minimum end offset of each subtree of a segment tree over
+them, so that the ranges enclosing (or enclosed by) a given range are found in
+O(log n + k) rather than by scanning all of them.
+"""
+import bisect
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+from semgrep.semgrep_types import Range
+
+
+class RangeIndex:
+    def __init__(self, ranges: Sequence[Range]) -> None:
+        """
+        Index RANGES. Queries return ranges in the order of RANGES.
+        """
+        self._ranges = ranges
+        # positions in RANGES, sorted by start offset
+        self._by_start = sorted(range(len(ranges)), key=lambda i: ranges[i].start)
+        self._starts = [ranges[i].start for i in self._by_start]
+
+        self._size = 1
+        while self._size < len(ranges):
+            self._size *= 2
+        self._max_ends = [-1] * (2 * self._size)
+        self._min_ends = [float("inf")] * (2 * self._size)
+        for leaf, i in enumerate(self._by_start):
+            self._max_ends[self._size + leaf] = ranges[i].end
+            self._min_ends[self._size + leaf] = ranges[i].end
+        for node in range(self._size - 1, 0, -1):
+            self._max_ends[node] = max(
+                self._max_ends[2 * node], self._max_ends[2 * node + 1]
+            )
+            self._min_ends[node] = min(
+                self._min_ends[2 * node], self._min_ends[2 * node + 1]
+            )
+
+        self._by_offsets: Dict[Tuple[int, int], List[int]] = {}
+        for i, _range in enumerate(ranges):
+            self._by_offsets.setdefault((_range.start, _range.end), []).append(i)
+
+    def _search(
+        self, lo: int, hi: int, tree: List, keep: Callable[[int], bool]
+    ) -> List[Range]:
+        """
+        Return the ranges at leaves LO (inclusive) to HI (exclusive) whose
+        end offset satisfies KEEP, pruning the subtrees whose maximum or
+        minimum end offset in TREE does not
+        """
+        positions = []
+        stack = [(1, 0, self._size)]
+        while stack:
+            node, node_lo, node_hi = stack.pop()
+            if node_hi <= lo or hi <= node_lo or not keep(tree[node]):
+                continue
+            if node >= self._size:
+                positions.append(self._by_start[node - self._size])
+                continue
+            mid = (node_lo + node_hi) // 2
+            stack.append((2 * node + 1, mid, node_hi))
+            stack.append((2 * node, node_lo, mid))
+        return [self._ranges[i] for i in sorted(positions)]
+
+    def equal(self, _range: Range) -> List[Range]:
+        """
+        Return the ranges with the same offsets as _RANGE
+        """
+        return [
+            self._ranges[i]
+            for i in self._by_offsets.get((_range.start, _range.end), [])
+        ]
+
+    def enclosing(self, _range: Range) -> List[Range]:
+        """
+        Return the ranges that enclose or are equal to _RANGE, by offsets only
+        """
+        hi = bisect.bisect_right(self._starts, _range.start)
+        return self._search(0, hi, self._max_ends, lambda end: end >= _range.end)
+
+    def enclosed(self, _range: Range) -> List[Range]:
+        """
+        Return the ranges that _RANGE encloses or is equal to, by offsets only
+        """
+        lo = bisect.bisect_left(self._starts, _range.start)
+        hi = bisect.bisect_right(self._starts, _range.end)
+        return self._search(lo, hi, self._min_ends, lambda end: end <= _range.end)
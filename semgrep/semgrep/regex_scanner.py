@@ -0,0 +1,200 @@
+"""
+Matching of the pattern-regex and pattern-not-regex patterns of all rules
+
+semgrep-core does not know about these patterns, so they are matched in Python.
+Rather than reading every target once per rule, a RegexScanner matches all the
+patterns that apply to a file in a single read of it.
+
+Files are memory-mapped and matched with bytes regexes, so that they do not
+have to be decoded: on plain ASCII text, bytes and str regexes behave the same.
+Other files are decoded once like Path.read_text does, which is also how binary
+files get skipped, and matched with str regexes.
+
+scan_targets shards the targets across worker processes, since matching holds
+the GIL.
+"""
+import bisect
+import io
+import logging
+import mmap
+import multiprocessing
+import os
+import re
+from pathlib import Path
+from typing import List
+from typing import Optional
+from typing import Pattern
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+from semgrep.error import SemgrepError
+
+logger = logging.getLogger(__name__)
+
+# the index of the pattern, then the offset, line and column of the start and
+# of the end of the match, with one indexed lines and columns
+RegexMatch = Tuple[int, int, int, int, int, int, int]
+
+# bytes that bytes and str regexes do not treat the same: non-ASCII bytes, the
+# information separators \x1c-\x1f that only str regexes consider spaces, and
+# carriage returns, which are translated to newlines when decoding
+_NOT_PLAIN_ASCII = re.compile(rb"[\r\x1c-\x1f\x80-\xff]")
+
+
+def _line_starts(contents: Union[bytes, mmap.mmap, str]) -> List[int]:
+    """
+    Return the offsets at which the lines of CONTENTS start
+    """
+    if isinstance(contents, str):
+        return [0, *(match.end() for match in re.finditer("\n", contents))]
+    return [0, *(match.end() for match in re.finditer(b"\n", contents))]
+
+
+def _position(offset: int, line_starts: List[int]) -> Tuple[int, int, int]:
+    line = bisect.bisect_right(line_starts, offset)
+    return offset, line, offset - line_starts[line - 1] + 1
+
+
+class RegexScanner:
+    def __init__(self, patterns: Sequence[str]) -> None:
+        """
+        Raises SemgrepError if one of PATTERNS is not a valid regex
+        """
+        try:
+            self._str_patterns = [re.compile(pattern) for pattern in patterns]
+        except re.error as err:
+            raise SemgrepError(f"invalid regular expression specified: {err}")
+        # None for the patterns that cannot be bytes regexes, e.g. with \u escapes
+        self._bytes_patterns: List[Optional[Pattern[bytes]]] = []
+        for pattern in patterns:
+            try:
+                self._bytes_patterns.append(re.compile(pattern.encode("utf-8")))
+            except re.error:
+                self._bytes_patterns.append(None)
+
+    def scan(self, path: Path, pattern_indices: Sequence[int]) -> List[RegexMatch]:
+        """
+        Return the matches in PATH of the patterns at PATTERN_INDICES, pattern
+        by pattern
+        """
+        with path.open("rb") as fd:
+            if os.fstat(fd.fileno()).st_size == 0:
+                return self._scan(path, b"", pattern_indices)
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return self._scan(path, data, pattern_indices)
+
+    def _scan(
+        self, path: Path, data: Union[bytes, mmap.mmap], pattern_indices: Sequence[int]
+    ) -> List[RegexMatch]:
+        bytes_patterns = [
+            (index, pattern)
+            for index in pattern_indices
+            for pattern in [self._bytes_patterns[index]]
+            if pattern is not None
+        ]
+        spans: List[Tuple[int, Tuple[int, int]]]
+        contents: Union[bytes, mmap.mmap, str]
+        if (
+            len(bytes_patterns) == len(pattern_indices)
+            and _NOT_PLAIN_ASCII.search(data) is None
+        ):
+            spans = [
+                (index, match.span())
+                for index, pattern in bytes_patterns
+                for match in pattern.finditer(data)
+            ]
+            contents = data
+        else:
+            try:
+                # like Path.read_text, with universal newlines
+                with io.TextIOWrapper(io.BytesIO(data[:]), "utf-8") as fd:
+                    contents = fd.read()
+            except UnicodeDecodeError:
+                logger.debug(f"regex matcher skipping binary file at {path}")
+                return []
+            spans = [
+                (index, match.span())
+                for index in pattern_indices
+                for match in self._str_patterns[index].finditer(contents)
+            ]
+
+        if not spans:
+            return []
+        # built once per file, so that converting an offset is a binary search
+        line_starts = _line_starts(contents)
+        return [
+            (index, *_position(start, line_starts), *_position(end, line_starts))
+            for index, (start, end) in spans
+        ]
+
+
+# the index of the target of a match, followed by the match
+TargetMatch = Tuple[int, int, int, int, int, int, int, int]
+
+# below this many targets per process, starting processes costs more than the
+# matching they share
+MIN_TARGETS_PER_PROCESS = 16
+
+# the scanner of a worker process, compiled once by _init_worker
+_worker_scanner: Optional[RegexScanner] = None
+
+
+def _init_worker(patterns: Sequence[str]) -> None:
+    global _worker_scanner
+    _worker_scanner = RegexScanner(patterns)
+
+
+def _scan_requests(
+    scanner: RegexScanner, requests: Sequence[Tuple[int, str, Sequence[int]]]
+) -> List[TargetMatch]:
+    return [
+        (target_index, *match)
+        for target_index, path, pattern_indices in requests
+        for match in scanner.scan(Path(path), pattern_indices)
+    ]
+
+
+def _scan_shard(shard: Sequence[Tuple[int, str, Sequence[int]]]) -> List[TargetMatch]:
+    assert _worker_scanner is not None
+    return _scan_requests(_worker_scanner, shard)
+
+
+def scan_targets(
+    patterns: Sequence[str],
+    targets: Sequence[Tuple[Path, Sequence[int]]],
+    jobs: int,
+) -> List[TargetMatch]:
+    """
+    Return the matches in each of TARGETS, a path and the indices of the
+    PATTERNS to match in it, by target and then pattern by pattern
+
+    re.finditer holds the GIL, so the targets are sharded across up to JOBS
+    worker processes, each compiling PATTERNS once when it starts.
+
+    Raises SemgrepError if one of PATTERNS is not a valid regex
+    """
+    # compiled here too, so that an invalid pattern is reported by this process
+    scanner = RegexScanner(patterns)
+    requests = [
+        (target_index, str(path), tuple(pattern_indices))
+        for target_index, (path, pattern_indices) in enumerate(targets)
+    ]
+    processes = min(jobs, len(requests) // MIN_TARGETS_PER_PROCESS)
+    if processes <= 1:
+        return _scan_requests(scanner, requests)
+
+    # a few shards per process, dealt round robin so that large files that
+    # are next to each other, e.g. in the same directory, end up in different
+    # shards
+    num_shards = processes * 4
+    shards = [requests[i::num_shards] for i in range(num_shards)]
+    with multiprocessing.Pool(
+        processes, initializer=_init_worker, initargs=(list(patterns),)
+    ) as process_pool:
+        matches_by_shard = process_pool.map(_scan_shard, shards)
+    # sorting is stable, so the matches of a target stay pattern by pattern
+    return sorted(
+        (match for matches in matches_by_shard for match in matches),
+        key=lambda match: match[0],
+    )
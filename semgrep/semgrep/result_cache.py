@@ -0,0 +1,257 @@
+"""
+Results of previous runs, for incremental scans
+
+The cache holds the hash of the content of each target of the last run, and
+for the hash of each rule of that run, the findings and errors it produced on
+each target. Only the targets with findings or errors have an entry: every
+rule of the last run was run on all its targets, so a target whose hash did
+not change and has no entry had no results. All the entries are dropped when
+the version of semgrep or the settings that affect results change.
+
+A run asks the cache which pairs it can skip, runs the others, then merges
+the cached results in and saves the results of the pairs it ran.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Sequence
+from typing import Set
+from typing import Tuple
+
+from semgrep.core_exception import CoreException
+from semgrep.error import MatchTimeoutError
+from semgrep.error import SemgrepError
+from semgrep.pattern_match import PatternMatch
+from semgrep.rule import Rule
+from semgrep.rule_match import RuleMatch
+
+logger = logging.getLogger(__name__)
+
+# the entry of the targets on which a rule had no findings nor errors
+NO_RESULTS: Dict[str, Any] = {"matches": [], "errors": []}
+
+
+def _hash_file(path: Path) -> str:
+    file_hash = hashlib.sha256()
+    with path.open("rb") as fd:
+        for chunk in iter(lambda: fd.read(1 << 16), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _hash_rule(rule: Rule) -> str:
+    return hashlib.sha256(
+        json.dumps(rule._raw, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, path: Path, settings: Dict[str, Any]) -> None:
+        """
+        Load the cache at PATH, unless it was saved with other SETTINGS
+
+        SETTINGS must include the versions of semgrep and semgrep-core, and
+        any option that changes the findings of a rule on a file.
+        """
+        self._path = path
+        self._settings = settings
+        # hash of each target, and entries of each rule, of the last run
+        self._files: Dict[str, str] = {}
+        self._rules: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._file_hashes: Dict[Path, str] = {}
+        self._rule_hashes: Dict[Rule, str] = {}
+        # (rule, target) pairs that were looked up during this run
+        self._hits: Dict[Rule, Set[Path]] = {}
+        self._misses: Dict[Rule, Set[Path]] = {}
+        # errors reported by semgrep-core, as JSON, for the pairs that were run
+        self._core_errors: Dict[Tuple[Rule, Path], List[Dict[str, Any]]] = {}
+
+        try:
+            with path.open() as fd:
+                cache = json.load(fd)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.debug(f"ignoring unreadable result cache at {path}: {e}")
+            return
+
+        if cache.get("settings") != settings:
+            logger.debug(f"ignoring result cache at {path} created with other settings")
+            return
+        self._files = cache.get("files", {})
+        self._rules = cache.get("rules", {})
+
+    def _file_hash(self, target: Path) -> str:
+        if target not in self._file_hashes:
+            self._file_hashes[target] = _hash_file(target)
+        return self._file_hashes[target]
+
+    def _rule_hash(self, rule: Rule) -> str:
+        if rule not in self._rule_hashes:
+            self._rule_hashes[rule] = _hash_rule(rule)
+        return self._rule_hashes[rule]
+
+    def _get_entry(self, rule: Rule, target: Path) -> Any:
+        """
+        Return the cached results of RULE on TARGET, or None if it must run
+        """
+        # hash the target even if it must run, to save its hash with the results
+        file_hash = self._file_hash(target)
+        rule_entries = self._rules.get(self._rule_hash(rule))
+        if rule_entries is None or self._files.get(str(target)) != file_hash:
+            return None
+        return rule_entries.get(str(target), NO_RESULTS)
+
+    def filter_targets(self, rule: Rule, targets: Sequence[Path]) -> Sequence[Path]:
+        """
+        Return the TARGETS that RULE must run on, i.e. those without cached results
+        """
+        hits = self._hits.setdefault(rule, set())
+        misses = self._misses.setdefault(rule, set())
+        result = []
+        for target in targets:
+            try:
+                cached = self._get_entry(rule, target) is not None
+            except OSError:
+                cached = False
+            if cached:
+                hits.add(target)
+            else:
+                misses.add(target)
+                result.append(target)
+        return result
+
+    def add_core_error(
+        self, rule: Rule, error_json: Dict[str, Any], language: str
+    ) -> None:
+        """
+        Record an error reported by semgrep-core while running RULE
+        """
+        error_json = {**error_json, "path": str(error_json["path"])}
+        self._core_errors.setdefault((rule, Path(error_json["path"])), []).append(
+            {"error": error_json, "language": language}
+        )
+
+    def merge(
+        self,
+        rule_matches_by_rule: Dict[Rule, List[RuleMatch]],
+        errors: List[SemgrepError],
+        all_targets: Set[Path],
+    ) -> Tuple[Dict[Rule, List[RuleMatch]], List[SemgrepError], Set[Path]]:
+        """
+        Record the results of the pairs that were run, and add the cached
+        results of the pairs that were skipped
+        """
+        # whether a file is skipped after a timeout depends on all the rules run
+        # on it, so its results are not worth caching
+        timed_out = {err.path for err in errors if isinstance(err, MatchTimeoutError)}
+
+        rules: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for rule, targets in self._misses.items():
+            by_path: Dict[Path, List[RuleMatch]] = {}
+            for rule_match in rule_matches_by_rule.get(rule, []):
+                by_path.setdefault(rule_match.path, []).append(rule_match)
+            rule_entries = rules.setdefault(self._rule_hash(rule), {})
+            for target in targets:
+                if target in timed_out:
+                    continue
+                matches = by_path.get(target, [])
+                core_errors = self._core_errors.get((rule, target), [])
+                if not matches and not core_errors:
+                    continue
+                rule_entries[str(target)] = {
+                    "matches": [
+                        {
+                            "pattern_match": rule_match._pattern_match.to_json(),
+                            "message": rule_match.message,
+                            "fix": rule_match._fix,
+                        }
+                        for rule_match in matches
+                    ],
+                    "errors": core_errors,
+                }
+
+        rule_matches_by_rule = {
+            rule: list(rule_matches)
+            for rule, rule_matches in rule_matches_by_rule.items()
+        }
+        errors = list(errors)
+        all_targets = set(all_targets)
+        num_hits = 0
+        for rule, targets in self._hits.items():
+            rule_entries = rules.setdefault(self._rule_hash(rule), {})
+            for target in targets:
+                entry = self._get_entry(rule, target)
+                if entry is not NO_RESULTS:
+                    rule_entries[str(target)] = entry
+                rule_matches_by_rule.setdefault(rule, []).extend(
+                    RuleMatch.from_pattern_match(
+                        rule.id,
+                        PatternMatch(cached_match["pattern_match"]),
+                        message=cached_match["message"],
+                        metadata=rule.metadata,
+                        severity=rule.severity,
+                        fix=cached_match["fix"],
+                        fix_regex=rule.fix_regex,
+                    )
+                    for cached_match in entry["matches"]
+                )
+                errors.extend(
+                    CoreException.from_json(
+                        cached_error["error"], cached_error["language"], rule.id
+                    ).into_semgrep_error()
+                    for cached_error in entry["errors"]
+                )
+                all_targets.add(target)
+                num_hits += 1
+            # keep the order of a full run stable whatever the pairs that were run
+            rule_matches_by_rule.setdefault(rule, []).sort(
+                key=lambda rule_match: (
+                    rule_match.path,
+                    rule_match.start["line"],
+                    rule_match.start["col"],
+                    rule_match.end["line"],
+                    rule_match.end["col"],
+                )
+            )
+        logger.debug(f"reused cached results for {num_hits} (rule, file) pairs")
+
+        # only keep the rules and targets of this run, so that the cache does not
+        # grow forever, and so that all the rules were run on all the targets
+        self._files = {
+            str(target): self._file_hashes[target]
+            for target in all_targets
+            if target in self._file_hashes and target not in timed_out
+        }
+        self._rules = rules
+        return rule_matches_by_rule, errors, all_targets
+
+    def save(self) -> None:
+        """
+        Write the cache to disk, atomically so that concurrent runs cannot
+        corrupt it
+        """
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self._path.parent, prefix=f".{self._path.name}."
+        )
+        try:
+            with os.fdopen(fd, "w") as tmp_file:
+                json.dump(
+                    {
+                        "settings": self._settings,
+                        "files": self._files,
+                        "rules": self._rules,
+                    },
+                    tmp_file,
+                )
+            os.replace(tmp_path, self._path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
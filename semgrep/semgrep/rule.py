@@ -30,6 +30,7 @@ from semgrep.semgrep_types import YAML_TAINT_MUST_HAVE_KEYS
 from semgrep.target_manager_extensions import JAVASCRIPT_LANGUAGES
 from semgrep.target_manager_extensions import REGEX_LANGUAGES
 from semgrep.target_manager_extensions import TYPESCRIPT_LANGUAGES
+from semgrep.where_python import WherePython
 
 
 class Rule:
@@ -39,6 +40,8 @@ class Rule:
 
         # For tracking errors from semgrep-core
         self._pattern_spans: Dict[PatternId, Span] = {}
+        # pattern-where-python expressions, compiled when first evaluated
+        self._where_python: Dict[str, WherePython] = {}
 
         paths_tree: Optional[YamlTree] = self._yaml.value.get("paths")
         if paths_tree is None:
@@ -308,6 +311,11 @@ class Rule:
     def fix_regex(self) -> Optional[Dict[str, Any]]:  # type: ignore
         return self._raw.get("fix-regex")
 
+    def where_python(self, where_expression: str) -> WherePython:
+        if where_expression not in self._where_python:
+            self._where_python[where_expression] = WherePython(where_expression)
+        return self._where_python[where_expression]
+
     @property
     def equivalences(self) -> List[Equivalence]:
         # Use 'i' to make equivalence id's unique
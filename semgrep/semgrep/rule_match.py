@@ -1,4 +1,3 @@
-import itertools
 from copy import deepcopy
 from pathlib import Path
 from typing import Any
@@ -11,6 +10,7 @@ import attr
 
 from semgrep.external.junit_xml import TestCase  # type: ignore[attr-defined]
 from semgrep.pattern_match import PatternMatch
+from semgrep.source_cache import source_cache
 
 
 @attr.s(frozen=True)
@@ -124,9 +124,7 @@ class RuleMatch:
         except KeyError:
             pass
 
-        # buffering=1 turns on line-level reads
-        with self.path.open(buffering=1, errors="replace") as fd:
-            result = list(itertools.islice(fd, start_line, end_line))
+        result = source_cache.lines(self.path, start_line, end_line)
 
         self._lines_cache[(start_line, end_line)] = result
         return result
@@ -136,7 +134,7 @@ class RuleMatch:
         return self._severity in {"WARNING", "ERROR"}
 
     def to_json(self) -> Dict[str, Any]:
-        json_obj = deepcopy(self._pattern_match._raw_json)
+        json_obj = deepcopy(self._pattern_match.to_json())
         json_obj["check_id"] = self._id
         json_obj["extra"]["message"] = self._message
         json_obj["extra"]["metadata"] = self._metadata
@@ -12,6 +12,7 @@ from typing import Union
 
 import attr
 
+from semgrep import __VERSION__
 from semgrep.autofix import apply_fixes
 from semgrep.config_resolver import get_config
 from semgrep.constants import COMMA_SEPARATED_LIST_RE
@@ -23,9 +24,14 @@ from semgrep.error import MISSING_CONFIG_EXIT_CODE
 from semgrep.error import SemgrepError
 from semgrep.output import OutputHandler
 from semgrep.output import OutputSettings
+from semgrep.parsing_cache import ParsingCache
+from semgrep.parsing_cache import semgrep_core_version
+from semgrep.pattern_match import clear_path_cache
 from semgrep.profile_manager import ProfileManager
+from semgrep.result_cache import ResultCache
 from semgrep.rule import Rule
 from semgrep.rule_match import RuleMatch
+from semgrep.source_cache import source_cache
 from semgrep.target_manager import TargetManager
 
 logger = logging.getLogger(__name__)
@@ -150,6 +156,7 @@ def main(
     configs: List[str],
     no_rewrite_rule_ids: bool = False,
     jobs: int = 1,
+    parallel_rules: int = 1,
     include: Optional[List[str]] = None,
     exclude: Optional[List[str]] = None,
     strict: bool = False,
@@ -165,6 +172,12 @@ def main(
     severity: Optional[List[str]] = None,
     report_time: bool = False,
     optimizations: str = "none",
+    batch_rules: bool = False,
+    prefilter: bool = True,
+    parsing_cache: Optional[ParsingCache] = None,
+    incremental_cache: Optional[Path] = None,
+    baseline_ref: Optional[str] = None,
+    baseline_changed_lines: bool = False,
 ) -> None:
     if include is None:
         include = []
@@ -172,6 +185,10 @@ def main(
     if exclude is None:
         exclude = []
 
+    # targets may have changed since the previous run in this process
+    source_cache.clear()
+    clear_path_cache()
+
     configs_obj, errors = get_config(pattern, lang, configs)
     all_rules = configs_obj.get_rules(no_rewrite_rule_ids)
 
@@ -227,10 +244,28 @@ The two most popular are:
         respect_git_ignore=respect_git_ignore,
         output_handler=output_handler,
         skip_unknown_extensions=skip_unknown_extensions,
+        baseline_ref=baseline_ref,
     )
 
     profiler = ProfileManager()
 
+    result_cache = None
+    if incremental_cache is not None:
+        result_cache = ResultCache(
+            incremental_cache,
+            settings={
+                "semgrep": __VERSION__,
+                "semgrep-core": semgrep_core_version(),
+                "allow_exec": dangerously_allow_arbitrary_code_execution_from_rules,
+                "timeout": timeout,
+                "max_memory": max_memory,
+                # batched rules share the timeout and errors of a file
+                "batch_rules": batch_rules,
+                "optimizations": optimizations,
+                "prefilter": prefilter,
+            },
+        )
+
     start_time = time.time()
     # actually invoke semgrep
     (
@@ -242,15 +277,39 @@ The two most popular are:
     ) = CoreRunner(
         allow_exec=dangerously_allow_arbitrary_code_execution_from_rules,
         jobs=jobs,
+        parallel_rules=parallel_rules,
         timeout=timeout,
         max_memory=max_memory,
         timeout_threshold=timeout_threshold,
         report_time=report_time,
+        batch_rules=batch_rules,
+        prefilter=prefilter,
+        parsing_cache=parsing_cache,
+        result_cache=result_cache,
+        debug=output_handler.settings.debug,
     ).invoke_semgrep(
         target_manager, profiler, filtered_rules, optimizations
     )
     profiler.save("total_time", start_time)
 
+    if result_cache is not None:
+        rule_matches_by_rule, semgrep_errors, all_targets = result_cache.merge(
+            rule_matches_by_rule, semgrep_errors, all_targets
+        )
+        result_cache.save()
+
+    if baseline_ref is not None and baseline_changed_lines:
+        rule_matches_by_rule = {
+            rule: [
+                rule_match
+                for rule_match in rule_matches
+                if target_manager.in_changed_lines(
+                    rule_match.path, rule_match.start["line"], rule_match.end["line"]
+                )
+            ]
+            for rule, rule_matches in rule_matches_by_rule.items()
+        }
+
     output_handler.handle_semgrep_errors(semgrep_errors)
 
     rule_matches_by_rule = {
@@ -90,12 +90,55 @@ def pattern_names_for_operators(operators: List[Operator]) -> List[str]:
 ALLOWED_GLOB_TYPES = ("include", "exclude")
 
 
+class FrozenDict(Dict[str, Any]):
+    """
+    A dict that cannot be modified, so that it can be shared instead of copied
+    """
+
+    def _immutable(self, *args: Any, **kwargs: Any) -> None:
+        raise TypeError(f"{self.__class__.__name__} is immutable")
+
+    __setitem__ = _immutable
+    __delitem__ = _immutable
+    clear = _immutable
+    pop = _immutable
+    popitem = _immutable  # type: ignore
+    setdefault = _immutable
+    update = _immutable
+
+    def __reduce__(self) -> Any:
+        return (self.__class__, (dict(self),))
+
+    def __copy__(self) -> "FrozenDict":
+        return self
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> "FrozenDict":
+        return self
+
+
+EMPTY_METAVARIABLES = FrozenDict()
+
+
 @functools.total_ordering
 class Range(NamedTuple):
     start: int
     end: int
     metavariables: Mapping[str, Any]
-    propagated_metavariables: Dict[str, Any] = {}
+    propagated_metavariables: FrozenDict = EMPTY_METAVARIABLES
+
+    def with_propagated_metavariables(
+        self, metavariables: Mapping[str, Any]
+    ) -> "Range":
+        """
+        Return a copy of this range that also has METAVARIABLES propagated
+        """
+        if not metavariables:
+            return self
+        return self._replace(
+            propagated_metavariables=FrozenDict(
+                {**self.propagated_metavariables, **metavariables}
+            )
+        )
 
     def is_enclosing_or_eq(self, rhs: "Range") -> bool:
         return self.is_range_enclosing_or_eq(rhs) and self.metavariables_match(rhs)
@@ -0,0 +1,142 @@
+"""
+Contents of the target files, read once per run
+
+Evaluating rules, checking nosem comments, autofixing and printing findings all
+need parts of the targets. They read them through the shared `source_cache`,
+which keeps the most recently used files in memory up to a maximum total size.
+Large files are memory mapped rather than read, so that only the pages that are
+needed get loaded.
+
+Offsets reported by semgrep-core are byte offsets, so the contents are kept as
+bytes and only the slices that are needed get decoded.
+"""
+import collections
+import io
+import mmap
+import os
+import threading
+from pathlib import Path
+from typing import List
+from typing import Optional
+from typing import Union
+
+from semgrep.constants import DEFAULT_SOURCE_CACHE_MAX_SIZE
+from semgrep.constants import DEFAULT_SOURCE_CACHE_MMAP_MIN_SIZE
+
+
+class _Source:
+    def __init__(self, path: Path, mmap_min_size: int) -> None:
+        self.data: Union[bytes, mmap.mmap]
+        with path.open("rb") as fd:
+            file_size = os.fstat(fd.fileno()).st_size
+            # empty files cannot be mapped
+            if file_size > 0 and file_size >= mmap_min_size:
+                self.data = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self.data = fd.read()
+        self.lines: Optional[List[str]] = None
+
+    @property
+    def size(self) -> int:
+        # decoded lines take about as much memory as the contents
+        return len(self.data) * (1 if self.lines is None else 2)
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
+class SourceCache:
+    def __init__(
+        self,
+        max_size: int = DEFAULT_SOURCE_CACHE_MAX_SIZE,
+        mmap_min_size: int = DEFAULT_SOURCE_CACHE_MMAP_MIN_SIZE,
+    ) -> None:
+        self.max_size = max_size  # in bytes
+        # files of at least this many bytes are memory mapped
+        self.mmap_min_size = mmap_min_size
+        self._sources: "collections.OrderedDict[Path, _Source]" = (
+            collections.OrderedDict()
+        )
+        self._size = 0
+        # rules may be evaluated in several threads, see --parallel-rules
+        self._lock = threading.RLock()
+
+    def _get(self, path: Path) -> _Source:
+        source = self._sources.get(path)
+        if source is None:
+            source = _Source(path, self.mmap_min_size)
+            self._sources[path] = source
+            self._size += source.size
+            self._evict()
+        else:
+            self._sources.move_to_end(path)
+        return source
+
+    def _evict(self) -> None:
+        """
+        Drop the least recently used files until the cache fits in its maximum
+        size, but always keep the last file read
+        """
+        while self._size > self.max_size and len(self._sources) > 1:
+            _, source = self._sources.popitem(last=False)
+            self._size -= source.size
+            source.close()
+
+    def read(self, path: Path, start_offset: int, end_offset: int) -> str:
+        """
+        Return the text between two byte offsets of PATH, ignoring non-utf8 bytes
+        """
+        with self._lock:
+            data = self._get(path).data[start_offset:end_offset]
+        return data.decode("utf-8", errors="replace")
+
+    def read_bytes(self, path: Path) -> bytes:
+        with self._lock:
+            return self._get(path).data[:]
+
+    def read_text(self, path: Path) -> str:
+        """
+        Return the contents of PATH like Path.read_text, i.e. with universal
+        newlines and failing on non-utf8 bytes
+        """
+        with io.TextIOWrapper(io.BytesIO(self.read_bytes(path)), "utf-8") as fd:
+            return fd.read()
+
+    def lines(self, path: Path, start_line: int, end_line: int) -> List[str]:
+        """
+        Return lines START_LINE (inclusive) to END_LINE (exclusive) of PATH,
+        zero-indexed and with their newlines, ignoring non-utf8 bytes
+        """
+        with self._lock:
+            source = self._get(path)
+            if source.lines is None:
+                with io.TextIOWrapper(
+                    io.BytesIO(source.data[:]), "utf-8", errors="replace"
+                ) as fd:
+                    lines = list(fd)
+                self._size -= source.size
+                source.lines = lines
+                self._size += source.size
+                self._evict()
+            return source.lines[start_line:end_line]
+
+    def invalidate(self, path: Path) -> None:
+        """
+        Forget the contents of PATH, e.g. after modifying it
+        """
+        with self._lock:
+            source = self._sources.pop(path, None)
+            if source is not None:
+                self._size -= source.size
+                source.close()
+
+    def clear(self) -> None:
+        with self._lock:
+            for source in self._sources.values():
+                source.close()
+            self._sources.clear()
+            self._size = 0
+
+
+source_cache = SourceCache()
@@ -0,0 +1,57 @@
+"""
+Files listing the targets of semgrep-core, for its -target_file option
+
+Rules usually share their targets, so instead of writing a new file for each
+semgrep-core invocation, each distinct list of targets is written once per run,
+to a file named after the hash of its content. A list is looked up by the
+targets of a rule and the targets pruned from them (see
+CoreRunner._prefilter_targets), rather than by the targets left, so that rules
+with the same targets and pruned targets never build their list again.
+"""
+import contextlib
+import hashlib
+import tempfile
+import threading
+from pathlib import Path
+from typing import AbstractSet
+from typing import Dict
+from typing import FrozenSet
+from typing import Iterator
+from typing import Sequence
+from typing import Tuple
+
+
+class TargetFileCache:
+    def __init__(self, directory: Path) -> None:
+        self._directory = directory
+        self._paths: Dict[Tuple[Tuple[Path, ...], FrozenSet[Path]], str] = {}
+        self._lock = threading.Lock()
+
+    def path(
+        self, targets: Sequence[Path], pruned: AbstractSet[Path] = frozenset()
+    ) -> str:
+        """
+        Return the path of a file listing TARGETS but PRUNED, one per line
+        """
+        key = (tuple(targets), frozenset(pruned))
+        with self._lock:
+            if key not in self._paths:
+                content = "\n".join(
+                    str(target) for target in key[0] if target not in pruned
+                ).encode("utf-8", errors="surrogateescape")
+                target_file = (
+                    self._directory / f"{hashlib.sha256(content).hexdigest()}.targets"
+                )
+                if not target_file.exists():
+                    target_file.write_bytes(content)
+                self._paths[key] = str(target_file)
+            return self._paths[key]
+
+
+@contextlib.contextmanager
+def target_file_cache() -> Iterator[TargetFileCache]:
+    """
+    Yield a TargetFileCache whose files are removed at the end of the run
+    """
+    with tempfile.TemporaryDirectory(prefix="semgrep-targets-") as directory:
+        yield TargetFileCache(Path(directory))
@@ -1,23 +1,29 @@
 import contextlib
 import os
+import re
 import subprocess
 import sys
 import tempfile
 from pathlib import Path
+from typing import cast
 from typing import Collection
 from typing import Dict
+from typing import FrozenSet
 from typing import Iterator
 from typing import List
+from typing import Optional
 from typing import Set
+from typing import Tuple
 
 import attr
 
 from semgrep.config_resolver import resolve_targets
 from semgrep.error import FilesNotFoundError
+from semgrep.error import SemgrepError
+from semgrep.glob_matcher import glob_matcher
 from semgrep.output import OutputHandler
 from semgrep.semgrep_types import Language
 from semgrep.target_manager_extensions import ALL_EXTENSIONS
-from semgrep.target_manager_extensions import FileExtension
 from semgrep.target_manager_extensions import lang_to_exts
 from semgrep.util import partition_set
 from semgrep.util import sub_check_output
@@ -40,6 +46,54 @@ def optional_stdin_target(target: List[str]) -> Iterator[List[str]]:
         yield target
 
 
+DIFF_OLD_FILE_RE = re.compile(r"^--- ")
+DIFF_FILE_RE = re.compile(r"^\+\+\+ (?:b/)?(.*)$")
+DIFF_HUNK_RE = re.compile(r"^@@ -\d+(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+def _parse_diff_hunks(diff: str, root: str) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Return the (start, end) ranges of lines added by each file of a git diff
+    with --unified=0 run in ROOT, by absolute path of the file
+
+    A hunk that only deletes lines counts the lines on each side of the
+    deletion as changed.
+    """
+    hunks: Dict[str, List[Tuple[int, int]]] = {}
+    current: List[Tuple[int, int]] = []
+    # lines left in the current hunk, which may look like headers
+    hunk_lines = 0
+    previous = ""
+    for line in diff.splitlines():
+        if hunk_lines > 0:
+            # "\ No newline at end of file" is not a line of the hunk
+            if not line.startswith("\\"):
+                hunk_lines -= 1
+            continue
+        file_match = DIFF_FILE_RE.match(line)
+        if file_match and DIFF_OLD_FILE_RE.match(previous):
+            path = file_match.group(1)
+            if path.startswith('"'):
+                # git quotes paths with unusual characters
+                path = path[1:-1].encode("latin-1").decode("unicode_escape")
+                path = path.encode("latin-1").decode("utf-8", errors="replace")
+                path = path[2:] if path.startswith("b/") else path
+            current = hunks.setdefault(os.path.normpath(os.path.join(root, path)), [])
+        hunk_match = DIFF_HUNK_RE.match(line)
+        if hunk_match:
+            old_count = int(hunk_match.group(1)) if hunk_match.group(1) else 1
+            start = int(hunk_match.group(2))
+            count = int(hunk_match.group(3)) if hunk_match.group(3) else 1
+            hunk_lines = old_count + count
+            if count > 0:
+                current.append((start, start + count - 1))
+            else:
+                # the lines were deleted after line START
+                current.append((max(start, 1), start + 1))
+        previous = line
+    return hunks
+
+
 @attr.s(auto_attribs=True)
 class TargetManager:
     """
@@ -51,6 +105,9 @@ class TargetManager:
     If skip_unknown_extensions is False then targets with extensions that are
     not understood by semgrep will always be returned by get_files. Else will discard
     targets with unknown extensions
+
+    If baseline_ref is set then will only consider files that were added or
+    modified since that git ref
     """
 
     includes: List[str]
@@ -59,8 +116,19 @@ class TargetManager:
     respect_git_ignore: bool
     output_handler: OutputHandler
     skip_unknown_extensions: bool
+    baseline_ref: Optional[str] = None
 
     _filtered_targets: Dict[str, Set[Path]] = attr.ib(factory=dict)
+    _rule_targets: Dict[
+        Tuple[Language, FrozenSet[str], FrozenSet[str]], Tuple[Path, ...]
+    ] = attr.ib(factory=dict, init=False)
+    _files_cache: Dict[Tuple[Path, bool], Dict[str, List[Path]]] = attr.ib(
+        factory=dict, init=False
+    )
+    _changed_files: Optional[Set[str]] = attr.ib(default=None, init=False)
+    _changed_lines: Optional[Dict[str, List[Tuple[int, int]]]] = attr.ib(
+        default=None, init=False
+    )
 
     @staticmethod
     def resolve_targets(targets: List[str]) -> Set[Path]:
@@ -75,99 +143,110 @@ class TargetManager:
         return os.access(path, os.R_OK) and path.exists() and not path.is_symlink()
 
     @staticmethod
-    def _expand_dir(
-        curr_dir: Path, language: Language, respect_git_ignore: bool
-    ) -> Set[Path]:
+    def _git_files(curr_dir: Path) -> Optional[List[Path]]:
         """
-        Recursively go through a directory and return list of all files with
-        default file extension of language
+        Return all files in curr_dir that are tracked or (untracked but not
+        ignored) by git, or None if curr_dir is not in a git repository
         """
+        try:
+            output = sub_check_output(
+                ["git", "ls-files", "-z", "--cached", "--others", "--exclude-standard"],
+                cwd=curr_dir.resolve(),
+                encoding="utf-8",
+                errors="surrogateescape",
+                stderr=subprocess.DEVNULL,
+            )
+        except (subprocess.CalledProcessError, FileNotFoundError):
+            return None
 
-        def _parse_output(output: str, curr_dir: Path) -> Set[Path]:
-            """
-            Convert a newline delimited list of files to a set of path objects
-            prepends curr_dir to all paths in said list
-
-            If list is empty then returns an empty set
-            """
-            files: Set[Path] = set()
-            if output:
-                files = {
-                    p
-                    for p in (
-                        Path(curr_dir) / elem for elem in output.strip().split("\n")
-                    )
-                    if TargetManager._is_valid(p)
-                }
-            return files
-
-        def _find_files_with_extension(
-            curr_dir: Path, extension: FileExtension
-        ) -> Set[Path]:
-            """
-            Return set of all files in curr_dir with given extension
-            """
-            return {
-                p
-                for p in curr_dir.rglob(f"*{extension}")
-                if TargetManager._is_valid(p) and p.is_file()
-            }
-
-        extensions = lang_to_exts(language)
-        expanded: Set[Path] = set()
+        # tracked files that were deleted are still listed, so check that
+        # every file exists
+        return [
+            p
+            for p in (curr_dir / elem for elem in set(output.split("\0")) if elem)
+            if TargetManager._is_valid(p)
+        ]
 
-        for ext in extensions:
-            if respect_git_ignore:
-                try:
-                    # Tracked files
-                    tracked_output = sub_check_output(
-                        ["git", "ls-files", f"*{ext}"],
-                        cwd=curr_dir.resolve(),
-                        encoding="utf-8",
-                        stderr=subprocess.DEVNULL,
-                    )
+    @staticmethod
+    def _walk_dir(curr_dir: Path, excludes: Collection[str]) -> List[Path]:
+        """
+        Return all files in curr_dir, without descending into directories that
+        match any glob in excludes or following symlinks
+        """
+        exclude_matcher = glob_matcher(excludes)
+        files = []
+        dirs = [curr_dir]
+        while dirs:
+            current = dirs.pop()
+            try:
+                with os.scandir(current) as entries:
+                    for entry in entries:
+                        path = current / entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if not exclude_matcher.match_path(path):
+                                dirs.append(path)
+                        elif entry.is_file(follow_symlinks=False) and os.access(
+                            entry.path, os.R_OK
+                        ):
+                            files.append(path)
+            except OSError:
+                continue
+        return files
 
-                    # Untracked but not ignored files
-                    untracked_output = sub_check_output(
-                        [
-                            "git",
-                            "ls-files",
-                            "--other",
-                            "--exclude-standard",
-                            f"*{ext}",
-                        ],
-                        cwd=curr_dir.resolve(),
-                        encoding="utf-8",
-                        stderr=subprocess.DEVNULL,
-                    )
+    @staticmethod
+    def _files_by_extension(files: List[Path]) -> Dict[str, List[Path]]:
+        """
+        Bucket files by the extension at the end of their name, the "" bucket
+        holding all files
+        """
+        buckets: Dict[str, List[Path]] = {"": files}
+        for path in files:
+            name = path.name
+            dot = name.rfind(".")
+            if dot != -1:
+                buckets.setdefault(name[dot:], []).append(path)
+        return buckets
 
-                    deleted_output = sub_check_output(
-                        ["git", "ls-files", "--deleted", f"*{ext}"],
-                        cwd=curr_dir.resolve(),
-                        encoding="utf-8",
-                        stderr=subprocess.DEVNULL,
-                    )
-                except (subprocess.CalledProcessError, FileNotFoundError):
-                    # Not a git directory or git not installed. Fallback to using rglob
-                    ext_files = _find_files_with_extension(curr_dir, ext)
-                    expanded = expanded.union(ext_files)
-                else:
-                    tracked = _parse_output(tracked_output, curr_dir)
-                    untracked_unignored = _parse_output(untracked_output, curr_dir)
-                    deleted = _parse_output(deleted_output, curr_dir)
-                    expanded = expanded.union(tracked)
-                    expanded = expanded.union(untracked_unignored)
-                    expanded = expanded.difference(deleted)
+    @staticmethod
+    def _expand_dir(
+        curr_dir: Path,
+        language: Language,
+        respect_git_ignore: bool,
+        files_cache: Optional[Dict[Tuple[Path, bool], Dict[str, List[Path]]]] = None,
+        excludes: Collection[str] = (),
+    ) -> Set[Path]:
+        """
+        Recursively go through a directory and return list of all files with
+        default file extension of language
 
-            else:
-                ext_files = _find_files_with_extension(curr_dir, ext)
-                expanded = expanded.union(ext_files)
+        The files of curr_dir are listed once, then cached in FILES_CACHE by
+        extension so that all languages share the listing. Directories that
+        match any glob in EXCLUDES are not listed when git is not used.
+        """
+        if files_cache is None:
+            files_cache = {}
+        key = (curr_dir, respect_git_ignore)
+        if key not in files_cache:
+            files = TargetManager._git_files(curr_dir) if respect_git_ignore else None
+            if files is None:
+                # Not a git directory or git not installed. Fallback to walking
+                # the directory
+                files = TargetManager._walk_dir(curr_dir, excludes)
+            files_cache[key] = TargetManager._files_by_extension(files)
+        files_by_extension = files_cache[key]
 
+        expanded: Set[Path] = set()
+        for ext in lang_to_exts(language):
+            expanded.update(files_by_extension.get(ext, []))
         return expanded
 
     @staticmethod
     def expand_targets(
-        targets: Collection[Path], lang: Language, respect_git_ignore: bool
+        targets: Collection[Path],
+        lang: Language,
+        respect_git_ignore: bool,
+        files_cache: Optional[Dict[Tuple[Path, bool], Dict[str, List[Path]]]] = None,
+        excludes: Collection[str] = (),
     ) -> Set[Path]:
         """
         Explore all directories. Remove duplicates
@@ -179,7 +258,9 @@ class TargetManager:
 
             if target.is_dir():
                 expanded.update(
-                    TargetManager._expand_dir(target, lang, respect_git_ignore)
+                    TargetManager._expand_dir(
+                        target, lang, respect_git_ignore, files_cache, excludes
+                    )
                 )
             else:
                 expanded.add(target)
@@ -191,8 +272,7 @@ class TargetManager:
         """
         Return true if path or any parent of path matches any glob in globs
         """
-        subpaths = [path, *path.parents]
-        return any(p.match(glob) for p in subpaths for glob in globs)
+        return glob_matcher(globs).match(path)
 
     @staticmethod
     def filter_includes(arr: Set[Path], includes: List[str]) -> Set[Path]:
@@ -204,14 +284,19 @@ class TargetManager:
         if not includes:
             return arr
 
-        return set(elem for elem in arr if TargetManager.match_glob(elem, includes))
+        include_matcher = glob_matcher(includes)
+        return set(elem for elem in arr if include_matcher.match(elem))
 
     @staticmethod
     def filter_excludes(arr: Set[Path], excludes: List[str]) -> Set[Path]:
         """
         Returns all elements in arr that do not match any excludes excludes
         """
-        return set(elem for elem in arr if not TargetManager.match_glob(elem, excludes))
+        if not excludes:
+            return arr
+
+        exclude_matcher = glob_matcher(excludes)
+        return set(elem for elem in arr if not exclude_matcher.match(elem))
 
     def filtered_files(self, lang: Language) -> Set[Path]:
         """
@@ -237,9 +322,12 @@ class TargetManager:
                 FilesNotFoundError(tuple(nonexistent_files))
             )
 
-        targets = self.expand_targets(directories, lang, self.respect_git_ignore)
+        excludes = self.excludes + [".git"]
+        targets = self.expand_targets(
+            directories, lang, self.respect_git_ignore, self._files_cache, excludes
+        )
         targets = self.filter_includes(targets, self.includes)
-        targets = self.filter_excludes(targets, self.excludes + [".git"])
+        targets = self.filter_excludes(targets, excludes)
 
         # Remove explicit_files with known extensions.
         explicit_files_with_lang_extension = set(
@@ -257,14 +345,121 @@ class TargetManager:
             )
             targets = targets.union(explicit_files_with_unknown_extensions)
 
+        if self.baseline_ref is not None:
+            changed_files = self.changed_files()
+            targets = set(t for t in targets if os.path.realpath(t) in changed_files)
+
         self._filtered_targets[lang] = targets
         return self._filtered_targets[lang]
 
+    def _git_roots(self) -> Set[str]:
+        """
+        Return the root directories of the git repositories of the targets
+        """
+        roots = set()
+        for target in self.resolve_targets(self.targets):
+            directory = target if target.is_dir() else target.parent
+            try:
+                output = sub_check_output(
+                    ["git", "-C", str(directory), "rev-parse", "--show-toplevel"],
+                    encoding="utf-8",
+                    stderr=subprocess.PIPE,
+                )
+            except subprocess.CalledProcessError as e:
+                raise SemgrepError(
+                    f"--baseline-ref requires {target} to be in a git repository: {e.stderr.strip()}"
+                )
+            except FileNotFoundError:
+                raise SemgrepError("--baseline-ref requires git to be installed")
+            roots.add(os.path.realpath(cast(str, output).rstrip("\n")))
+        return roots
+
+    def _git(self, root: str, *args: str) -> str:
+        """
+        Return the output of a git command run in the repository at ROOT
+        """
+        try:
+            return cast(
+                str,
+                sub_check_output(
+                    ["git", "-C", root, *args],
+                    encoding="utf-8",
+                    stderr=subprocess.PIPE,
+                ),
+            )
+        except subprocess.CalledProcessError as e:
+            raise SemgrepError(
+                f"could not list files changed since {self.baseline_ref}: {e.stderr.strip()}"
+            )
+        except FileNotFoundError:
+            raise SemgrepError("--baseline-ref requires git to be installed")
+
+    def _git_diff(self, root: str, *args: str) -> str:
+        """
+        Return the output of git diff between self.BASELINE_REF and the working
+        tree of the repository at ROOT, with paths relative to ROOT
+        """
+        return self._git(
+            root,
+            "diff",
+            "--diff-filter=ACMRT",
+            *args,
+            cast(str, self.baseline_ref),
+            "--",
+        )
+
+    def _untracked_files(self, root: str) -> List[str]:
+        """
+        Return the real paths of the files of the repository at ROOT that are
+        neither tracked nor ignored, which git diff does not list
+        """
+        output = self._git(root, "ls-files", "--others", "--exclude-standard", "-z")
+        return [
+            os.path.normpath(os.path.join(root, path))
+            for path in output.split("\0")
+            if path
+        ]
+
+    def changed_files(self) -> Set[str]:
+        """
+        Return the real paths of files added or modified since self.BASELINE_REF,
+        including untracked files
+        """
+        if self._changed_files is None:
+            self._changed_files = set()
+            for root in self._git_roots():
+                self._changed_files.update(
+                    os.path.normpath(os.path.join(root, path))
+                    for path in self._git_diff(root, "--name-only", "-z").split("\0")
+                    if path
+                )
+                self._changed_files.update(self._untracked_files(root))
+        return self._changed_files
+
+    def in_changed_lines(self, path: Path, start_line: int, end_line: int) -> bool:
+        """
+        Return true if any line between START_LINE and END_LINE (one indexed,
+        inclusive) of PATH was added or modified since self.BASELINE_REF, which
+        is every line of an untracked file
+        """
+        if self._changed_lines is None:
+            self._changed_lines = {}
+            for root in self._git_roots():
+                self._changed_lines.update(
+                    _parse_diff_hunks(self._git_diff(root, "--unified=0"), root)
+                )
+                for untracked in self._untracked_files(root):
+                    self._changed_lines[untracked] = [(1, sys.maxsize)]
+        return any(
+            start <= end_line and start_line <= end
+            for start, end in self._changed_lines.get(os.path.realpath(path), [])
+        )
+
     def get_files(
         self, lang: Language, includes: List[str], excludes: List[str]
-    ) -> List[Path]:
+    ) -> Tuple[Path, ...]:
         """
-        Returns list of files that should be analyzed for a LANG
+        Returns the files that should be analyzed for a LANG
 
         Given this object's TARGET, self.INCLUDE, and self.EXCLUDE will return list
         of all descendant files of directories in TARGET that end in extension
@@ -273,8 +468,14 @@ class TargetManager:
         an ancestor that matches a pattern in self.EXCLUDES. Any explicitly named files
         in TARGET will bypass this global INCLUDE/EXCLUDE filter. The local INCLUDE/EXCLUDE
         filter is then applied.
+
+        The result is shared by all the calls with the same LANG, INCLUDES and
+        EXCLUDES, e.g. for rules with the same `paths:` filters.
         """
-        targets = self.filtered_files(lang)
-        targets = self.filter_includes(targets, includes)
-        targets = self.filter_excludes(targets, excludes)
-        return list(targets)
+        key = (lang, frozenset(includes), frozenset(excludes))
+        if key not in self._rule_targets:
+            targets = self.filtered_files(lang)
+            targets = self.filter_includes(targets, includes)
+            targets = self.filter_excludes(targets, excludes)
+            self._rule_targets[key] = tuple(targets)
+        return self._rule_targets[key]
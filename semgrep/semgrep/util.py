@@ -151,6 +151,14 @@ def sub_run(cmd: List[str], **kwargs: Any) -> Any:
     return result
 
 
+def sub_popen(cmd: List[str], **kwargs: Any) -> Any:
+    """A simple proxy function to minimize and centralize subprocess usage."""
+    # fmt: off
+    process = subprocess.Popen(cmd, **kwargs)  # nosem: python.lang.security.audit.dangerous-subprocess-use.dangerous-subprocess-use
+    # fmt: on
+    return process
+
+
 def sub_check_output(cmd: List[str], **kwargs: Any) -> Any:
     """A simple proxy function to minimize and centralize subprocess usage."""
     # fmt: off
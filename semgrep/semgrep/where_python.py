@@ -0,0 +1,64 @@
+import logging
+from types import CodeType
+from typing import Dict
+from typing import Tuple
+from typing import Union
+
+from semgrep.error import SemgrepError
+
+logger = logging.getLogger(__name__)
+
+RETURN_VAR = "semgrep_pattern_return"
+
+
+class WherePython:
+    """
+    A pattern-where-python expression, compiled once
+
+    The result of the expression is cached by the values of the metavariables,
+    since they are all it gets to see.
+    """
+
+    def __init__(self, where_expression: str) -> None:
+        self.where_expression = where_expression
+        lines = where_expression.strip().split("\n")
+        to_eval = "\n".join(lines[:-1] + [f"{RETURN_VAR} = {lines[-1]}"])
+        # the error is reported each time the expression is evaluated
+        self._code: Union[CodeType, SyntaxError]
+        try:
+            self._code = compile(to_eval, "<pattern-where-python>", "exec")
+        except SyntaxError as ex:
+            self._code = ex
+        self._results: Dict[Tuple[Tuple[str, str], ...], bool] = {}
+
+    def evaluate(self, metavariable_values: Dict[str, str]) -> bool:
+        key = tuple(sorted(metavariable_values.items()))
+        if key not in self._results:
+            self._results[key] = self._evaluate(metavariable_values)
+        return self._results[key]
+
+    def _evaluate(self, metavariable_values: Dict[str, str]) -> bool:
+        result = False
+        scope = {"vars": dict(metavariable_values)}
+
+        try:
+            if isinstance(self._code, SyntaxError):
+                raise self._code
+            # fmt: off
+            exec(self._code, scope)  # nosem: contrib.dlint.dlint-equivalent.insecure-exec-use, python.lang.security.audit.exec-detected.exec-detected
+            # fmt: on
+            result = scope[RETURN_VAR]  # type: ignore
+        except KeyError as ex:
+            logger.error(
+                f"could not find metavariable {ex} while evaluating where-python expression '{self.where_expression}', consider case where metavariable is missing"
+            )
+        except Exception as ex:
+            logger.error(
+                f"received error '{repr(ex)}' while evaluating where-python expression '{self.where_expression}'"
+            )
+
+        if not isinstance(result, bool):
+            raise SemgrepError(
+                f"where-python expression '{self.where_expression}' needs boolean output but got {result}"
+            )
+        return result
@@ -489,3 +489,30 @@ def test_taint_mode(run_semgrep_in_tmp, snapshot):
         ),
         "results.json",
     )
+
+
+@pytest.mark.parametrize(
+    "rule",
+    ["rules/eqeq.yaml", "rules/multiple-long.yaml", "rules/regex-child.yaml"],
+)
+def test_batch_rules(run_semgrep_in_tmp, rule):
+    """
+    Running rules of the same language in a single semgrep-core invocation
+    must not change the results
+    """
+    assert run_semgrep_in_tmp(rule) == run_semgrep_in_tmp(
+        rule, options=["--batch-rules"]
+    )
+
+
+@pytest.mark.parametrize(
+    "options",
+    [["--parallel-rules", "4"], ["--parallel-rules", "4", "--batch-rules"]],
+)
+def test_parallel_rules(run_semgrep_in_tmp, options):
+    """
+    Running several rules concurrently must not change the results
+    """
+    assert run_semgrep_in_tmp("rules/multiple-long.yaml") == run_semgrep_in_tmp(
+        "rules/multiple-long.yaml", options=options
+    )
@@ -0,0 +1,107 @@
+import pytest
+
+from semgrep.core_runner import CoreRunner
+from semgrep.error import MatchTimeoutError
+from semgrep.profile_manager import ProfileManager
+from semgrep.profiling import ProfilingData
+from semgrep.profiling import Times
+from semgrep.rule import Rule
+from semgrep.semgrep_types import Language
+
+
+def make_rule(rule_id, pattern):
+    return Rule.from_json(
+        {
+            "id": rule_id,
+            "pattern": pattern,
+            "severity": "INFO",
+            "languages": ["python"],
+            "message": "test",
+        }
+    )
+
+
+def test_batch_errors_and_times(tmp_path, monkeypatch):
+    rules = [make_rule("first", "foo($X)"), make_rule("second", "bar($X)")]
+    a_py, slow_py = tmp_path / "a.py", tmp_path / "slow.py"
+    runner = CoreRunner(
+        allow_exec=False,
+        jobs=1,
+        timeout=0,
+        max_memory=0,
+        timeout_threshold=0,
+        report_time=True,
+        batch_rules=True,
+    )
+    monkeypatch.setattr(runner, "get_files_for_language", lambda *args: [a_py, slow_py])
+    monkeypatch.setattr(
+        runner,
+        "_run_core_command",
+        lambda *args, **kwargs: {
+            "matches": [],
+            "errors": [
+                {
+                    "check_id": "Timeout",
+                    "path": str(slow_py),
+                    "start": {"line": 1, "col": 1},
+                    "end": {"line": 1, "col": 1},
+                    "extra": {"message": "Timeout", "line": ""},
+                }
+            ],
+            "time": {
+                "targets": [
+                    {
+                        "path": str(a_py),
+                        "parse_time": 0.5,
+                        "match_time": 1.0,
+                        "run_time": 2.0,
+                    }
+                ]
+            },
+        },
+    )
+    profiling_data = ProfilingData()
+
+    results = runner._run_batch(
+        Language("python"),
+        rules,
+        None,
+        "",
+        None,
+        {},
+        {},
+        [],
+        ProfileManager(),
+        profiling_data,
+    )
+
+    # a timeout of the batch is reported once, not once per rule
+    errors = [error for rule in rules for error in results[rule][2]]
+    assert errors == [MatchTimeoutError(path=slow_py, rule_id="first")]
+    # the time of the batch on a file is split between its rules
+    for rule in rules:
+        assert profiling_data.get_times(rule.id, str(a_py)) == Times(0.25, 0.5, 1.0)
+
+
+@pytest.mark.parametrize("prefilter", [True, False])
+def test_prefilter_targets(tmp_path, monkeypatch, prefilter):
+    rules = [make_rule("loads", "pickle.loads($X)"), make_rule("any", "$F($X)")]
+    with_loads, without_loads = tmp_path / "a.py", tmp_path / "b.py"
+    with_loads.write_text("import pickle\npickle.loads(data)\n")
+    without_loads.write_text("print(data)\n")
+    runner = CoreRunner(
+        allow_exec=False,
+        jobs=1,
+        timeout=0,
+        max_memory=0,
+        timeout_threshold=0,
+        report_time=False,
+        prefilter=prefilter,
+    )
+    monkeypatch.setattr(
+        runner, "get_files_for_language", lambda *args: [with_loads, without_loads]
+    )
+
+    pruned_targets = runner._prefilter_targets(rules, None)
+
+    assert pruned_targets == ({rules[0]: {without_loads}} if prefilter else {})
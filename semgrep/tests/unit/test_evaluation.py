@@ -1,16 +1,22 @@
 #!/usr/bin/env python3
+from pathlib import Path
 from typing import Any
 from typing import Dict
 from typing import List
 from typing import Optional
 from typing import Set
 from unittest.mock import MagicMock
+from unittest.mock import patch
 from unittest.mock import PropertyMock
 
 import pytest
 
+import semgrep.evaluation
 from semgrep.error import SemgrepError
 from semgrep.evaluation import enumerate_patterns_in_boolean_expression
+from semgrep.evaluation import evaluate
+from semgrep.evaluation import FileMatches
+from semgrep.evaluation import group_pattern_matches
 from semgrep.evaluation import evaluate_expression as raw_evaluate_expression
 from semgrep.pattern_match import PatternMatch
 from semgrep.rule import Rule
@@ -498,6 +504,32 @@ def test_evaluate_python() -> None:
     assert result == set([Range(400, 500, {})]), f"{result}"
 
 
+def test_range_index_only_for_range_operators() -> None:
+    results = {
+        PatternId("all_execs"): [
+            PatternMatchMock(400, 500, {"$X": {"abstract_content": "cmd_pattern"}}),
+        ]
+    }
+
+    expression = [
+        BooleanRuleExpression(OPERATORS.AND, PatternId("all_execs"), None, "all_execs"),
+        BooleanRuleExpression(
+            OPERATORS.WHERE_PYTHON,
+            PatternId("p1"),
+            None,
+            "vars['$X'].startswith('cmd')",
+        ),
+    ]
+
+    with patch(
+        "semgrep.evaluation.RangeIndex", wraps=semgrep.evaluation.RangeIndex
+    ) as range_index:
+        result = evaluate_expression(expression, results, allow_exec=True)
+    assert result == set([Range(400, 500, {})]), f"{result}"
+    # only the pattern compares ranges, not the where-python filter
+    assert range_index.call_count == 1
+
+
 def test_evaluate_python_exec_false() -> None:
     results = {
         PatternId("all_execs"): [
@@ -542,6 +574,49 @@ def test_evaluate_python_bad_return_type() -> None:
         evaluate_expression(expression, results, allow_exec=True)
 
 
+def test_evaluate_python_cached_per_rule() -> None:
+    rule = Rule.from_json(
+        {
+            "id": "test-id",
+            "message": "test message",
+            "languages": ["python"],
+            "severity": "ERROR",
+            "patterns": [
+                {"pattern": "exec($X)"},
+                {"pattern-where-python": "vars['$X'].startswith('cmd')"},
+            ],
+        }
+    )
+    where_python = rule.where_python("vars['$X'].startswith('cmd')")
+    assert rule.where_python("vars['$X'].startswith('cmd')") is where_python
+
+    results = {
+        PatternId("all_execs"): [
+            PatternMatchMock(400, 500, {"$X": {"abstract_content": "cmd_pattern"}}),
+            PatternMatchMock(800, 900, {"$X": {"abstract_content": "other_pattern"}}),
+            PatternMatchMock(1000, 1100, {"$X": {"abstract_content": "cmd_pattern"}}),
+        ]
+    }
+    expression = [
+        BooleanRuleExpression(OPERATORS.AND, PatternId("all_execs"), None, "all_execs"),
+        BooleanRuleExpression(
+            OPERATORS.WHERE_PYTHON,
+            PatternId("p1"),
+            None,
+            "vars['$X'].startswith('cmd')",
+        ),
+    ]
+    e = BooleanRuleExpression(OPERATORS.AND_ALL, None, expression, None)
+
+    with patch.object(
+        where_python, "_evaluate", wraps=where_python._evaluate
+    ) as evaluate:
+        result = raw_evaluate_expression(e, results, [], allow_exec=True, rule=rule)
+        assert result == {Range(400, 500, {}), Range(1000, 1100, {})}
+        # once per distinct value of $X
+        assert evaluate.call_count == 2
+
+
 def test_single_pattern_match_filtering() -> None:
     results = {
         PatternId("pattern1"): [PatternMatchMock(30, 100, {"$X": "x1", "$Y": "y1"})],
@@ -558,3 +633,74 @@ def test_single_pattern_match_filtering() -> None:
     ]
     result = evaluate_expression(expression, results)
     assert result == set(), f"{result}"
+
+
+def test_range_propagated_metavariables() -> None:
+    _range = Range(100, 200, {"$X": "x"})
+    propagated = _range.with_propagated_metavariables({"$Y": "y"})
+    assert propagated == _range
+    assert propagated.propagated_metavariables == {"$Y": "y"}
+    assert _range.propagated_metavariables == {}
+    assert propagated.with_propagated_metavariables(
+        {"$Z": "z"}
+    ).propagated_metavariables == {"$Y": "y", "$Z": "z"}
+    with pytest.raises(TypeError):
+        propagated.propagated_metavariables.update({"$Z": "z"})
+
+
+def test_debugging_steps_only_when_debugging() -> None:
+    rule = Rule.from_json(
+        {
+            "id": "test-id",
+            "message": "test message",
+            "languages": ["python"],
+            "severity": "ERROR",
+            "patterns": [{"pattern": "foo($X)"}, {"pattern-not": "foo(1)"}],
+        }
+    )
+    no_matches = FileMatches([], {})
+    assert evaluate(rule, no_matches, allow_exec=False) == ([], [])
+
+    _, steps = evaluate(rule, no_matches, allow_exec=False, debug=True)
+    assert [step["filter"] for step in steps] == [
+        "initial",
+        "pattern",
+        "pattern-not",
+        "patterns",
+    ]
+
+
+def test_group_pattern_matches() -> None:
+    def pattern_match(pattern_id: str, path: str, start: int) -> PatternMatch:
+        return PatternMatch(
+            {
+                "check_id": f"0.{pattern_id}",
+                "path": path,
+                "start": {"line": 1, "col": start + 1, "offset": start},
+                "end": {"line": 1, "col": start + 2, "offset": start + 1},
+                "extra": {"message": "", "metavars": {}},
+            }
+        )
+
+    a1, b1, a2, b2, c2 = (
+        pattern_match("a", "x.py", 1),
+        pattern_match("b", "x.py", 2),
+        pattern_match("a", "y.py", 3),
+        pattern_match("b", "y.py", 4),
+        pattern_match("c", "y.py", 5),
+    )
+    a3 = pattern_match("a", "x.py", 6)
+    grouped = group_pattern_matches([a1, b1, a2, a3, c2, b2])
+
+    assert list(grouped) == [Path("x.py"), Path("y.py")]
+    assert grouped[Path("x.py")].pattern_matches == [a1, b1, a3]
+    assert list(grouped[Path("x.py")].pattern_ids_to_pattern_matches.items()) == [
+        ("b", [b1]),
+        ("a", [a1, a3]),
+    ]
+    assert grouped[Path("y.py")].pattern_matches == [a2, c2, b2]
+    assert list(grouped[Path("y.py")].pattern_ids_to_pattern_matches) == [
+        "c",
+        "b",
+        "a",
+    ]
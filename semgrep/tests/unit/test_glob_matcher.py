@@ -0,0 +1,92 @@
+from pathlib import Path
+
+import pytest
+
+import semgrep.glob_matcher
+from semgrep.glob_matcher import glob_matcher
+from semgrep.glob_matcher import GlobMatcher
+
+PATHS = [
+    Path(p)
+    for p in [
+        "foo.py",
+        "foo/bar.py",
+        "foo/bar/baz.go",
+        "a/foo/b/c.java",
+        "/foo/bar.py",
+        "/tmp/foo/x.js",
+        "/tmp/.git/HEAD",
+        "tests/[x]/a-b.py",
+        "x/a&b/y.py",
+        "]/a]b.py",
+    ]
+]
+
+
+@pytest.mark.parametrize(
+    "glob",
+    [
+        "*",
+        "*.py",
+        "foo",
+        "foo/*.py",
+        "bar/baz.go",
+        "/foo",
+        "/tmp/*",
+        "/*/foo/*.js",
+        "?oo",
+        "*/*",
+        "[ab]",
+        "[!f]*",
+        "[!]]*",
+        "[]]",
+        "a[]]b.py",
+        "*[!]]",
+        "[a-c]*",
+        "*.[gj]*",
+        "**",
+        ".git",
+        "[x]",
+        "[[]x]",
+        "a&b",
+        "./foo",
+        "[",
+    ],
+)
+def test_same_as_path_match(glob):
+    matcher = GlobMatcher([glob])
+    for path in PATHS:
+        assert matcher.match_path(path) == path.match(glob), path
+        assert matcher.match(path) == any(
+            p.match(glob) for p in [path, *path.parents]
+        ), path
+
+
+def test_any_glob():
+    matcher = GlobMatcher(["*.go", "/tmp", "a/foo"])
+    assert [path for path in PATHS if matcher.match(path)] == [
+        Path("foo/bar/baz.go"),
+        Path("a/foo/b/c.java"),
+        Path("/tmp/foo/x.js"),
+        Path("/tmp/.git/HEAD"),
+    ]
+    assert not GlobMatcher([]).match(Path("foo.py"))
+
+
+def test_shared_matchers():
+    assert glob_matcher(["*.py", "foo"]) is glob_matcher(("foo", "*.py"))
+    assert glob_matcher(["*.py"]) is not glob_matcher(["*.go"])
+
+
+def test_bounded_caches(monkeypatch):
+    monkeypatch.setattr(semgrep.glob_matcher, "MAX_CACHED_PATHS", 2)
+    matcher = GlobMatcher(["*.py"])
+    assert [matcher.match(Path(f"{i}.py")) for i in range(5)] == [True] * 5
+    assert len(matcher._cache) <= 2
+
+    for i in range(semgrep.glob_matcher.MAX_MATCHERS + 1):
+        glob_matcher([f"{i}.py"])
+    assert (
+        semgrep.glob_matcher._glob_matcher.cache_info().currsize
+        <= semgrep.glob_matcher.MAX_MATCHERS
+    )
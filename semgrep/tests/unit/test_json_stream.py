@@ -0,0 +1,54 @@
+import io
+import json
+
+import pytest
+
+import semgrep.json_stream
+from semgrep.json_stream import JSONStreamError
+from semgrep.json_stream import load_object
+
+
+class ChunkedStream(io.RawIOBase):
+    """
+    Return at most SIZE bytes per read, like a pipe
+    """
+
+    def __init__(self, data, size):
+        self._data = data
+        self._size = size
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        chunk, self._data = self._data[: self._size], self._data[self._size :]
+        return chunk
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 5, 1 << 16])
+def test_load_object(monkeypatch, chunk_size):
+    monkeypatch.setattr(semgrep.json_stream, "CHUNK_SIZE", chunk_size)
+    output = {
+        "matches": [
+            {"path": "é.py", "start": {"line": 12345, "offset": 1.5e-10}},
+            {"path": "b.py", "extra": [True, False, None]},
+        ],
+        "errors": [],
+        "stats": {"okfiles": 1000},
+    }
+    data = json.dumps(output, indent=2).encode("utf-8") + b"\n"
+
+    result = load_object(
+        ChunkedStream(data, chunk_size), {"matches": lambda m: m["path"]}
+    )
+
+    assert result == {**output, "matches": ["é.py", "b.py"]}
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"", b"[]", b'{"matches": [1, 2}', b'{"a": 1} {}', b"Fatal error: exception\n"],
+)
+def test_invalid_output(data):
+    with pytest.raises(JSONStreamError):
+        load_object(io.BytesIO(data), {"matches": lambda m: m})
@@ -0,0 +1,125 @@
+import pytest
+
+import semgrep.literal_prefilter
+
+from semgrep.literal_prefilter import required_words
+from semgrep.literal_prefilter import satisfies
+from semgrep.literal_prefilter import target_words
+from semgrep.regex_scanner import MIN_TARGETS_PER_PROCESS
+from semgrep.rule import Rule
+
+
+def make_rule(languages=("python",), **patterns):
+    return Rule.from_json(
+        {
+            "id": "test-rule",
+            "message": "test",
+            "severity": "ERROR",
+            "languages": list(languages),
+            **patterns,
+        }
+    )
+
+
+def test_pattern_words():
+    rule = make_rule(pattern="pickle.loads($X, 'utf-8')")
+
+    assert required_words(rule) == [frozenset(["loads"]), frozenset(["pickle"])]
+
+
+@pytest.mark.parametrize(
+    "pattern",
+    [
+        "$X == $X",
+        "'foo' + $X",
+        "(String $X)",
+        "def $F(...): ...",
+        "$X: int = $Y",
+        "return 0x10",
+    ],
+)
+def test_pattern_without_words(pattern):
+    assert required_words(make_rule(pattern=pattern)) == []
+
+
+def test_patterns_and_either():
+    rule = make_rule(
+        patterns=[
+            {"pattern-inside": "with lock: ..."},
+            {
+                "pattern-either": [
+                    {"pattern": "system($X)"},
+                    {
+                        "patterns": [
+                            {"pattern": "eval($X)"},
+                            {"pattern-not": "eval('safe')"},
+                        ]
+                    },
+                ]
+            },
+            {"pattern-not-inside": "if debug: ..."},
+        ]
+    )
+
+    requirement = required_words(rule)
+
+    assert requirement == [frozenset(["lock"]), frozenset(["system", "eval"])]
+    assert satisfies(frozenset(["lock", "eval"]), requirement)
+    assert not satisfies(frozenset(["eval", "debug"]), requirement)
+
+
+def test_either_with_any_alternative():
+    rule = make_rule(
+        **{"pattern-either": [{"pattern": "system($X)"}, {"pattern": "$F($X)"}]}
+    )
+
+    assert required_words(rule) == []
+
+
+def test_keywords_of_rule_languages():
+    # semgrep matches `do ... end` blocks in braces too
+    rule = make_rule(["ruby"], pattern="items.each do |$X| ... end")
+    requirement = required_words(rule)
+
+    assert requirement == [frozenset(["each"]), frozenset(["items"])]
+    assert satisfies(frozenset(["items", "each"]), requirement)
+    # not keywords in python
+    assert required_words(make_rule(pattern="end.then($X)")) == [
+        frozenset(["end"]),
+        frozenset(["then"]),
+    ]
+
+
+def test_languages_without_keywords():
+    rule = make_rule(["regex"], **{"pattern-regex": "eval"})
+    assert required_words(rule) == []
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_target_words(tmp_path, jobs):
+    targets = []
+    for i in range(3 * MIN_TARGETS_PER_PROCESS):
+        target = tmp_path / f"{i}.py"
+        target.write_text("import Pickle\n" if i % 2 else "pickled = exec_\n")
+        targets.append(target)
+    targets.append(tmp_path / "missing.py")
+
+    words = target_words(frozenset(["pickle", "exec"]), targets, jobs)
+
+    assert words == [
+        *(
+            frozenset(["pickle"]) if i % 2 else frozenset()
+            for i in range(3 * MIN_TARGETS_PER_PROCESS)
+        ),
+        None,
+    ]
+
+
+def test_target_words_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(semgrep.literal_prefilter, "_CHUNK_SIZE", 4)
+    target = tmp_path / "a.py"
+    target.write_text("x = PICKLE.loads(y) # exec_immediately\n")
+
+    words = target_words(frozenset(["pickle", "loads", "exec", "y"]), [target], 1)
+
+    assert words == [frozenset(["pickle", "loads", "y"])]
@@ -0,0 +1,101 @@
+import pytest
+
+import semgrep.metavariable_comparison
+from semgrep.metavariable_comparison import compile_comparison
+from semgrep.metavariable_comparison import metavariable_comparison
+from semgrep.metavariable_comparison import metavariable_comparisons
+
+
+@pytest.mark.parametrize(
+    "comparison,content,expected",
+    [
+        ("$X > 50 and $X < 150", 100, True),
+        ("$X > 50 and $X < 150", 200, False),
+        ("$X > 0o600", 0o700, True),
+        ("$X > 1.5", 2.5, True),
+        # no implicit conversion between ints and floats
+        ("$X > 1", 2.5, False),
+        ("$X == 1", 1.0, False),
+        ("$X == 1", 1, True),
+        ("$X != 1", 2, True),
+        ("$X in [1, 2, 3]", 2, True),
+        ("$X not in [1, 2, 3]", 2, False),
+        ("$X + 1 == 5", 4, True),
+        ("-$X * 2 == -8", 4, True),
+        # integer division and modulo round towards zero
+        ("$X / 2 == -3", -7, True),
+        ("$X % 2 == -1", -7, True),
+        ("$X / 0 == 1", 7, False),
+        ("not ($X < 10)", 10, True),
+        ("$X < 10 or $X > 20 or $X == 15", 15, True),
+        ("$X", 0, False),
+        ("$X", 3, True),
+        ("$Y > 1", 3, False),
+        ("int($X) > 1", "3", True),
+        ("int($X) > 1", "x", False),
+        ("str($X) == '42'", 42, True),
+        ("re.match(str($X), '12')", 123, True),
+        ("re.match(str($X), '$X')", 123, False),
+    ],
+)
+def test_metavariable_comparison(comparison, content, expected):
+    assert compile_comparison(comparison) is not None
+    assert metavariable_comparison("$X", comparison, content) is expected
+
+
+@pytest.mark.parametrize(
+    "comparison", ["$X ** 2 > 4", "$X.foo", "foo($X)", "$X >", "(1, 2)"]
+)
+def test_unsupported_comparison(comparison):
+    assert compile_comparison(comparison) is None
+
+
+def test_core_comparisons_batched(monkeypatch):
+    calls = []
+
+    def core_comparisons(metavariable, comparison, contents):
+        calls.append(contents)
+        return [content > 2 for content in contents]
+
+    monkeypatch.setattr(
+        semgrep.metavariable_comparison,
+        "_core_metavariable_comparisons",
+        core_comparisons,
+    )
+    comparison = "$X ** 2 > 4"
+    assert metavariable_comparisons("$X", comparison, [1, 3, 1, 2.5]) == [
+        False,
+        True,
+        False,
+        True,
+    ]
+    assert metavariable_comparisons("$X", comparison, [3, 4, 1.0]) == [
+        True,
+        True,
+        False,
+    ]
+    assert calls == [[1, 3, 2.5], [4, 1.0]]
+
+
+def test_core_results_bounded(monkeypatch):
+    monkeypatch.setattr(semgrep.metavariable_comparison, "_MAX_CORE_RESULTS", 4)
+    monkeypatch.setattr(semgrep.metavariable_comparison, "_core_results", {})
+    monkeypatch.setattr(
+        semgrep.metavariable_comparison,
+        "_core_metavariable_comparisons",
+        lambda metavariable, comparison, contents: [
+            content > 2 for content in contents
+        ],
+    )
+    comparison = "$X ** 2 > 4"
+    assert metavariable_comparisons("$X", comparison, [1, 2, 3]) == [
+        False,
+        False,
+        True,
+    ]
+    assert metavariable_comparisons("$X", comparison, [1, 4, 5]) == [
+        False,
+        True,
+        True,
+    ]
+    assert len(semgrep.metavariable_comparison._core_results) <= 4
@@ -0,0 +1,75 @@
+import os
+import time
+
+import pytest
+
+from semgrep.error import SemgrepError
+from semgrep.parsing_cache import ParsingCache
+
+
+def write_cache_file(path, size, last_use):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    os.utime(path, (last_use, last_use))
+
+
+def test_evict_least_recently_used(tmp_path):
+    write_cache_file(tmp_path / "1.0" / "a.ast_cache", 10, 100)
+    write_cache_file(tmp_path / "1.0" / "b.ast_cache", 10, 300)
+    write_cache_file(tmp_path / "0.9" / "c.ast_cache", 10, 200)
+    write_cache_file(tmp_path / "0.9" / "d.ast_cache", 10, 50)
+
+    ParsingCache(tmp_path, max_size=20).evict()
+
+    assert sorted(p.name for p in tmp_path.glob("*/*")) == [
+        "b.ast_cache",
+        "c.ast_cache",
+    ]
+
+
+def test_evict_removes_empty_version_dirs(tmp_path):
+    write_cache_file(tmp_path / "1.0" / "a.ast_cache", 10, 200)
+    write_cache_file(tmp_path / "0.9" / "b.ast_cache", 10, 100)
+
+    ParsingCache(tmp_path, max_size=10).evict()
+
+    assert [p.name for p in tmp_path.iterdir()] == ["1.0"]
+
+
+def test_evict_ignores_other_files(tmp_path):
+    write_cache_file(tmp_path / "1.0" / "a.ast_cache", 10, 200)
+    write_cache_file(tmp_path / "1.0" / "notes.txt", 10, 100)
+
+    ParsingCache(tmp_path, max_size=0).evict()
+
+    assert [p.name for p in tmp_path.glob("*/*")] == ["notes.txt"]
+
+
+def test_evict_only_stale_tmp_files(tmp_path):
+    write_cache_file(tmp_path / "1.0" / "a.ast_cache", 10, 200)
+    write_cache_file(tmp_path / "1.0" / "b.ast_cache.123.tmp", 10, 100)
+    # still being written by a concurrent run
+    write_cache_file(tmp_path / "1.0" / "c.ast_cache.456.tmp", 10, time.time())
+
+    ParsingCache(tmp_path, max_size=0).evict()
+
+    assert [p.name for p in tmp_path.glob("*/*")] == ["c.ast_cache.456.tmp"]
+
+
+def test_clear(tmp_path):
+    write_cache_file(tmp_path / "1.0" / "a.ast_cache", 10, 100)
+    write_cache_file(tmp_path / "1.0" / "b.ast_cache.123.tmp", 10, 100)
+
+    ParsingCache(tmp_path).clear()
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_clear_refuses_other_directories(tmp_path):
+    write_cache_file(tmp_path / "1.0" / "a.ast_cache", 10, 100)
+    write_cache_file(tmp_path / "src" / "main.py", 10, 100)
+
+    with pytest.raises(SemgrepError):
+        ParsingCache(tmp_path).clear()
+
+    assert (tmp_path / "1.0" / "a.ast_cache").exists()
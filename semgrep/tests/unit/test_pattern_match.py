@@ -0,0 +1,71 @@
+import tracemalloc
+from pathlib import Path
+
+from semgrep.pattern_match import PatternMatch
+
+
+def make_pattern_match(check_id, start, end, metavars):
+    return PatternMatch(
+        {
+            "check_id": check_id,
+            "path": "src/a.py",
+            "start": {"line": 1, "col": start + 1, "offset": start},
+            "end": {"line": 1, "col": end + 1, "offset": end},
+            "extra": {"message": "", "metavars": metavars},
+        }
+    )
+
+
+def test_parsed_fields():
+    metavars = {
+        "$Y": {"unique_id": {"type": "id", "sid": 2}},
+        "$X": {"unique_id": {"type": "AST", "md5sum": "abc"}},
+    }
+    pattern_match = make_pattern_match("3.pattern-inside.1", 4, 10, metavars)
+
+    assert pattern_match.rule_index == 3
+    assert pattern_match.id == "pattern-inside.1"
+    assert pattern_match.path == Path("src/a.py")
+    assert pattern_match.start == {"line": 1, "col": 5}
+    assert pattern_match.metavariable_uids == {"$Y": 2, "$X": "abc"}
+    assert (pattern_match.range.start, pattern_match.range.end) == (4, 10)
+    assert pattern_match.to_json()["check_id"] == "3.pattern-inside.1"
+    assert PatternMatch(pattern_match.to_json()).range == pattern_match.range
+
+
+def test_shared_path():
+    first = make_pattern_match("0.a", 0, 1, {})
+    second = make_pattern_match("0.b", 2, 3, {})
+    assert first.path is second.path
+
+
+def test_whole_rule_check_id():
+    pattern_match = make_pattern_match("python.lang.eqeq", 0, 1, {})
+    assert pattern_match.id == "python.lang.eqeq"
+    assert pattern_match.to_json()["check_id"] == "python.lang.eqeq"
+
+
+def test_memory_per_match():
+    raw_jsons = [
+        {
+            "check_id": "0.a",
+            "path": "src/a.py",
+            "start": {"line": 1, "col": 1, "offset": i},
+            "end": {"line": 1, "col": 2, "offset": i + 1},
+            "extra": {"message": "", "metavars": {}},
+        }
+        for i in range(1000)
+    ]
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        pattern_matches = [PatternMatch(raw_json) for raw_json in raw_jsons]
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+    # the parsed fields take about 190 bytes, and the top-level dict of the
+    # JSON output is not kept; copying the fields next to it took about 490
+    assert len(pattern_matches) == 1000
+    assert (after - before) / len(pattern_matches) < 250
@@ -0,0 +1,32 @@
+import random
+
+from semgrep.range_index import RangeIndex
+from semgrep.semgrep_types import Range
+
+
+def test_same_as_scanning():
+    rng = random.Random(0)
+    ranges = []
+    for _ in range(200):
+        start = rng.randint(0, 100)
+        ranges.append(Range(start, start + rng.randint(0, 20), {}))
+    index = RangeIndex(ranges)
+
+    for start in range(0, 110, 3):
+        for end in range(start, start + 25, 4):
+            query = Range(start, end, {})
+            assert index.enclosing(query) == [
+                r for r in ranges if r.is_range_enclosing_or_eq(query)
+            ]
+            assert index.enclosed(query) == [
+                r for r in ranges if query.is_range_enclosing_or_eq(r)
+            ]
+            assert index.equal(query) == [
+                r for r in ranges if (r.start, r.end) == (start, end)
+            ]
+
+
+def test_empty():
+    index = RangeIndex([])
+    assert index.enclosing(Range(0, 1, {})) == []
+    assert index.enclosed(Range(0, 1, {})) == []
@@ -0,0 +1,78 @@
+import re
+
+import pytest
+
+from semgrep.error import SemgrepError
+from semgrep.regex_scanner import MIN_TARGETS_PER_PROCESS
+from semgrep.regex_scanner import RegexScanner
+from semgrep.regex_scanner import scan_targets
+
+
+def test_positions(tmp_path):
+    target = tmp_path / "a.txt"
+    target.write_text("foo\nbar foo\n\nfoo")
+    scanner = RegexScanner(["foo", "o\n", "unused"])
+
+    assert scanner.scan(target, [0, 1]) == [
+        (0, 0, 1, 1, 3, 1, 4),
+        (0, 8, 2, 5, 11, 2, 8),
+        (0, 13, 4, 1, 16, 4, 4),
+        (1, 2, 1, 3, 4, 2, 1),
+        (1, 10, 2, 7, 12, 3, 1),
+    ]
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [
+        "fóo\nbar foo\n",
+        "foo\r\nbar foo\r\n",
+        "foo\x1cbar foo\n",
+    ],
+)
+def test_same_as_str_regexes(tmp_path, contents):
+    target = tmp_path / "a.txt"
+    target.write_bytes(contents.encode("utf-8"))
+    text = target.read_text()
+    patterns = [r"\w+\s", r"o$", r"(?m)o$", r"ó", r"[^a-z\n]"]
+    scanner = RegexScanner(patterns)
+
+    for index, pattern in enumerate(patterns):
+        assert [(match[1], match[4]) for match in scanner.scan(target, [index])] == [
+            match.span() for match in re.finditer(pattern, text)
+        ]
+
+
+def test_binary_and_empty_files(tmp_path):
+    binary = tmp_path / "a.bin"
+    binary.write_bytes(b"foo\xff\xfe")
+    empty = tmp_path / "empty.txt"
+    empty.write_bytes(b"")
+    scanner = RegexScanner(["foo", ".*"])
+
+    assert scanner.scan(binary, [0]) == []
+    assert scanner.scan(empty, [1]) == [(1, 0, 1, 1, 0, 1, 1)]
+
+
+def test_invalid_regex():
+    with pytest.raises(SemgrepError):
+        RegexScanner(["("])
+    with pytest.raises(SemgrepError):
+        scan_targets(["("], [], jobs=2)
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_scan_targets(tmp_path, jobs):
+    targets = []
+    for i in range(3 * MIN_TARGETS_PER_PROCESS):
+        target = tmp_path / f"{i}.txt"
+        target.write_text(f"foo {i}\nbar\n")
+        targets.append((target, [0, 1] if i % 2 else [1]))
+
+    matches = scan_targets(["foo", "bar"], targets, jobs)
+
+    assert matches == [
+        (i, *match)
+        for i, (target, indices) in enumerate(targets)
+        for match in RegexScanner(["foo", "bar"]).scan(target, indices)
+    ]
@@ -0,0 +1,149 @@
+import json
+
+from semgrep.error import LexicalError
+from semgrep.pattern_match import PatternMatch
+from semgrep.result_cache import ResultCache
+from semgrep.rule import Rule
+from semgrep.rule_match import RuleMatch
+
+SETTINGS = {"semgrep": "1.0"}
+
+
+def make_rule(pattern="$X == $X"):
+    return Rule.from_json(
+        {
+            "id": "eqeq",
+            "pattern": pattern,
+            "severity": "INFO",
+            "languages": ["python"],
+            "message": "useless comparison",
+        }
+    )
+
+
+def make_rule_match(rule, path):
+    pattern_match = PatternMatch(
+        {
+            "check_id": "0.eqeq",
+            "path": str(path),
+            "start": {"line": 1, "col": 1, "offset": 0},
+            "end": {"line": 1, "col": 7, "offset": 6},
+            "extra": {"message": "", "metavars": {}},
+        }
+    )
+    return RuleMatch.from_pattern_match(
+        rule.id,
+        pattern_match,
+        message=rule.message,
+        metadata=rule.metadata,
+        severity=rule.severity,
+        fix=None,
+        fix_regex=None,
+    )
+
+
+def run(cache_path, rule, targets, run_rule, settings=SETTINGS):
+    """
+    Run RUN_RULE on the targets that are not cached, return the merged results
+    and the targets that were run
+    """
+    cache = ResultCache(cache_path, settings)
+    to_run = cache.filter_targets(rule, targets)
+    rule_matches, errors = run_rule(cache, to_run)
+    results = cache.merge({rule: rule_matches}, errors, set(to_run))
+    cache.save()
+    return results, to_run
+
+
+def test_reuse_unchanged_files(tmp_path):
+    cache_path = tmp_path / "cache.json"
+    a = tmp_path / "a.py"
+    b = tmp_path / "b.py"
+    a.write_text("1 == 1\n")
+    b.write_text("x = 1\n")
+    rule = make_rule()
+
+    def run_rule(cache, targets):
+        return [make_rule_match(rule, t) for t in targets if t == a], []
+
+    (findings, _, all_targets), to_run = run(cache_path, rule, [a, b], run_rule)
+    assert to_run == [a, b]
+    assert [rm.path for rm in findings[rule]] == [a]
+
+    (cached_findings, _, all_targets), to_run = run(cache_path, rule, [a, b], run_rule)
+    assert to_run == []
+    assert all_targets == {a, b}
+    assert [rm.to_json() for rm in cached_findings[rule]] == [
+        rm.to_json() for rm in findings[rule]
+    ]
+
+    b.write_text("2 == 2\n")
+    _, to_run = run(cache_path, rule, [a, b], run_rule)
+    assert to_run == [b]
+
+
+def test_rerun_changed_rules(tmp_path):
+    cache_path = tmp_path / "cache.json"
+    a = tmp_path / "a.py"
+    a.write_text("1 == 1\n")
+
+    def run_rule(cache, targets):
+        return [], []
+
+    run(cache_path, make_rule(), [a], run_rule)
+    _, to_run = run(cache_path, make_rule(), [a], run_rule)
+    assert to_run == []
+    _, to_run = run(cache_path, make_rule("$X != $X"), [a], run_rule)
+    assert to_run == [a]
+    _, to_run = run(cache_path, make_rule(), [a], run_rule, settings={"semgrep": "2"})
+    assert to_run == [a]
+
+
+def test_reuse_errors(tmp_path):
+    cache_path = tmp_path / "cache.json"
+    a = tmp_path / "a.py"
+    a.write_text("1 == \n")
+    rule = make_rule()
+    error_json = {
+        "check_id": "LexicalError",
+        "path": str(a),
+        "start": {"line": 1, "col": 1},
+        "end": {"line": 1, "col": 2},
+        "extra": {"message": "", "line": ""},
+    }
+
+    def run_rule(cache, targets):
+        for target in targets:
+            cache.add_core_error(rule, error_json, "python")
+        return [], [LexicalError(a, rule.id)] if targets else []
+
+    run(cache_path, rule, [a], run_rule)
+    (_, errors, _), to_run = run(cache_path, rule, [a], run_rule)
+    assert to_run == []
+    assert errors == [LexicalError(a, rule.id)]
+
+
+def test_only_entries_with_results(tmp_path):
+    cache_path = tmp_path / "cache.json"
+    a = tmp_path / "a.py"
+    b = tmp_path / "b.py"
+    a.write_text("1 == 1\n")
+    b.write_text("x = 1\n")
+    rules = [make_rule(), make_rule("$X != $X")]
+
+    cache = ResultCache(cache_path, SETTINGS)
+    for rule in rules:
+        cache.filter_targets(rule, [a, b])
+    cache.merge({rules[0]: [make_rule_match(rules[0], a)]}, [], {a, b})
+    cache.save()
+
+    saved = json.loads(cache_path.read_text())
+    # each file hash is saved once, and rules without results have no entries
+    assert sorted(saved["files"]) == [str(a), str(b)]
+    assert sorted(len(entries) for entries in saved["rules"].values()) == [0, 1]
+
+    cache = ResultCache(cache_path, SETTINGS)
+    assert [cache.filter_targets(rule, [a, b]) for rule in rules] == [[], []]
+    findings, _, _ = cache.merge({}, [], set())
+    assert [rm.path for rm in findings[rules[0]]] == [a]
+    assert findings[rules[1]] == []
@@ -0,0 +1,39 @@
+import mmap
+
+import pytest
+
+from semgrep.source_cache import SourceCache
+
+
+@pytest.mark.parametrize("mmap_min_size", [1, 1 << 20])
+def test_read_byte_offsets(tmp_path, mmap_min_size):
+    path = tmp_path / "a.py"
+    contents = "s = 'héllo'\r\nfoo(bar)\n"
+    path.write_bytes(contents.encode("utf-8"))
+    cache = SourceCache(mmap_min_size=mmap_min_size)
+
+    start = contents.encode("utf-8").index(b"bar")
+    assert cache.read(path, start, start + 3) == "bar"
+    assert cache.lines(path, 1, 2) == ["foo(bar)\n"]
+    assert cache.read_text(path) == "s = 'héllo'\nfoo(bar)\n"
+    # only files of at least mmap_min_size bytes are mapped
+    is_mapped = isinstance(cache._sources[path].data, mmap.mmap)
+    assert is_mapped == (mmap_min_size == 1)
+
+
+def test_evict_least_recently_used(tmp_path):
+    paths = [tmp_path / name for name in ["a", "b", "c"]]
+    for path in paths:
+        path.write_text("x" * 10)
+    cache = SourceCache(max_size=20)
+
+    for path in paths:
+        cache.read(path, 0, 1)
+    paths[1].write_text("y" * 10)
+    paths[2].write_text("z" * 10)
+
+    # a was evicted and is read again, c is still cached
+    assert cache.read(paths[0], 0, 1) == "x"
+    assert cache.read(paths[2], 0, 1) == "x"
+    cache.invalidate(paths[2])
+    assert cache.read(paths[2], 0, 1) == "z"
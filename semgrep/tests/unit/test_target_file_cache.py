@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from semgrep.target_file_cache import TargetFileCache
+
+
+def test_one_file_per_target_list(tmp_path):
+    cache = TargetFileCache(tmp_path)
+    a, b = Path("src/a.py"), Path("src/b.py")
+
+    path = cache.path((a, b))
+    assert Path(path).read_text() == "src/a.py\nsrc/b.py"
+    assert cache.path([a, b]) == path
+    assert cache.path([b]) != path
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # named after the content, so another cache reuses the same files
+    assert TargetFileCache(tmp_path).path([a, b]) == path
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_pruned_targets(tmp_path):
+    cache = TargetFileCache(tmp_path)
+    a, b = Path("src/a.py"), Path("src/b.py")
+
+    path = cache.path([a, b], frozenset([a]))
+    assert Path(path).read_text() == "src/b.py"
+    assert cache.path([a, b], {a}) == path
+    # the same list of targets is written to the same file
+    assert cache.path([b]) == path
+    assert cache.path([a, b]) != path
+    assert len(list(tmp_path.iterdir())) == 2
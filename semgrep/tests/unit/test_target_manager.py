@@ -1,7 +1,12 @@
+import os
 import subprocess
 from pathlib import Path
+from typing import Dict
+from typing import List
 from typing import Set
+from typing import Tuple
 
+import semgrep.target_manager
 from semgrep.constants import OutputFormat
 from semgrep.output import OutputHandler
 from semgrep.output import OutputSettings
@@ -408,7 +413,7 @@ def test_ignore_git_dir(tmp_path, monkeypatch):
         output_per_line_max_chars_limit=None,
     )
     defaulthandler = OutputHandler(output_settings)
-    assert [] == TargetManager([], [], [foo], True, defaulthandler, False).get_files(
+    assert () == TargetManager([], [], [foo], True, defaulthandler, False).get_files(
         language, [], []
     )
 
@@ -464,7 +469,7 @@ def test_explicit_path(tmp_path, monkeypatch):
         TargetManager([], [], ["foo/a.go"], False, defaulthandler, False).get_files(
             python_language, [], []
         )
-        == []
+        == ()
     )
 
     # Should include explicitly passed file with unknown extension if skip_unknown_extensions=False
@@ -496,3 +501,177 @@ def test_explicit_path(tmp_path, monkeypatch):
         ),
         {foo_a},
     )
+
+
+def test_baseline_ref(tmp_path, monkeypatch):
+    """
+    Only files added or modified since the baseline ref are targets, and
+    changed lines are those added or modified since then, or next to deleted
+    lines, wherever semgrep is run from. Untracked files are entirely changed.
+    """
+    foo = tmp_path / "foo.py"
+    bar = tmp_path / "bar.py"
+    baz = tmp_path / "baz.py"
+    qux = tmp_path / "qux.py"
+    foo.write_text("a = 1\nb = 2\nc = 3\n")
+    bar.write_text("d = 4\ng = 7\n")
+
+    monkeypatch.chdir(tmp_path)
+    for var in ["GIT_AUTHOR", "GIT_COMMITTER"]:
+        monkeypatch.setenv(f"{var}_NAME", "semgrep")
+        monkeypatch.setenv(f"{var}_EMAIL", "semgrep@example.com")
+    subprocess.run(["git", "init"])
+    subprocess.run(["git", "add", foo, bar])
+    subprocess.run(["git", "commit", "-m", "first commit"])
+
+    # the added "++ b" line looks like a file header in the diff
+    foo.write_text("a = 1\n++ b\nc = 3\ne = 5\n")
+    bar.write_text("d = 4\n")
+    baz.write_text("f = 6\n")
+    subprocess.run(["git", "add", baz])
+    qux.write_text("h = 8\ni = 9\n")
+
+    output_settings = OutputSettings(
+        output_format=OutputFormat.TEXT,
+        output_destination=None,
+        error_on_findings=False,
+        verbose_errors=False,
+        strict=False,
+        json_stats=False,
+        output_time=False,
+        output_per_finding_max_lines_limit=None,
+        output_per_line_max_chars_limit=None,
+    )
+    defaulthandler = OutputHandler(output_settings)
+    target_manager = TargetManager(
+        [], [], ["."], True, defaulthandler, False, baseline_ref="HEAD"
+    )
+
+    assert cmp_path_sets(
+        set(target_manager.get_files(Language("python"), [], [])),
+        {Path("foo.py"), Path("bar.py"), Path("baz.py"), Path("qux.py")},
+    )
+    assert not target_manager.in_changed_lines(Path("foo.py"), 1, 1)
+    assert target_manager.in_changed_lines(Path("foo.py"), 1, 2)
+    assert not target_manager.in_changed_lines(Path("foo.py"), 3, 3)
+    assert target_manager.in_changed_lines(Path("foo.py"), 4, 4)
+    assert target_manager.in_changed_lines(Path("baz.py"), 1, 1)
+    assert target_manager.in_changed_lines(Path("bar.py"), 1, 1)
+    assert target_manager.in_changed_lines(Path("qux.py"), 2, 2)
+
+    # paths are relative to the repository, not to the current directory
+    (tmp_path / "sub").mkdir()
+    monkeypatch.chdir(tmp_path / "sub")
+    target_manager = TargetManager(
+        [], [], [str(tmp_path)], True, defaulthandler, False, baseline_ref="HEAD"
+    )
+    assert cmp_path_sets(
+        set(target_manager.get_files(Language("python"), [], [])),
+        {foo, bar, baz, qux},
+    )
+    assert target_manager.in_changed_lines(foo, 4, 4)
+    assert not target_manager.in_changed_lines(foo, 3, 3)
+
+
+def test_git_ls_files_once_per_dir(tmp_path, monkeypatch):
+    """
+    git is called once per directory, whatever the number of languages
+    """
+    foo = tmp_path / "foo"
+    foo.mkdir()
+    (foo / "a.py").touch()
+    (foo / "b.js").touch()
+    (foo / "c.ts").touch()
+
+    monkeypatch.chdir(tmp_path)
+    subprocess.run(["git", "init"])
+    subprocess.run(["git", "add", foo / "a.py"])
+
+    git_calls = []
+    sub_check_output = semgrep.target_manager.sub_check_output
+
+    def count_calls(cmd, **kwargs):
+        git_calls.append(cmd)
+        return sub_check_output(cmd, **kwargs)
+
+    monkeypatch.setattr(semgrep.target_manager, "sub_check_output", count_calls)
+
+    files_cache: Dict[Tuple[Path, bool], Dict[str, List[Path]]] = {}
+    for language, expected in [
+        ("python", {foo / "a.py"}),
+        ("javascript", {foo / "b.js"}),
+        ("typescript", {foo / "c.ts"}),
+    ]:
+        assert cmp_path_sets(
+            TargetManager.expand_targets([foo], Language(language), True, files_cache),
+            expected,
+        )
+    assert len(git_calls) == 1
+
+
+def test_walk_prunes_excluded_dirs(tmp_path, monkeypatch):
+    """
+    Without git, excluded directories are never listed
+    """
+    foo = tmp_path / "foo"
+    (foo / "node_modules" / "lib").mkdir(parents=True)
+    (foo / "node_modules" / "lib" / "a.js").touch()
+    (foo / "src").mkdir()
+    (foo / "src" / "b.js").touch()
+    (foo / "src" / "c.py").touch()
+
+    monkeypatch.chdir(tmp_path)
+    listed = []
+    scandir = os.scandir
+
+    def record_scandir(path):
+        listed.append(Path(path).name)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", record_scandir)
+
+    files_cache: Dict[Tuple[Path, bool], Dict[str, List[Path]]] = {}
+    assert cmp_path_sets(
+        TargetManager.expand_targets(
+            [foo], Language("js"), False, files_cache, ["node_modules"]
+        ),
+        {foo / "src" / "b.js"},
+    )
+    assert cmp_path_sets(
+        TargetManager.expand_targets(
+            [foo], Language("python"), False, files_cache, ["node_modules"]
+        ),
+        {foo / "src" / "c.py"},
+    )
+    assert sorted(listed) == ["foo", "src"]
+
+
+def test_get_files_shared_between_rules(tmp_path, monkeypatch):
+    foo = tmp_path / "foo"
+    foo.mkdir()
+    (foo / "a.py").touch()
+    (foo / "test_a.py").touch()
+
+    monkeypatch.chdir(tmp_path)
+    output_settings = OutputSettings(
+        output_format=OutputFormat.TEXT,
+        output_destination=None,
+        error_on_findings=False,
+        verbose_errors=False,
+        strict=False,
+        json_stats=False,
+        output_time=False,
+        output_per_finding_max_lines_limit=None,
+        output_per_line_max_chars_limit=None,
+    )
+    target_manager = TargetManager(
+        [], [], ["."], False, OutputHandler(output_settings), False
+    )
+    python_language = Language("python")
+
+    files = target_manager.get_files(python_language, ["*.py"], ["test_*", "bar"])
+    assert cmp_path_sets(set(files), {foo / "a.py"})
+    assert files is target_manager.get_files(
+        python_language, ["*.py"], ["bar", "test_*"]
+    )
+    assert files is not target_manager.get_files(python_language, ["*.py"], [])